@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Admission control for the PawfectMatch AI services
+Per-route concurrency limits and priority classes, shedding queued requests with 503 + Retry-After under overload
+"""
+
+import os
+import re
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional, Sequence
+
+from fastapi.responses import JSONResponse
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first; exempt routes (probes, metrics, admin) bypass admission entirely
+INTERACTIVE = "interactive"
+BATCH = "batch"
+BACKGROUND = "background"
+EXEMPT = "exempt"
+PRIORITIES = (INTERACTIVE, BATCH, BACKGROUND)
+
+DEFAULT_MAX_WAIT_MS = {INTERACTIVE: 1000.0, BATCH: 5000.0, BACKGROUND: 15000.0}
+
+QUEUE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ADMISSION_REQUESTS = REGISTRY.counter("admission_requests_total", "Admission decisions by route and result",
+                                      ("route", "result"))
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge("admission_queue_depth", "Requests waiting for admission by priority",
+                                       ("priority",))
+ADMISSION_IN_FLIGHT = REGISTRY.gauge("admission_in_flight", "Admitted requests being served by route", ("route",))
+ADMISSION_QUEUE_TIME = REGISTRY.histogram("admission_queue_seconds", "Time spent waiting for admission by priority",
+                                          ("priority",), buckets=QUEUE_BUCKETS)
+
+
+class RoutePolicy:
+    """
+    A route group: its priority class and how many of its requests may run at once (0: no route limit).
+
+    path is a route template as declared on the app ({param} matches one
+    segment); a trailing "*" matches any suffix.
+    """
+
+    __slots__ = ("name", "priority", "limit", "methods", "path", "_pattern")
+
+    def __init__(self, name: str, priority: str, methods: Sequence[str], path: str, limit: int = 0):
+        if priority not in PRIORITIES and priority != EXEMPT:
+            raise ValueError(f"{name}: unknown priority class {priority!r}")
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.methods = frozenset(methods)
+        self.path = path
+        prefix = path.endswith("*")
+        pattern = re.sub(r"\\\{[^/]+?\\\}", "[^/]+", re.escape(path.rstrip("*")))
+        self._pattern = re.compile(pattern + ("" if prefix else "$"))
+
+    def matches(self, method: str, path: str) -> bool:
+        return (not self.methods or method in self.methods) and self._pattern.match(path) is not None
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("policy", "future", "enqueued")
+
+    def __init__(self, policy: RoutePolicy, future: asyncio.Future):
+        self.policy = policy
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+def parse_settings(setting: str) -> Dict[str, float]:
+    """'generate_bios=2,cohort_update=4' -> {name: value}"""
+    values = {}
+    for item in setting.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            values[name.strip()] = float(value)
+    return values
+
+
+class AdmissionController:
+    """
+    Bounds concurrent requests per worker and decides who runs next.
+
+    At most `capacity` requests run at once, and each route group at most
+    its policy's limit. Requests that cannot start queue in their priority
+    class; a freed slot goes to the oldest waiter of the highest class whose
+    route group has room, so a spike of batch work delays interactive
+    requests by one slot at most.
+
+    Shedding is based on time spent queued, not queue length alone: a
+    waiter not admitted within its class's max wait gets a 503, and while
+    the last admitted request of a class waited longer than that, new
+    arrivals of the class are shed immediately instead of queueing for a
+    slot they would not get in time. max_queue is a hard bound per class.
+    Retry-After is the class's recent queueing delay, rounded up.
+    """
+
+    def __init__(self, policies: Sequence[RoutePolicy], capacity: int = 64, default_priority: str = INTERACTIVE,
+                 max_wait_ms: Optional[Dict[str, float]] = None, max_queue: int = 256):
+        self.policies = list(policies)
+        self.capacity = capacity
+        self.default = RoutePolicy("default", default_priority, (), "/*")
+        self.max_wait = {priority: ms / 1000 for priority, ms in {**DEFAULT_MAX_WAIT_MS, **(max_wait_ms or {})}.items()}
+        self.max_queue = max_queue
+        self._active = 0
+        self._route_active: Dict[str, int] = {}
+        self._queues: Dict[str, Deque[_Waiter]] = {priority: deque() for priority in PRIORITIES}
+        self._delay: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+
+    @classmethod
+    def from_env(cls, policies: Sequence[RoutePolicy]) -> "AdmissionController":
+        """ADMISSION_CAPACITY (0 disables), ADMISSION_LIMITS, ADMISSION_MAX_WAIT_MS and ADMISSION_MAX_QUEUE"""
+        limits = parse_settings(os.getenv("ADMISSION_LIMITS", ""))
+        for policy in policies:
+            if policy.name in limits:
+                policy.limit = int(limits[policy.name])
+        return cls(policies, capacity=int(os.getenv("ADMISSION_CAPACITY", 64)),
+                   max_wait_ms=parse_settings(os.getenv("ADMISSION_MAX_WAIT_MS", "")),
+                   max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 256)))
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def classify(self, method: str, path: str) -> RoutePolicy:
+        for policy in self.policies:
+            if policy.matches(method, path):
+                return policy
+        return self.default
+
+    def _has_room(self, policy: RoutePolicy) -> bool:
+        return self._active < self.capacity and (not policy.limit or self._route_active.get(policy.name, 0) < policy.limit)
+
+    def _start(self, policy: RoutePolicy) -> None:
+        self._active += 1
+        self._route_active[policy.name] = self._route_active.get(policy.name, 0) + 1
+        ADMISSION_IN_FLIGHT.inc(policy.name)
+
+    def _runnable_waiter(self, up_to: str) -> bool:
+        """Whether a waiter at or above priority up_to could start now (it goes first)"""
+        for priority in PRIORITIES:
+            if any(self._has_room(waiter.policy) for waiter in self._queues[priority]):
+                return True
+            if priority == up_to:
+                return False
+        return False
+
+    def retry_after(self, priority: str) -> int:
+        return max(1, math.ceil(max(self._delay[priority], self.max_wait[priority])))
+
+    async def acquire(self, policy: RoutePolicy) -> None:
+        """Wait for a slot; raises Overloaded when the request is shed"""
+        if self._has_room(policy) and not self._runnable_waiter(policy.priority):
+            self._start(policy)
+            ADMISSION_QUEUE_TIME.observe(0.0, policy.priority)
+            return
+        queue = self._queues[policy.priority]
+        if len(queue) >= self.max_queue:
+            raise Overloaded("queue_full", self.retry_after(policy.priority))
+        if queue and self._delay[policy.priority] > self.max_wait[policy.priority]:
+            raise Overloaded("queue_delay", self.retry_after(policy.priority))
+
+        waiter = _Waiter(policy, asyncio.get_running_loop().create_future())
+        queue.append(waiter)
+        ADMISSION_QUEUE_DEPTH.inc(policy.priority)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait[policy.priority])
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                self._dequeue(waiter)
+                self._delay[policy.priority] = time.monotonic() - waiter.enqueued
+                raise Overloaded("queue_timeout", self.retry_after(policy.priority))
+        except asyncio.CancelledError:
+            # Client went away while queued; hand on a slot it was granted meanwhile
+            if waiter.future.done():
+                self.release(policy)
+            else:
+                self._dequeue(waiter)
+            raise
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        self._queues[waiter.policy.priority].remove(waiter)
+        ADMISSION_QUEUE_DEPTH.dec(waiter.policy.priority)
+
+    def release(self, policy: RoutePolicy) -> None:
+        self._active -= 1
+        self._route_active[policy.name] -= 1
+        ADMISSION_IN_FLIGHT.dec(policy.name)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Start the oldest waiters of the highest classes that have room, while slots are free"""
+        now = time.monotonic()
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            for waiter in list(queue):
+                if self._active >= self.capacity:
+                    return
+                if not self._has_room(waiter.policy):
+                    continue
+                queue.remove(waiter)
+                ADMISSION_QUEUE_DEPTH.dec(priority)
+                waited = now - waiter.enqueued
+                self._delay[priority] = waited
+                ADMISSION_QUEUE_TIME.observe(waited, priority)
+                self._start(waiter.policy)
+                waiter.future.set_result(None)
+        # Nothing queued in a class means no standing delay there
+        for priority in PRIORITIES:
+            if not self._queues[priority]:
+                self._delay[priority] = 0.0
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "capacity": self.capacity,
+            "active": self._active,
+            "routes": {name: count for name, count in self._route_active.items() if count},
+            "queued": {priority: len(queue) for priority, queue in self._queues.items()},
+            "queue_delay_ms": {priority: round(delay * 1000, 1) for priority, delay in self._delay.items()},
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware running every HTTP request through an AdmissionController.
+
+    The slot is held until the response has been sent, so streamed
+    responses count against their route for their whole duration.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.controller.enabled:
+            await self.app(scope, receive, send)
+            return
+        policy = self.controller.classify(scope["method"], scope["path"])
+        if policy.priority == EXEMPT:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.controller.acquire(policy)
+        except Overloaded as e:
+            ADMISSION_REQUESTS.inc(policy.name, e.reason)
+            response = JSONResponse(status_code=503, content={"detail": "Service overloaded, retry later"},
+                                    headers={"Retry-After": str(e.retry_after)})
+            await response(scope, receive, send)
+            return
+        ADMISSION_REQUESTS.inc(policy.name, "admitted")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(policy)
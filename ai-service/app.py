@@ -8,21 +8,25 @@ Includes basic matching, DeepSeek integration, caching, and learning capabilitie
 import os
 import json
 import asyncio
-import aiohttp
 import logging
-from typing import List, Dict, Any, Optional, Tuple
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File
+from typing import Annotated, List, Dict, Any, Optional, Tuple
+from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-import uvicorn
 from datetime import datetime, timedelta
-import hashlib
-from functools import lru_cache
-import numpy as np
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
+import heapq
+import time
+from lazy_imports import lazy_import
+import fast_json
+from fast_json import FastJSONResponse, RawJSONResponse
+from response_cache import VARY_HEADERS, ResponseCache, read_json, validate_body, request_body_openapi
+from cache_codec import CacheCodec
+from catalog import CATALOG_SYNCS, PetCatalog, CatalogConflict
+from admission import AdmissionController, AdmissionMiddleware, RoutePolicy, BATCH, BACKGROUND, EXEMPT
+
+# Only needed for DeepSeek calls; deferred so it stays off the cold-start path
+aiohttp = lazy_import("aiohttp")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -32,9 +36,22 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Consolidated PawfectMatch AI Service",
     description="Production-ready AI service with advanced pet matching, DeepSeek integration, caching, and learning",
-    version="3.0.0"
+    version="3.0.0",
+    default_response_class=FastJSONResponse
 )
 
+# Admission control (ADMISSION_CAPACITY, ADMISSION_LIMITS, ADMISSION_MAX_WAIT_MS, ADMISSION_MAX_QUEUE); unlisted
+# routes are interactive. Added first, so shed responses still get CORS headers.
+admission = AdmissionController.from_env([
+    RoutePolicy("probes", EXEMPT, ("GET",), "/health"),
+    RoutePolicy("probes", EXEMPT, ("GET",), "/ready"),
+    RoutePolicy("recommendations", BATCH, ("POST",), "/get-recommendations", limit=8),
+    RoutePolicy("recommendations_stream", BATCH, ("POST",), "/get-recommendations/stream", limit=4),
+    RoutePolicy("feedback", BACKGROUND, ("POST",), "/learn-from-feedback", limit=4),
+    RoutePolicy("catalog_sync", BATCH, ("POST",), "/catalog/sync", limit=1),
+])
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -49,26 +66,69 @@ DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "sk-53af1f0560c54499aa5d6d39b02
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-
-# Initialize Redis for caching (optional)
+# A cache that is down at startup is retried with exponential backoff up to this many seconds apart
+REDIS_RECONNECT_MAX_DELAY = float(os.getenv("REDIS_RECONNECT_MAX_DELAY", 60))
+# Streaming recommendations: longest accepted NDJSON line and largest top-k a client may ask for
+STREAM_MAX_LINE_BYTES = int(os.getenv("STREAM_MAX_LINE_BYTES", 64 * 1024))
+STREAM_MAX_LIMIT = int(os.getenv("STREAM_MAX_LIMIT", 1000))
+PERSONALITY_TAGS_MAX = int(os.getenv("PERSONALITY_TAGS_MAX", 32))  # per pet
+PERSONALITY_TAG_MAX_LENGTH = 64
+# Cached response bodies: codec (gzip is sent as-is to clients that accept it) and size below which they stay raw
+RESPONSE_CACHE_CODEC = os.getenv("RESPONSE_CACHE_CODEC", "gzip")
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 256))
+# Resident candidate catalog (snapshot/journal directory shared by workers) and sync batches between snapshot rewrites
+CATALOG_PATH = os.getenv("CATALOG_PATH", "./data/recommendation_catalog")
+CATALOG_COMPACT_EVERY = int(os.getenv("CATALOG_COMPACT_EVERY", 1000))
+
+# Redis for caching (optional), connected by the startup hook; an empty REDIS_URL disables it
 redis_client = None
-try:
-    import redis
-    redis_client = redis.from_url(REDIS_URL)
-    logger.info("Redis caching enabled")
-except ImportError:
-    logger.warning("Redis not available, caching disabled")
-except Exception as e:
-    logger.warning(f"Redis connection failed: {e}, caching disabled")
+service_ready = False
+
+def connect_redis() -> bool:
+    """Import redis and verify the connection; runs in an executor during startup and reconnection"""
+    global redis_client
+    try:
+        import redis
+        client = redis.from_url(REDIS_URL, socket_connect_timeout=2)
+        client.ping()
+        redis_client = client
+        logger.info("Redis caching enabled")
+        return True
+    except ImportError:
+        logger.warning("Redis not available, caching disabled")
+    except Exception as e:
+        logger.warning(f"Redis connection failed: {e}, caching disabled")
+    return False
+
+async def reconnect_redis():
+    """Retry a cache that was down at startup, backing off up to REDIS_RECONNECT_MAX_DELAY between attempts"""
+    delay = 1.0
+    while redis_client is None:
+        await asyncio.sleep(delay)
+        if await asyncio.get_event_loop().run_in_executor(None, connect_redis):
+            return
+        delay = min(delay * 2, REDIS_RECONNECT_MAX_DELAY)
+
+@app.on_event("startup")
+async def initialize_dependencies():
+    """Connect the cache after the app is importable so workers boot without waiting on Redis"""
+    global service_ready
+    if redis_client is None and REDIS_URL:
+        if not await asyncio.get_event_loop().run_in_executor(None, connect_redis):
+            app.state.redis_reconnect_task = asyncio.create_task(reconnect_redis())
+    await asyncio.get_event_loop().run_in_executor(None, pet_catalog.refresh)
+    service_ready = True
 
 # Pydantic models
+PersonalityTag = Annotated[str, Field(max_length=PERSONALITY_TAG_MAX_LENGTH)]
+
 class PetProfile(BaseModel):
     id: str
     species: str
     breed: str
     age: int
     size: str
-    personality_tags: List[str]
+    personality_tags: List[PersonalityTag] = Field(..., max_length=PERSONALITY_TAGS_MAX)
     intent: str
     location: Optional[Dict[str, Any]] = None
     owner_id: Optional[str] = None
@@ -81,7 +141,17 @@ class UserProfile(BaseModel):
 
 class RecommendationRequest(BaseModel):
     user_profile: UserProfile
-    candidate_pets: List[PetProfile]
+    # Candidates sent in full, referenced by catalog id, or both
+    candidate_pets: List[PetProfile] = []
+    candidate_ids: List[str] = []
+
+class CatalogSyncRequest(BaseModel):
+    """One batch of catalog changes moving it from base_version to version; replace sends the whole catalog"""
+    base_version: int = Field(..., ge=0)
+    version: int = Field(..., ge=1)
+    upserts: List[PetProfile] = Field(default=[], max_length=5000)
+    deletes: List[str] = Field(default=[], max_length=5000)
+    replace: bool = False
 
 class BioGenerationRequest(BaseModel):
     pet_name: str
@@ -101,7 +171,14 @@ class ChatSuggestionRequest(BaseModel):
     user_id: str
 
 # Utility functions
-@lru_cache(maxsize=1000)
+SIZE_COMPATIBILITY = {
+    ('small', 'small'): 0.15,
+    ('small', 'medium'): 0.1,
+    ('medium', 'medium'): 0.15,
+    ('medium', 'large'): 0.1,
+    ('large', 'large'): 0.15
+}
+
 def calculate_compatibility_score(pet1: Dict[str, Any], pet2: Dict[str, Any]) -> float:
     """Calculate compatibility score between two pets"""
     score = 0.0
@@ -118,15 +195,8 @@ def calculate_compatibility_score(pet1: Dict[str, Any], pet2: Dict[str, Any]) ->
         score += 0.1
 
     # Size compatibility
-    size_compat = {
-        ('small', 'small'): 0.15,
-        ('small', 'medium'): 0.1,
-        ('medium', 'medium'): 0.15,
-        ('medium', 'large'): 0.1,
-        ('large', 'large'): 0.15
-    }
     size_key = (pet1.get('size', ''), pet2.get('size', ''))
-    score += size_compat.get(size_key, 0.05)
+    score += SIZE_COMPATIBILITY.get(size_key, 0.05)
 
     # Personality compatibility
     pet1_tags = set(pet1.get('personality_tags', []))
@@ -173,27 +243,16 @@ async def call_deepseek_api(messages: List[Dict[str, Any]], temperature: float =
         logger.error(f"DeepSeek API call failed: {e}")
         return "I'm sorry, I couldn't process your request right now."
 
-def get_cache_key(endpoint: str, params: Dict[str, Any]) -> str:
-    """Generate cache key for requests"""
-    param_str = json.dumps(params, sort_keys=True)
-    return hashlib.md5(f"{endpoint}:{param_str}".encode()).hexdigest()
-
-def get_cached_response(key: str) -> Optional[str]:
-    """Get cached response"""
-    if redis_client:
-        try:
-            return redis_client.get(key)
-        except:
-            pass
-    return None
-
-def set_cached_response(key: str, value: str, ttl: int = 3600):
-    """Cache response"""
-    if redis_client:
-        try:
-            redis_client.setex(key, ttl, value)
-        except:
-            pass
+# Candidate profiles by id, parsed once when synced rather than on every recommendation request
+pet_catalog = PetCatalog(CATALOG_PATH, lambda pet: pet, compact_every=CATALOG_COMPACT_EVERY)
+
+async def get_catalog() -> PetCatalog:
+    await asyncio.get_event_loop().run_in_executor(None, pet_catalog.refresh)
+    return pet_catalog
+
+# Encoded /generate-bio bodies; hits skip validation, the DeepSeek call and JSON encoding
+response_cache = ResponseCache(lambda: redis_client, "response",
+                               codec=CacheCodec("response", RESPONSE_CACHE_CODEC, CACHE_COMPRESS_MIN_BYTES))
 
 # API Endpoints
 
@@ -207,15 +266,26 @@ async def health_check():
         "features": ["matching", "deepseek", "caching", "learning"]
     }
 
-@app.post("/generate-bio")
-async def generate_pet_bio(request: BioGenerationRequest):
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until startup initialization has finished"""
+    if not service_ready:
+        raise HTTPException(status_code=503, detail="Service is starting")
+    return {"status": "ready", "cache": "enabled" if redis_client else "disabled"}
+
+@app.post("/generate-bio", openapi_extra=request_body_openapi(BioGenerationRequest))
+async def generate_pet_bio(http_request: Request):
     """Generate AI-powered pet bio"""
-    cache_key = get_cache_key("generate_bio", request.dict())
+    data = await read_json(http_request)
+    cache_key = response_cache.key("generate_bio", data)
+
+    # Check cache; hits are the stored response body, sent as-is
+    cached = await response_cache.get(cache_key, "generate_bio")
+    response = response_cache.respond(cached, http_request) if cached else None
+    if response is not None:
+        return response
 
-    # Check cache
-    cached = get_cached_response(cache_key)
-    if cached:
-        return json.loads(cached)
+    request = validate_body(BioGenerationRequest, data)
 
     try:
         messages = [
@@ -237,26 +307,28 @@ async def generate_pet_bio(request: BioGenerationRequest):
             "pet_name": request.pet_name
         }
 
-        # Cache response
-        set_cached_response(cache_key, json.dumps(response))
+        # Serialize once: the same bytes are cached and sent
+        body = fast_json.dumps(response)
+        await response_cache.set(cache_key, body)
 
-        return response
+        return RawJSONResponse(body, headers=VARY_HEADERS)
 
     except Exception as e:
         logger.error(f"Bio generation failed: {e}")
-        raise HTTPException(status_code=500, detail="Bio generation failed")
+        raise HTTPException(status_code=500, detail="Bio generation failed", headers=VARY_HEADERS)
 
 @app.post("/calculate-compatibility")
 async def calculate_compatibility(request: CompatibilityRequest):
     """Calculate compatibility between two pets"""
+    catalog = await get_catalog()
     try:
-        # Mock pet data - in production, fetch from database
-        pet_a = {"id": request.pet_a_id, "species": "dog", "age": 3, "size": "medium", "personality_tags": ["friendly", "playful"]}
-        pet_b = {"id": request.pet_b_id, "species": "dog", "age": 2, "size": "small", "personality_tags": ["calm", "friendly"]}
+        # Pets not synced to the catalog yet keep the placeholder profiles this endpoint has always used
+        pet_a = catalog.get(request.pet_a_id) or {"id": request.pet_a_id, "species": "dog", "age": 3, "size": "medium", "personality_tags": ["friendly", "playful"]}
+        pet_b = catalog.get(request.pet_b_id) or {"id": request.pet_b_id, "species": "dog", "age": 2, "size": "small", "personality_tags": ["calm", "friendly"]}
 
         score = calculate_compatibility_score(pet_a, pet_b)
 
-        return {
+        return FastJSONResponse({
             "compatibility_score": score,
             "recommendation": "Highly compatible!" if score > 0.7 else "Moderately compatible" if score > 0.4 else "May need supervision",
             "factors": {
@@ -265,49 +337,186 @@ async def calculate_compatibility(request: CompatibilityRequest):
                 "size_compatibility": pet_a["size"] == pet_b["size"],
                 "personality_overlap": len(set(pet_a["personality_tags"]) & set(pet_b["personality_tags"]))
             }
-        }
+        })
 
     except Exception as e:
         logger.error(f"Compatibility calculation failed: {e}")
         raise HTTPException(status_code=500, detail="Compatibility calculation failed")
 
+RECOMMENDATION_MIN_SCORE = 0.3  # Only include reasonably compatible pets
+
+def preference_profile(user_profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The pseudo-pet candidates are scored against, built from the user's preferences"""
+    preferences = user_profile.get("preferences") or {}
+    return {
+        "species": preferences.get("preferred_species", "dog"),
+        "age": 3,  # Mock user pet age
+        "size": preferences.get("preferred_size", "medium"),
+        "personality_tags": preferences.get("personality_preferences", [])
+    }
+
+def recommendation(candidate: Dict[str, Any], score: float) -> Dict[str, Any]:
+    return {
+        "pet_id": candidate["id"],
+        "compatibility_score": score,
+        "reasoning": f"High compatibility based on {candidate.get('species')} preferences"
+    }
+
 @app.post("/get-recommendations")
 async def get_recommendations(request: RecommendationRequest):
     """Get personalized pet recommendations"""
+    catalogued, missing = [], []
+    if request.candidate_ids:
+        catalogued, missing = (await get_catalog()).lookup(request.candidate_ids)
     try:
-        recommendations = []
-
-        for candidate in request.candidate_pets:
-            score = calculate_compatibility_score(
-                {
-                    "species": request.user_profile.preferences.get("preferred_species", "dog"),
-                    "age": 3,  # Mock user pet age
-                    "size": request.user_profile.preferences.get("preferred_size", "medium"),
-                    "personality_tags": request.user_profile.preferences.get("personality_preferences", [])
-                },
-                candidate.dict()
-            )
-
-            if score > 0.3:  # Only include reasonably compatible pets
-                recommendations.append({
-                    "pet_id": candidate.id,
-                    "compatibility_score": score,
-                    "reasoning": f"High compatibility based on {candidate.species} preferences"
-                })
-
-        # Sort by compatibility score
-        recommendations.sort(key=lambda x: x["compatibility_score"], reverse=True)
-
-        return {
-            "recommendations": recommendations[:10],  # Top 10
-            "total_candidates": len(request.candidate_pets),
+        reference = preference_profile(request.user_profile.model_dump())
+        scored = []
+        candidates = [candidate.model_dump() for candidate in request.candidate_pets] + catalogued
+        for candidate in candidates:
+            score = calculate_compatibility_score(reference, candidate)
+            if score > RECOMMENDATION_MIN_SCORE:
+                scored.append((score, candidate))
+
+        # Top 10 by score; nlargest is stable, so ties keep request order
+        top = heapq.nlargest(10, scored, key=lambda item: item[0])
+
+        return FastJSONResponse({
+            "recommendations": [recommendation(candidate, score) for score, candidate in top],
+            "total_candidates": len(candidates),
+            "unknown_candidate_ids": missing,
             "generated_at": datetime.now().isoformat()
-        }
+        })
 
     except Exception as e:
         logger.error(f"Recommendation generation failed: {e}")
         raise HTTPException(status_code=500, detail="Recommendation generation failed")
 
+@app.post("/catalog/sync")
+async def sync_catalog(request: CatalogSyncRequest):
+    """Apply a batch of catalog upserts and deletes; 409 with the current version when base_version is stale"""
+    try:
+        result = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: pet_catalog.sync(request.base_version, request.version,
+                                           [pet.model_dump() for pet in request.upserts], request.deletes,
+                                           request.replace)
+        )
+    except CatalogConflict as e:
+        CATALOG_SYNCS.inc("conflict")
+        raise HTTPException(status_code=409, detail={"message": str(e), "version": e.version})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    CATALOG_SYNCS.inc("applied" if result["applied"] else "duplicate")
+    return result
+
+@app.get("/catalog")
+async def catalog_stats():
+    return (await get_catalog()).stats()
+
+class StreamError(ValueError):
+    """Malformed NDJSON stream; reported as a 400 before any results are sent"""
+
+async def ndjson_lines(request: Request, max_line_bytes: int):
+    """Yield non-empty NDJSON lines as the body arrives, holding at most one partial line between chunks"""
+    tail = b""
+    async for chunk in request.stream():
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        if len(tail) > max_line_bytes:
+            raise StreamError(f"NDJSON line exceeds {max_line_bytes} bytes")
+        for line in lines:
+            if len(line) > max_line_bytes:
+                raise StreamError(f"NDJSON line exceeds {max_line_bytes} bytes")
+            if line.strip():
+                yield line
+    if tail.strip():
+        yield tail
+
+class TopK:
+    """Running top-k by score in a bounded min-heap; earlier items win ties, as with a stable sort"""
+
+    def __init__(self, k: int):
+        self.k = k
+        self._pushed = 0
+        self._heap: List[Tuple[float, int, Any]] = []
+
+    def push(self, score: float, item: Any) -> None:
+        self._pushed += 1
+        entry = (score, -self._pushed, item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def ranked(self) -> List[Tuple[float, Any]]:
+        return [(score, item) for score, _, item in sorted(self._heap, reverse=True)]
+
+@app.post("/get-recommendations/stream", openapi_extra={"requestBody": {"required": True, "content": {
+    "application/x-ndjson": {"schema": {"type": "string", "description":
+        'First line: {"user_profile": {...}, "limit": 10, "min_score": 0.3}; then one PetProfile per line'}}}}})
+async def stream_recommendations(http_request: Request):
+    """
+    Recommendations over an NDJSON candidate stream.
+
+    The first line carries user_profile (and optional limit and min_score);
+    every following line is one candidate pet. Candidates are parsed and
+    scored as the body arrives and only the running top-k is kept, so memory
+    stays flat however many candidates are sent. The response is NDJSON: one
+    ranked recommendation per line, then a summary line. Candidate lines that
+    are not valid JSON objects with an id are skipped and counted as rejected.
+    """
+    started = time.perf_counter()
+    lines = ndjson_lines(http_request, STREAM_MAX_LINE_BYTES)
+    try:
+        header = fast_json.loads(await lines.__anext__())
+        if not isinstance(header, dict) or not isinstance(header.get("user_profile"), dict):
+            raise StreamError("First NDJSON line must be an object with user_profile")
+        limit = header.get("limit", 10)
+        min_score = header.get("min_score", RECOMMENDATION_MIN_SCORE)
+        if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= STREAM_MAX_LIMIT:
+            raise StreamError(f"limit must be an integer between 1 and {STREAM_MAX_LIMIT}")
+        if not isinstance(min_score, (int, float)) or isinstance(min_score, bool):
+            raise StreamError("min_score must be a number")
+        if not isinstance(header["user_profile"].get("preferences") or {}, dict):
+            raise StreamError("user_profile.preferences must be an object")
+
+        reference = preference_profile(header["user_profile"])
+        top = TopK(limit)
+        total = rejected = 0
+        async for line in lines:
+            total += 1
+            try:
+                candidate = fast_json.loads(line)
+                if not isinstance(candidate, dict) or not isinstance(candidate.get("id"), str):
+                    raise ValueError("candidate must be an object with a string id")
+                score = calculate_compatibility_score(reference, candidate)
+            except (ValueError, TypeError, AttributeError):
+                rejected += 1
+                continue
+            if score > min_score:
+                top.push(score, candidate)
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="Empty NDJSON stream")
+    except (StreamError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid NDJSON stream: {e}")
+
+    ranked = top.ranked()
+    summary = {
+        "summary": {
+            "total_candidates": total,
+            "rejected": rejected,
+            "returned": len(ranked),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "generated_at": datetime.now().isoformat()
+        }
+    }
+
+    def render():
+        for rank, (score, candidate) in enumerate(ranked, 1):
+            yield fast_json.dumps({"rank": rank, **recommendation(candidate, score)}) + b"\n"
+        yield fast_json.dumps(summary) + b"\n"
+
+    return StreamingResponse(render(), media_type="application/x-ndjson")
+
 @app.post("/chat-suggestions")
 async def get_chat_suggestions(request: ChatSuggestionRequest):
     """Get AI-powered chat suggestions"""
@@ -394,5 +603,6 @@ async def process_feedback_learning(feedback: Dict[str, Any]):
         logger.error(f"Feedback processing failed: {e}")
 
 if __name__ == "__main__":
+    import uvicorn
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
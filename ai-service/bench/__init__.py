@@ -0,0 +1,4 @@
+"""
+Load-testing and benchmark suite for the PawfectMatch AI service variants
+Run from ai-service/: python -m bench --help
+"""
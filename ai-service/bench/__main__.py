@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark the three AI service variants against a stand-in DeepSeek server
+
+Example:
+    python -m bench --variants deepseek_app,simple_app --mode both --duration 10 --output report.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+import urllib.request
+from typing import Any, Dict, List
+
+from bench.loadgen import ProcessStats, run_scenario
+from bench.payloads import app_payloads, deepseek_payloads, payload_pool, simple_payloads
+from bench.serve import VARIANTS
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = {
+    "deepseek_app": deepseek_payloads,
+    "app": app_payloads,
+    "simple_app": simple_payloads,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status < 500:
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Service at {url} did not become ready within {timeout}s")
+
+
+def spawn(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", *args], cwd=SERVICE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="AI service load-testing suite")
+    parser.add_argument("--variants", default=",".join(VARIANTS))
+    parser.add_argument("--endpoints", default="", help="Comma-separated path filter (default: all)")
+    parser.add_argument("--mode", choices=("closed", "open", "both"), default="both")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=50.0, help="Open-loop arrival rate (req/s)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of closed-loop warmup per endpoint")
+    parser.add_argument("--pool-size", type=int, default=100, help="Distinct payloads per endpoint (drives cache hit ratio)")
+    parser.add_argument("--no-cache", action="store_true", help="Run services without the Redis substitute")
+    parser.add_argument("--stub-latency-ms", type=float, default=400.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=150.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--stub-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--stub-replay", help="Serve upstream responses recorded with LLM_BACKEND=record")
+    parser.add_argument("--stub-recorded-latency", action="store_true",
+                        help="With --stub-replay, use each recording's latency instead of --stub-latency-ms")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    return parser.parse_args()
+
+
+async def bench_variant(variant: str, base_url: str, server: ProcessStats, args: argparse.Namespace) -> List[Dict]:
+    modes = ("closed", "open") if args.mode == "both" else (args.mode,)
+    wanted = [e for e in args.endpoints.split(",") if e]
+    results = []
+    for path, factory in ENDPOINTS[variant]().items():
+        if wanted and path not in wanted:
+            continue
+        payloads = payload_pool(factory, args.pool_size, args.seed)
+        if args.warmup:
+            await run_scenario(base_url, "POST", path, payloads, "closed", args.concurrency, args.rate, args.warmup)
+        for mode in modes:
+            summary = await run_scenario(base_url, "POST", path, payloads, mode, args.concurrency, args.rate,
+                                         args.duration, server=server)
+            print(f"{variant:<13} {path:<32} {mode:<6} {summary['throughput_rps']:>9.1f} rps  "
+                  f"p50 {summary['latency_ms']['p50']:>8.1f} ms  p99 {summary['latency_ms']['p99']:>8.1f} ms  "
+                  f"cpu/req {summary.get('server_cpu_ms_per_request', 'n/a')} ms", file=sys.stderr)
+            results.append(summary)
+    return results
+
+
+def main() -> None:
+    args = parse_args()
+    stub_port = free_port()
+    env = dict(os.environ, DEEPSEEK_API_KEY="bench-key", DEEPSEEK_BASE_URL=f"http://127.0.0.1:{stub_port}",
+               PYTHONPATH=SERVICE_DIR)
+    stub = spawn(["bench.stub_deepseek", "--port", str(stub_port), "--latency-ms", str(args.stub_latency_ms),
+                  "--jitter-ms", str(args.stub_jitter_ms), "--error-rate", str(args.stub_error_rate),
+                  "--rate-limit-rate", str(args.stub_rate_limit_rate), "--seed", str(args.seed)]
+                 + (["--replay", os.path.abspath(args.stub_replay)] if args.stub_replay else [])
+                 + (["--recorded-latency"] if args.stub_recorded_latency else []), env)
+    report: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "variants": {},
+    }
+    try:
+        wait_for(f"http://127.0.0.1:{stub_port}/stats")
+        for variant in args.variants.split(","):
+            port = free_port()
+            serve_args = ["bench.serve", variant, "--port", str(port)] + (["--no-cache"] if args.no_cache else [])
+            process = spawn(serve_args, env)
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                wait_for(f"{base_url}/health")
+                server = ProcessStats(process.pid)
+                report["variants"][variant] = {
+                    "startup_memory": server.memory_kb(),
+                    "scenarios": asyncio.run(bench_variant(variant, base_url, server, args)),
+                }
+            finally:
+                stop(process)
+        with urllib.request.urlopen(f"http://127.0.0.1:{stub_port}/stats") as response:
+            report["stub_upstream"] = json.load(response)
+    finally:
+        stop(stub)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+In-memory Redis substitute for benchmarks
+Implements the subset of redis-py the AI services use; thread-safe for run_in_executor callers
+"""
+
+import time
+import fnmatch
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class FakeRedis:
+    def __init__(self, decode_responses: bool = False):
+        self.decode_responses = decode_responses
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._commands = 0
+        self._started = time.time()
+
+    @classmethod
+    def from_url(cls, url: str, decode_responses: bool = False, **kwargs) -> "FakeRedis":
+        return cls(decode_responses=decode_responses)
+
+    def _encode(self, value: Any) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode("utf-8")
+
+    def _decode(self, value: bytes) -> Any:
+        return value.decode("utf-8") if self.decode_responses else value
+
+    def _key(self, key: Any) -> str:
+        return key.decode("utf-8") if isinstance(key, bytes) else str(key)
+
+    def _live(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    def ping(self) -> bool:
+        return True
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            self._commands += 1
+            value = self._live(self._key(key))
+        return None if value is None else self._decode(value)
+
+    def set(self, key: Any, value: Any, ex: Optional[int] = None, nx: bool = False, **kwargs) -> Optional[bool]:
+        with self._lock:
+            self._commands += 1
+            if nx and self._live(self._key(key)) is not None:
+                return None
+            self._data[self._key(key)] = (self._encode(value), time.time() + ex if ex else None)
+        return True
+
+    def setex(self, key: Any, ttl: int, value: Any) -> bool:
+        return self.set(key, value, ex=int(ttl))
+
+    def delete(self, *keys: Any) -> int:
+        with self._lock:
+            self._commands += 1
+            return sum(1 for key in keys if self._data.pop(self._key(key), None) is not None)
+
+    def eval(self, script: str, numkeys: int, *keys_and_args: Any) -> Any:
+        """
+        Only compare-and-swap scripts: if KEYS[1] holds ARGV[1], delete it
+        (lock release) or set it to ARGV[2] with ARGV[3] seconds to live.
+        """
+        if 'redis.call("get", KEYS[1]) == ARGV[1]' not in script:
+            raise NotImplementedError("FakeRedis only evaluates compare-and-swap scripts")
+        key, args = self._key(keys_and_args[0]), keys_and_args[numkeys:]
+        with self._lock:
+            self._commands += 1
+            if self._live(key) != self._encode(args[0]):
+                return 0
+            if 'redis.call("del", KEYS[1])' in script:
+                del self._data[key]
+                return 1
+            if 'redis.call("set", KEYS[1], ARGV[2], "EX", ARGV[3])' in script:
+                self._data[key] = (self._encode(args[1]), time.time() + int(args[2]))
+                return True
+        raise NotImplementedError("FakeRedis only evaluates compare-and-swap scripts")
+
+    def keys(self, pattern: str = "*") -> List[Any]:
+        with self._lock:
+            self._commands += 1
+            matched = [key for key in list(self._data) if fnmatch.fnmatchcase(key, pattern) and self._live(key) is not None]
+        return matched if self.decode_responses else [key.encode("utf-8") for key in matched]
+
+    def ttl(self, key: Any) -> int:
+        with self._lock:
+            entry = self._data.get(self._key(key))
+        if entry is None:
+            return -2
+        return -1 if entry[1] is None else max(0, int(entry[1] - time.time()))
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            used = sum(len(k) + len(v) for k, (v, _) in self._data.items())
+            return {
+                "used_memory": used,
+                "used_memory_human": f"{used / 1024:.1f}K",
+                "connected_clients": 1,
+                "total_commands_processed": self._commands,
+                "total_connections_received": 1,
+                "uptime_in_seconds": int(time.time() - self._started),
+            }
+
+
+class FakePipeline:
+    """Queues commands and runs them in order on execute(), like a redis-py pipeline"""
+
+    def __init__(self, client: FakeRedis):
+        self._client = client
+        self._commands: List[Tuple[Any, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs) -> "FakePipeline":
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self) -> List[Any]:
+        commands, self._commands = self._commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Closed- and open-loop HTTP load generation with latency percentiles and server resource accounting
+"""
+
+import os
+import time
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+@dataclass
+class LoadResult:
+    latencies: List[float] = field(default_factory=list)
+    statuses: Dict[str, int] = field(default_factory=dict)
+    wall_seconds: float = 0.0
+
+    def record(self, status: str, latency: float) -> None:
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        ok = sum(n for status, n in self.statuses.items() if status.startswith("2"))
+        return {
+            "requests": count,
+            "ok": ok,
+            "statuses": dict(sorted(self.statuses.items())),
+            "throughput_rps": round(count / self.wall_seconds, 2) if self.wall_seconds else 0.0,
+            "latency_ms": {
+                f"p{pct}": round(percentile(ordered, pct) * 1000, 2) for pct in (50, 90, 95, 99)
+            } | {"max": round(ordered[-1] * 1000, 2) if ordered else 0.0},
+        }
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, -(-pct * len(sorted_values) // 100) - 1)
+    return sorted_values[int(rank)]
+
+
+class ProcessStats:
+    """CPU time and memory of a server process read from /proc (Linux only; None elsewhere)."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def memory_kb(self) -> Dict[str, Optional[int]]:
+        values: Dict[str, Optional[int]] = {"rss_kb": None, "peak_rss_kb": None}
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        values["rss_kb"] = int(line.split()[1])
+                    elif line.startswith("VmHWM:"):
+                        values["peak_rss_kb"] = int(line.split()[1])
+        except OSError:
+            pass
+        return values
+
+
+async def _send(session: aiohttp.ClientSession, method: str, url: str, payload: Any) -> str:
+    try:
+        async with session.request(method, url, json=payload if method == "POST" else None) as response:
+            await response.read()
+            return str(response.status)
+    except asyncio.TimeoutError:
+        return "timeout"
+    except aiohttp.ClientError as e:
+        return type(e).__name__
+
+
+async def closed_loop(session: aiohttp.ClientSession, method: str, url: str, payloads: Sequence[Any],
+                      concurrency: int, duration: float) -> LoadResult:
+    """Fixed concurrency: each worker sends its next request as soon as the previous one returns."""
+    result = LoadResult()
+    pool = itertools.cycle(payloads)
+    started = time.perf_counter()
+    deadline = started + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            sent = time.perf_counter()
+            status = await _send(session, method, url, next(pool))
+            result.record(status, time.perf_counter() - sent)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.wall_seconds = time.perf_counter() - started
+    return result
+
+
+async def open_loop(session: aiohttp.ClientSession, method: str, url: str, payloads: Sequence[Any],
+                    rate: float, duration: float) -> LoadResult:
+    """
+    Fixed arrival rate independent of response times.
+
+    Latency is measured from each request's scheduled send time, so a stalled
+    server shows up as queueing delay instead of being hidden (no coordinated omission).
+    """
+    result = LoadResult()
+    pool = itertools.cycle(payloads)
+    started = time.perf_counter()
+    tasks = []
+
+    async def fire(scheduled: float, payload: Any):
+        status = await _send(session, method, url, payload)
+        result.record(status, time.perf_counter() - scheduled)
+
+    for i in itertools.count():
+        scheduled = started + i / rate
+        if scheduled >= started + duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(fire(scheduled, next(pool))))
+    await asyncio.gather(*tasks)
+    result.wall_seconds = time.perf_counter() - started
+    return result
+
+
+async def run_scenario(base_url: str, method: str, path: str, payloads: Sequence[Any], mode: str,
+                       concurrency: int, rate: float, duration: float,
+                       server: Optional[ProcessStats] = None, timeout: float = 60.0) -> Dict[str, Any]:
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        cpu_before = server.cpu_seconds() if server else None
+        if mode == "closed":
+            result = await closed_loop(session, method, base_url + path, payloads, concurrency, duration)
+        else:
+            result = await open_loop(session, method, base_url + path, payloads, rate, duration)
+        cpu_after = server.cpu_seconds() if server else None
+
+    summary = {"endpoint": path, "method": method, "mode": mode,
+               "concurrency": concurrency if mode == "closed" else None,
+               "target_rps": rate if mode == "open" else None} | result.summary()
+    if cpu_before is not None and cpu_after is not None and summary["requests"]:
+        summary["server_cpu_ms_per_request"] = round((cpu_after - cpu_before) * 1000 / summary["requests"], 3)
+    if server:
+        summary["server_memory"] = server.memory_kb()
+    return summary
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Realistic request payloads for each AI service variant
+Seeded so every run drives identical traffic
+"""
+
+import random
+from typing import Any, Callable, Dict, List
+
+BREEDS = {
+    "dog": ["golden retriever", "french bulldog", "labrador retriever", "beagle", "border collie", "mixed"],
+    "cat": ["siamese", "persian", "maine coon", "domestic shorthair"],
+}
+SIZES = ["tiny", "small", "medium", "large", "extra-large"]
+TAGS = ["friendly", "playful", "calm", "energetic", "gentle", "curious", "independent", "vocal",
+        "good-with-kids", "good-with-pets", "shy", "loyal", "smart", "cuddly", "adventurous"]
+NAMES = ["Rex", "Luna", "Max", "Bella", "Milo", "Nala", "Charlie", "Coco", "Buddy", "Daisy", "Oscar", "Ziggy"]
+TONES = ["friendly", "playful", "elegant", "adventurous"]
+LENGTHS = ["short", "medium", "long"]
+
+
+def pet_profile(rng: random.Random, pet_id: int) -> Dict[str, Any]:
+    """A PetProfile as deepseek_app expects it, including the fields scoring never reads."""
+    species = rng.choice(list(BREEDS))
+    name = rng.choice(NAMES)
+    return {
+        "id": f"pet-{pet_id}",
+        "name": name,
+        "species": species,
+        "breed": rng.choice(BREEDS[species]),
+        "age": rng.randint(0, 15),
+        "size": rng.choice(SIZES),
+        "personality_tags": rng.sample(TAGS, rng.randint(1, 5)),
+        "photos": [f"https://cdn.example.com/pets/{pet_id}/{i}.jpg" for i in range(rng.randint(1, 6))],
+        "current_bio": f"{name} loves long walks and naps in the sun. " * rng.randint(1, 4),
+        "owner_preferences": {"max_distance_km": rng.randint(5, 50), "intent": rng.choice(["playdate", "adoption"])},
+        "health_info": {"vaccinated": True, "neutered": rng.random() > 0.3, "allergies": []},
+        "location": {"lat": round(rng.uniform(40, 41), 5), "lng": round(rng.uniform(-74, -73), 5)},
+        "activity_level": rng.randint(1, 10),
+        "training_level": rng.randint(1, 10),
+        "socialization": rng.randint(1, 10),
+    }
+
+
+def basic_pet(rng: random.Random, pet_id: int) -> Dict[str, Any]:
+    """The smaller PetProfile used by app.py."""
+    pet = pet_profile(rng, pet_id)
+    return {key: pet[key] for key in ("id", "species", "breed", "age", "size", "personality_tags", "location")} | {
+        "intent": pet["owner_preferences"]["intent"],
+        "owner_id": f"owner-{pet_id}",
+    }
+
+
+PayloadFactory = Callable[[random.Random, int], Any]
+
+
+def deepseek_payloads() -> Dict[str, PayloadFactory]:
+    return {
+        "/api/generate-bio": lambda rng, i: {
+            "pet": pet_profile(rng, i), "tone": rng.choice(TONES), "length": rng.choice(LENGTHS)
+        },
+        "/api/analyze-photo": lambda rng, i: {
+            "photo_url": f"https://cdn.example.com/pets/{i}/0.jpg", "pet_name": rng.choice(NAMES)
+        },
+        "/api/enhanced-compatibility": lambda rng, i: {
+            "pet1": pet_profile(rng, i), "pet2": pet_profile(rng, i + 1), "interaction_type": "playdate"
+        },
+        "/api/calculate-compatibility": lambda rng, i: {
+            "pet1": pet_profile(rng, i), "pet2": pet_profile(rng, i + 1)
+        },
+        "/api/suggest-improvements": lambda rng, i: pet_profile(rng, i),
+    }
+
+
+def app_payloads(candidates: int = 200) -> Dict[str, PayloadFactory]:
+    return {
+        "/generate-bio": lambda rng, i: {
+            "pet_name": rng.choice(NAMES), "breed": rng.choice(BREEDS["dog"]), "age": rng.randint(0, 15),
+            "temperament": rng.sample(TAGS, 3), "special_traits": rng.sample(TAGS, 1)
+        },
+        "/calculate-compatibility": lambda rng, i: {"pet_a_id": f"pet-{i}", "pet_b_id": f"pet-{i + 1}"},
+        "/get-recommendations": lambda rng, i: {
+            "user_profile": {
+                "id": f"user-{i}",
+                "preferences": {"preferred_species": "dog", "preferred_size": rng.choice(SIZES),
+                                "personality_preferences": rng.sample(TAGS, 3)},
+                "location": {"lat": 40.7, "lng": -73.9},
+                "pets": [basic_pet(rng, i)],
+            },
+            "candidate_pets": [basic_pet(rng, i * candidates + n) for n in range(candidates)],
+        },
+        "/chat-suggestions": lambda rng, i: {
+            "match_id": f"match-{i}", "user_id": f"user-{i}",
+            "conversation_history": [{"content": f"My pet {rng.choice(NAMES)} loves the park!"} for _ in range(8)],
+        },
+    }
+
+
+def simple_payloads() -> Dict[str, PayloadFactory]:
+    def simple_pet(rng: random.Random, i: int) -> Dict[str, Any]:
+        pet = pet_profile(rng, i)
+        return {"name": pet["name"], "species": pet["species"], "breed": pet["breed"], "age": pet["age"],
+                "personality": pet["personality_tags"]}
+
+    return {
+        "/generate-bio": simple_pet,
+        "/analyze-photo": lambda rng, i: {"photo_url": f"https://cdn.example.com/pets/{i}/0.jpg"},
+        "/calculate-compatibility": lambda rng, i: {"pet1": simple_pet(rng, i), "pet2": simple_pet(rng, i + 1)},
+    }
+
+
+def payload_pool(factory: PayloadFactory, size: int, seed: int) -> List[Any]:
+    """Pre-build a bounded pool so repeated payloads exercise the caches like real traffic."""
+    rng = random.Random(seed)
+    return [factory(rng, i) for i in range(size)]
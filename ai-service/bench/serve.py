@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Run one AI service variant for benchmarking with an in-memory Redis substitute
+Usage: python -m bench.serve deepseek_app --port 8001 [--no-cache]
+"""
+
+import argparse
+import importlib
+import logging
+import os
+
+from bench.fake_redis import FakeRedis
+
+VARIANTS = ("deepseek_app", "app", "simple_app")
+
+
+def serve(variant: str, host: str, port: int, cache: bool = True) -> None:
+    if variant == "simple_app":
+        import simple_app
+        simple_app.run_server(port)  # stdlib server: no cache, no upstream calls
+        return
+
+    import uvicorn
+    if not cache:
+        os.environ["REDIS_URL"] = ""  # keep the startup hook from connecting to a real Redis
+    module = importlib.import_module(variant)
+    # deepseek_app reads str values, app.py decodes bytes itself
+    module.redis_client = FakeRedis(decode_responses=(variant == "deepseek_app")) if cache else None
+    if variant == "deepseek_app":
+        module.redis_bytes_client = FakeRedis() if cache else None  # completion and encoded-response caches
+    uvicorn.run(module.app, host=host, port=port, log_level="warning", access_log=False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve an AI service variant for load testing")
+    parser.add_argument("variant", choices=VARIANTS)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--no-cache", action="store_true", help="Run without the Redis substitute")
+    args = parser.parse_args()
+    serve(args.variant, args.host, args.port, cache=not args.no_cache)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
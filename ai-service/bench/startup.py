@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: module import time of each AI service variant in fresh interpreters
+Usage: python -m bench.startup [--modules deepseek_app,app] [--runs 10] [--importtime]
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = (
+    "import time, sys; t = time.perf_counter(); import {module}; "
+    "sys.stdout.write(repr(time.perf_counter() - t) + ' ' + repr(len(sys.modules)))"
+)
+
+
+def measure(module: str, runs: int) -> Dict:
+    timings: List[float] = []
+    modules_loaded = 0
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=SERVICE_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        seconds, modules_loaded = output.split()
+        timings.append(float(seconds))
+    return {
+        "module": module,
+        "runs": runs,
+        "import_ms_min": round(min(timings) * 1000, 1),
+        "import_ms_median": round(statistics.median(timings) * 1000, 1),
+        "modules_loaded": int(modules_loaded),
+    }
+
+
+def slowest_imports(module: str, top: int = 15) -> List[Dict]:
+    """Cumulative import cost of each module the service imports directly, from -X importtime."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=SERVICE_DIR,
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, timings = line.split(":", 1)
+        _, cumulative_us, name = timings.split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # Two spaces of indent per nesting level
+        if depth == 1:  # Direct imports of the service module
+            rows.append({"module": name.strip(), "cumulative_ms": round(int(cumulative_us) / 1000, 1)})
+    return sorted(rows, key=lambda r: r["cumulative_ms"], reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="AI service import-time benchmark")
+    parser.add_argument("--modules", default="deepseek_app,app,simple_app")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--importtime", action="store_true", help="Also list the slowest top-level imports")
+    args = parser.parse_args()
+
+    results = []
+    for module in args.modules.split(","):
+        try:
+            result = measure(module, args.runs)
+            if args.importtime:
+                result["slowest_imports"] = slowest_imports(module)
+        except subprocess.CalledProcessError as e:
+            result = {"module": module, "error": e.stderr.strip().splitlines()[-1] if e.stderr else str(e)}
+        results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
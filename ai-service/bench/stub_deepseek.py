@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the DeepSeek chat completions API
+Configurable latency, error and 429 rates so load tests never touch the real upstream; --replay serves responses
+recorded by the service's LLM_BACKEND=record mode
+"""
+
+import json
+import random
+import asyncio
+import argparse
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from itertools import count
+from typing import Optional
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+FILLER = (
+    "This pet shows a warm, curious temperament and settles quickly with gentle handling. "
+    "Daily walks, enrichment toys and consistent routines will keep them happy and balanced. "
+    "They do best with calm introductions in neutral territory and plenty of positive reinforcement. "
+)
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 400.0
+    jitter_ms: float = 150.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    seed: int = 7
+    replay: Optional[str] = None
+    recorded_latency: bool = False
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def json_content(messages: list, text: str) -> str:
+    """JSON mode: one entry per {"id": ...} line of the last message (batched bio prompts), else a wrapper"""
+    ids = []
+    for line in messages[-1].get("content", "").splitlines() if messages else []:
+        if line.startswith('{"id"'):
+            ids.append(json.loads(line)["id"])
+    if not ids:
+        return json.dumps({"text": text})
+    per_item = text[: max(200, len(text) // len(ids))]
+    return json.dumps({item: per_item for item in ids})
+
+
+class Replay:
+    """
+    Recorded exchanges by request key, and by system prompt for requests that were never recorded.
+
+    Synthetic load-test payloads rarely match a recorded prompt exactly; they
+    get the recordings of the same endpoint (same system prompt) in turn.
+    """
+
+    def __init__(self, path: str):
+        from llm_backends import exchange_key, load_recordings  # service module, on PYTHONPATH when benchmarking
+        self.exchange_key = exchange_key
+        self.exact = {}
+        self.similar = defaultdict(list)
+        self.turns = defaultdict(count)
+        for exchange in load_recordings(path):
+            self.exact[exchange["key"]] = exchange
+            self.similar[system_prompt(exchange["messages"])].append(exchange)
+
+    def lookup(self, payload: dict, stats: dict) -> Optional[dict]:
+        messages = payload.get("messages", [])
+        key = self.exchange_key(payload.get("model"), messages, int(payload.get("max_tokens", 500)),
+                                payload.get("response_format"))
+        if key in self.exact:
+            stats["replay_exact"] += 1
+            return self.exact[key]
+        candidates = self.similar.get(system_prompt(messages))
+        if candidates:
+            stats["replay_similar"] += 1
+            return candidates[next(self.turns[system_prompt(messages)]) % len(candidates)]
+        stats["replay_miss"] += 1
+        return None
+
+
+def system_prompt(messages: list) -> str:
+    return next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+
+
+def build_app(config: StubConfig) -> web.Application:
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+    replay = None
+    if config.replay:
+        replay = Replay(config.replay)
+        stats.update(replay_exact=0, replay_similar=0, replay_miss=0)
+        logger.info(f"Replaying {len(replay.exact)} recorded exchanges from {config.replay}")
+
+    async def chat_completions(request: web.Request) -> web.Response:
+        stats["requests"] += 1
+        payload = await request.json()
+        recorded = replay.lookup(payload, stats) if replay is not None else None
+        if recorded is not None and config.recorded_latency:
+            latency = recorded["latency_ms"] / 1000
+        else:
+            latency = max(0.0, config.latency_ms + rng.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+        await asyncio.sleep(latency)
+
+        roll = rng.random()
+        if roll < config.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return web.json_response({"error": {"message": "Rate limit reached"}}, status=429)
+        if roll < config.rate_limit_rate + config.error_rate:
+            stats["errors"] += 1
+            return web.json_response({"error": {"message": "Upstream failure"}}, status=500)
+
+        prompt = " ".join(m.get("content", "") for m in payload.get("messages", []))
+        max_tokens = int(payload.get("max_tokens", 500))
+        content = (FILLER * 8)[: max_tokens * 4]
+        if recorded is not None:
+            content = recorded["response"]
+        elif (payload.get("response_format") or {}).get("type") == "json_object":
+            content = json_content(payload.get("messages", []), content)
+        return web.json_response({
+            "id": f"stub-{stats['requests']}",
+            "object": "chat.completion",
+            "model": payload.get("model", "deepseek-chat"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": estimate_tokens(prompt),
+                "completion_tokens": estimate_tokens(content),
+                "total_tokens": estimate_tokens(prompt) + estimate_tokens(content),
+            },
+        })
+
+    async def stub_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/chat/completions", chat_completions)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", stub_stats)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stand-in DeepSeek API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=StubConfig.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=StubConfig.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=StubConfig.rate_limit_rate)
+    parser.add_argument("--seed", type=int, default=StubConfig.seed)
+    parser.add_argument("--replay", help="Answer with responses from an LLM_BACKEND=record file")
+    parser.add_argument("--recorded-latency", action="store_true",
+                        help="With --replay, wait as long as the recorded call took instead of --latency-ms")
+    args = parser.parse_args()
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, args.seed,
+                        args.replay, args.recorded_latency)
+    logger.info(f"Stub DeepSeek listening on {args.host}:{args.port} with {json.dumps(config.__dict__)}")
+    web.run_app(build_app(config), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Compressed cache values for the PawfectMatch AI services
+A versioned envelope around zstd, zlib or gzip payloads, with optional shared dictionaries and a size threshold
+
+Train a dictionary from LLM_BACKEND=record recordings or plain text files:
+    python -m cache_codec train data/llm_recordings.jsonl --output data/cache_dict.bin
+"""
+
+import sys
+import gzip
+import zlib
+import struct
+import logging
+import argparse
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from metrics import REGISTRY
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used when it is missing
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_BYTES = REGISTRY.counter("cache_codec_bytes_total", "Bytes given to and stored by each cache codec",
+                               ("cache", "stage"))
+
+# Envelope: magic, version, codec, dictionary id (0 = none), then the payload. 0xFF never starts UTF-8
+# text or the response cache's one-byte flags, so entries written before the envelope still decode.
+MAGIC = 0xFF
+VERSION = 1
+HEADER = struct.Struct(">BBBI")
+
+RAW = 0
+GZIP = 1  # servable as-is with Content-Encoding: gzip; never uses a dictionary
+ZLIB = 2  # raw deflate, optionally with a preset dictionary
+ZSTD = 3
+
+CODECS = {"none": RAW, "gzip": GZIP, "zlib": ZLIB, "zstd": ZSTD}
+
+# zlib looks back at most 32 KiB, so longer preset dictionaries are wasted
+ZLIB_DICT_LIMIT = 32 * 1024
+
+
+def dictionary_id(data: bytes) -> int:
+    return zlib.crc32(data) or 1
+
+
+def load_dictionaries(paths: str) -> List[bytes]:
+    """Comma-separated dictionary files; the first is used to compress, all of them to decompress"""
+    dictionaries = []
+    for path in filter(None, (p.strip() for p in paths.split(","))):
+        with open(path, "rb") as f:
+            dictionaries.append(f.read())
+    return dictionaries
+
+
+class CacheCodec:
+    """
+    Encodes cache values into a versioned envelope and back.
+
+    Values shorter than min_bytes, or that do not shrink, are stored raw
+    (5 bytes of header). The codec and dictionary used are recorded per
+    entry, so changing CACHE_CODEC or rotating dictionaries never
+    invalidates what is already stored: any entry decodes as long as its
+    dictionary is still listed. Entries without the envelope are returned
+    unchanged. decode() returns None for entries it cannot read (unknown
+    dictionary, zstd not installed, newer version), which callers treat as
+    a miss.
+    """
+
+    def __init__(self, name: str, codec: str = "auto", min_bytes: int = 256, level: Optional[int] = None,
+                 dictionaries: Sequence[bytes] = ()):
+        if codec == "auto":
+            codec = "zstd" if zstandard is not None else "zlib"
+        if codec not in CODECS:
+            raise ValueError(f"Unknown cache codec: {codec!r}")
+        if codec == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed, compressing cache values with zlib")
+            codec = "zlib"
+        self.name = name
+        self.codec = CODECS[codec]
+        self.min_bytes = min_bytes
+        self.level = level
+        self._dictionaries: Dict[int, bytes] = {dictionary_id(d): d for d in dictionaries}
+        # GZIP entries must stay plain gzip for HTTP passthrough
+        self._dictionary_id = dictionary_id(dictionaries[0]) if dictionaries and self.codec in (ZLIB, ZSTD) else 0
+        self._local = threading.local()
+
+    @property
+    def codec_name(self) -> str:
+        return next(name for name, codec in CODECS.items() if codec == self.codec)
+
+    def encode(self, value: Union[str, bytes]) -> bytes:
+        data = value.encode("utf-8") if isinstance(value, str) else value
+        codec, dict_id, payload = RAW, 0, data
+        if self.codec != RAW and len(data) >= self.min_bytes:
+            compressed = self._compress(data)
+            if len(compressed) < len(data):
+                codec, dict_id, payload = self.codec, self._dictionary_id, compressed
+        entry = HEADER.pack(MAGIC, VERSION, codec, dict_id) + payload
+        CODEC_BYTES.inc(self.name, "input", amount=len(data))
+        CODEC_BYTES.inc(self.name, "stored", amount=len(entry))
+        return entry
+
+    def decode(self, entry: Optional[bytes]) -> Optional[bytes]:
+        if not entry:
+            return None
+        codec, dict_id, payload = self.unpack(entry)
+        if codec is None:
+            if entry[0] == MAGIC:  # truncated, or written by a newer version
+                logger.warning(f"Unreadable {self.name} cache entry envelope")
+                return None
+            return entry
+        try:
+            if codec == RAW:
+                return payload
+            if codec == GZIP:
+                return gzip.decompress(payload)
+            dictionary = self._dictionaries.get(dict_id) if dict_id else None
+            if dict_id and dictionary is None:
+                logger.warning(f"{self.name} cache entry uses unknown dictionary {dict_id:08x}")
+                return None
+            if codec == ZLIB:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary[-ZLIB_DICT_LIMIT:]) \
+                    if dictionary else zlib.decompressobj(-zlib.MAX_WBITS)
+                return decompressor.decompress(payload) + decompressor.flush()
+            if codec == ZSTD and zstandard is not None:
+                return self._zstd_decompressor(dict_id, dictionary).decompress(payload)
+        except (OSError, EOFError, zlib.error) as e:
+            logger.warning(f"Undecodable {self.name} cache entry: {e}")
+            return None
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                logger.warning(f"Undecodable {self.name} cache entry: {e}")
+                return None
+            raise
+        return None
+
+    def decode_text(self, entry: Optional[Union[str, bytes]]) -> Optional[str]:
+        if isinstance(entry, str):  # read through a decode_responses client
+            return entry
+        data = self.decode(entry)
+        if data is None:
+            return None
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError as e:
+            logger.warning(f"Undecodable {self.name} cache entry: {e}")
+            return None
+
+    @staticmethod
+    def unpack(entry: bytes) -> Tuple[Optional[int], int, bytes]:
+        """(codec, dictionary id, payload); codec is None for entries without a known envelope"""
+        if len(entry) < HEADER.size or entry[0] != MAGIC:
+            return None, 0, entry
+        magic, version, codec, dict_id = HEADER.unpack_from(entry)
+        if version != VERSION:
+            return None, 0, entry
+        return codec, dict_id, entry[HEADER.size:]
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == GZIP:
+            return gzip.compress(data, compresslevel=self.level or 6)
+        dictionary = self._dictionaries.get(self._dictionary_id)
+        if self.codec == ZLIB:
+            compressor = zlib.compressobj(self.level or 6, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                          zdict=dictionary[-ZLIB_DICT_LIMIT:]) if dictionary \
+                else zlib.compressobj(self.level or 6, zlib.DEFLATED, -zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush()
+        # zstd contexts are reusable but not thread-safe: one per thread
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            kwargs = {"dict_data": zstandard.ZstdCompressionDict(dictionary)} if dictionary else {}
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level or 3,
+                                                                           write_content_size=True, **kwargs)
+        return compressor.compress(data)
+
+    def _zstd_decompressor(self, dict_id: int, dictionary: Optional[bytes]):
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            kwargs = {"dict_data": zstandard.ZstdCompressionDict(dictionary)} if dictionary else {}
+            decompressor = decompressors[dict_id] = zstandard.ZstdDecompressor(**kwargs)
+        return decompressor
+
+    def stats(self) -> Dict[str, object]:
+        given, stored = CODEC_BYTES.value(self.name, "input"), CODEC_BYTES.value(self.name, "stored")
+        return {"codec": self.codec_name, "dictionary": f"{self._dictionary_id:08x}" if self._dictionary_id else None,
+                "min_bytes": self.min_bytes, "ratio": round(stored / given, 3) if given else None}
+
+
+def train_dictionary(samples: Sequence[bytes], size: int = 16 * 1024) -> bytes:
+    """
+    Shared dictionary for compressing many small, similar values.
+
+    With zstandard this is its trainer (COVER). Otherwise, for zlib's
+    preset dictionary, the sentences that recur most across samples are
+    concatenated with the most common last, where deflate reaches them
+    with the shortest distances.
+    """
+    if zstandard is not None and len(samples) >= 8:
+        return zstandard.train_dictionary(size, list(samples)).as_bytes()
+    size = min(size, ZLIB_DICT_LIMIT)
+    counts = Counter()
+    for sample in samples:
+        sentences = {s.strip() for s in sample.replace(b"\n", b". ").split(b". ") if len(s.strip()) > 16}
+        counts.update(sentences)
+    chosen, used = [], 0
+    for sentence, seen in counts.most_common():
+        if seen < 2 or used + len(sentence) + 2 > size:
+            continue
+        chosen.append(sentence)
+        used += len(sentence) + 2
+    return b". ".join(reversed(chosen)) + b". "
+
+
+def read_samples(paths: Iterable[str]) -> List[bytes]:
+    """Responses from LLM recordings (.jsonl), or each other file as one sample"""
+    import json
+    samples = []
+    for path in paths:
+        if path.endswith(".jsonl"):
+            with open(path, "rb") as f:
+                samples.extend(json.loads(line)["response"].encode("utf-8") for line in f if line.strip())
+        else:
+            with open(path, "rb") as f:
+                samples.append(f.read())
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cache codec tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="Train a compression dictionary from cached-value samples")
+    train.add_argument("inputs", nargs="+", help="LLM recordings (.jsonl) or text files")
+    train.add_argument("--output", required=True)
+    train.add_argument("--size", type=int, default=16 * 1024)
+    args = parser.parse_args()
+
+    samples = read_samples(args.inputs)
+    dictionary = train_dictionary(samples, args.size)
+    with open(args.output, "wb") as f:
+        f.write(dictionary)
+    plain = CacheCodec("train", min_bytes=0)
+    trained = CacheCodec("train", min_bytes=0, dictionaries=[dictionary])
+    before = sum(len(plain.encode(s)) for s in samples)
+    after = sum(len(trained.encode(s)) for s in samples)
+    total = sum(len(s) for s in samples) or 1
+    print(f"{len(dictionary)} byte {plain.codec_name} dictionary {dictionary_id(dictionary):08x} from "
+          f"{len(samples)} samples: {before / total:.1%} -> {after / total:.1%} of original size", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
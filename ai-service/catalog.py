@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Resident pet catalog for the PawfectMatch AI services
+Profiles loaded from a local snapshot and kept current by versioned upsert/delete batches, so requests can send ids
+
+Snapshot format (snapshot.ndjson in the catalog directory), e.g. exported from the main database:
+    {"format": 1, "version": 1042, "pets": 2}
+    {"id": "pet-1", "species": "dog", ...}
+    {"id": "pet-2", "species": "cat", ...}
+"""
+
+import os
+import fcntl
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import fast_json
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+SNAPSHOT = "snapshot.ndjson"
+JOURNAL = "journal.ndjson"
+
+CATALOG_LOOKUPS = REGISTRY.counter("catalog_lookups_total", "Catalog lookups of pets referenced by id",
+                                   ("result",))
+# Recorded by the sync endpoints on the event loop; sync() runs in executor threads
+CATALOG_SYNCS = REGISTRY.counter("catalog_syncs_total", "Catalog sync batches by result", ("result",))
+
+
+class CatalogConflict(Exception):
+    """A sync batch does not start at the catalog's version; the producer resends from `version`"""
+
+    def __init__(self, version: int):
+        super().__init__(f"Catalog is at version {version}")
+        self.version = version
+
+
+class PetCatalog:
+    """
+    In-memory pet profiles by id, each encoded once into what the service scores with.
+
+    Like CohortMatrix, state lives in a directory shared by all worker
+    processes: snapshot.ndjson holds the catalog at some version and
+    journal.ndjson the sync batches applied since, one per line. Each
+    worker keeps every pet decoded and encoded in memory; refresh() is a
+    stat when nothing changed and otherwise replays the journal lines other
+    workers appended. Writers serialise on a file lock. After compact_every
+    batches the snapshot is rewritten and the journal emptied.
+
+    Versions come from the producer (e.g. the main database's change
+    sequence). A batch moves the catalog from base_version to version and
+    raises CatalogConflict unless base_version is the current version.
+    Batches at or below the current version are acknowledged without being
+    applied, so retries are idempotent. A replace batch carries the whole
+    catalog and applies at any version but the current one, so it can also
+    move the catalog back, e.g. after the producer restored a backup.
+    """
+
+    def __init__(self, path: str, encode: Callable[[Dict[str, Any]], Any], compact_every: int = 1000):
+        self.path = path
+        self.encode = encode
+        self.compact_every = compact_every
+        self.version = 0
+        self.snapshot_version = 0
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Any] = {}
+        self._snapshot_stamp: Optional[Tuple[int, int]] = None
+        self._journal_offset = 0
+        self._journal_batches = 0
+
+    @property
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.path, SNAPSHOT)
+
+    @property
+    def _journal_path(self) -> str:
+        return os.path.join(self.path, JOURNAL)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, pet_id: str) -> bool:
+        return pet_id in self._entries
+
+    def get(self, pet_id: str) -> Optional[Any]:
+        entry = self._entries.get(pet_id)
+        CATALOG_LOOKUPS.inc("found" if entry is not None else "missing")
+        return entry
+
+    def lookup(self, pet_ids: Iterable[str]) -> Tuple[List[Any], List[str]]:
+        """(entries found, in request order; ids not in the catalog)"""
+        entries, missing = [], []
+        for pet_id in pet_ids:
+            entry = self._entries.get(pet_id)
+            if entry is None:
+                missing.append(pet_id)
+            else:
+                entries.append(entry)
+        CATALOG_LOOKUPS.inc("found", amount=len(entries))
+        CATALOG_LOOKUPS.inc("missing", amount=len(missing))
+        return entries, missing
+
+    # -- persistence -----------------------------------------------------
+
+    def refresh(self) -> None:
+        """Pick up batches and snapshots written by other processes"""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        try:
+            stat = os.stat(self._snapshot_path)
+            snapshot_stamp = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            snapshot_stamp = None
+        try:
+            journal_size = os.stat(self._journal_path).st_size
+        except FileNotFoundError:
+            journal_size = 0
+        if snapshot_stamp != self._snapshot_stamp or journal_size < self._journal_offset:
+            self._load()
+        elif journal_size > self._journal_offset:
+            self._replay()
+
+    def _load(self) -> None:
+        entries, version, stamp = {}, 0, None
+        try:
+            with open(self._snapshot_path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                stamp = (stat.st_ino, stat.st_mtime_ns)
+                header = fast_json.loads(f.readline())
+                if header.get("format") != FORMAT:
+                    raise ValueError(f"Unsupported catalog snapshot format: {header.get('format')!r}")
+                version = header["version"]
+                for line in f:
+                    if line.strip():
+                        pet = fast_json.loads(line)
+                        entries[pet["id"]] = self.encode(pet)
+        except FileNotFoundError:
+            pass
+        self._entries = entries
+        self.version = self.snapshot_version = version
+        self._snapshot_stamp = stamp
+        self._journal_offset = 0
+        self._journal_batches = 0
+        self._replay()
+        logger.info(f"Catalog loaded: {len(self._entries)} pets at version {self.version}")
+
+    def _replay(self) -> None:
+        try:
+            with open(self._journal_path, "rb") as f:
+                f.seek(self._journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A batch still being written has no newline yet; it is read on the next refresh
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                batch = fast_json.loads(line)
+                # Lines at or below the snapshot's version were compacted into it
+                if batch["version"] > self.version:
+                    self._apply(batch)
+                self._journal_batches += 1
+        self._journal_offset += end
+
+    def _apply(self, batch: Dict[str, Any]) -> None:
+        encoded = [(pet["id"], self.encode(pet)) for pet in batch.get("upserts", ())]
+        if batch.get("replace"):
+            self._entries = dict(encoded)
+        else:
+            self._entries.update(encoded)
+            for pet_id in batch.get("deletes", ()):
+                self._entries.pop(pet_id, None)
+        self.version = batch["version"]
+
+    # -- sync --------------------------------------------------------------
+
+    def sync(self, base_version: int, version: int, upserts: Sequence[Dict[str, Any]] = (),
+             deletes: Sequence[str] = (), replace: bool = False) -> Dict[str, Any]:
+        """Apply one producer batch; upserts are validated profile dicts with an "id" """
+        if version <= base_version and not replace:
+            raise ValueError("version must be greater than base_version")
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock, open(os.path.join(self.path, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._refresh()
+            if version == self.version or (version < self.version and not replace):
+                return {"applied": False, "version": self.version, "pets": len(self)}
+            if not replace and base_version != self.version:
+                raise CatalogConflict(self.version)
+            if version < self.version:
+                # Journal lines above the new version must not be replayed onto it by readers of the new snapshot
+                self._truncate_journal()
+
+            batch = {"version": version, "upserts": list(upserts), "deletes": list(deletes)}
+            if replace:
+                batch["replace"] = True
+            self._apply(batch)
+            if replace:
+                self._write_snapshot(fast_json.dumps(pet) for pet in upserts)
+            else:
+                line = fast_json.dumps(batch) + b"\n"
+                with open(self._journal_path, "ab") as f:
+                    f.truncate(self._journal_offset)  # drop a partial line left by a crashed writer
+                    f.write(line)
+                self._journal_offset += len(line)
+                self._journal_batches += 1
+                if self._journal_batches >= self.compact_every:
+                    self._compact()
+            return {"applied": True, "version": self.version, "pets": len(self)}
+
+    def _compact(self) -> None:
+        """Fold the journal into a new snapshot; profiles are re-read from disk, not kept in memory"""
+        profiles: Dict[str, bytes] = {}
+        try:
+            with open(self._snapshot_path, "rb") as f:
+                f.readline()
+                for line in f:
+                    if line.strip():
+                        profiles[fast_json.loads(line)["id"]] = line.rstrip(b"\n")
+        except FileNotFoundError:
+            pass
+        with open(self._journal_path, "rb") as f:
+            data = f.read(self._journal_offset)
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            batch = fast_json.loads(line)
+            if batch["version"] <= self.snapshot_version:
+                continue
+            for pet in batch.get("upserts", ()):
+                profiles[pet["id"]] = fast_json.dumps(pet)
+            for pet_id in batch.get("deletes", ()):
+                profiles.pop(pet_id, None)
+        self._write_snapshot(profiles.values())
+
+    def _write_snapshot(self, lines: Iterable[bytes]) -> None:
+        """Replace the snapshot with the catalog at the current version and empty the journal"""
+        tmp_snapshot = self._snapshot_path + ".tmp"
+        with open(tmp_snapshot, "wb") as f:
+            f.write(fast_json.dumps({"format": FORMAT, "version": self.version, "pets": len(self)}) + b"\n")
+            for line in lines:
+                f.write(line + b"\n")
+        os.replace(tmp_snapshot, self._snapshot_path)
+        # Readers that saw the new snapshot skip the old journal lines by version until it is emptied
+        self._truncate_journal()
+        stat = os.stat(self._snapshot_path)
+        self._snapshot_stamp = (stat.st_ino, stat.st_mtime_ns)
+        self.snapshot_version = self.version
+        self._journal_offset = 0
+        self._journal_batches = 0
+        logger.info(f"Catalog snapshot written: {len(self)} pets at version {self.version}")
+
+    def _truncate_journal(self) -> None:
+        with open(self._journal_path, "wb"):
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"version": self.version, "pets": len(self), "snapshot_version": self.snapshot_version,
+                "journal_batches": self._journal_batches}
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Materialised pairwise compatibility for active pet cohorts
+Quantised scores in a blocked, memory-mapped matrix with incremental row/column updates
+"""
+
+import os
+import re
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import compatibility
+import fast_json
+import incremental
+from compatibility import VOCABULARY, BreedTable, PetRecord, PetTraits
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 64                  # 64 x 64 uint8 tiles are exactly one 4 KiB page
+SCORE_SCALE = 250           # quantisation step of 0.4 percentage points
+EMPTY = 255                 # free slot, or a pet paired with itself
+DEFAULT_CAPACITY = 1024
+ROW_CHUNK = 64              # rows scored per vectorised pass when rebuilding
+COHORT_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def quantize(overall: "np.ndarray") -> "np.ndarray":
+    return np.rint(np.clip(overall, 0.0, 1.0) * SCORE_SCALE).astype(np.uint8)
+
+
+def to_percentage(quantized: "np.ndarray") -> "np.ndarray":
+    """Stored bytes back to compatibility_score units (0-100, one decimal)"""
+    return np.round(quantized.astype(np.float64) * (100.0 / SCORE_SCALE), 1)
+
+
+class CohortMatrix:
+    """
+    Symmetric overall-score matrix for one cohort of pets (e.g. a region).
+
+    Scores are stored as uint8 in BLOCK x BLOCK tiles, so the file has shape
+    (blocks, blocks, BLOCK, BLOCK): a row update and its mirrored column
+    update each touch one page per block instead of one page per pet, and a
+    lookup is a single indexed read. Pets occupy slots; deleted slots are
+    reused and the file doubles when full.
+
+    Like PhotoHashIndex, state lives in a directory shared by all worker
+    processes: the matrix is a memory-mapped file and manifest.json maps
+    slots to pet ids and traits. Writers serialise on a file lock and bump the
+    manifest version; readers re-open when the manifest changes. Score bytes
+    are written in place, so readers see new rows without re-opening.
+    """
+
+    def __init__(self, path: str, breed_table: BreedTable, capacity: int = DEFAULT_CAPACITY,
+                 partial_rows: int = 256):
+        self.path = path
+        self.breed_table = breed_table
+        self.initial_capacity = max(BLOCK, -(-capacity // BLOCK) * BLOCK)
+        self._lock = threading.Lock()
+        self._version = -1
+        self._manifest_mtime = 0.0
+        self._matrix: Optional[np.memmap] = None
+        self._matrix_file: Optional[str] = None
+        self._ids: List[Optional[str]] = []
+        self._records: List[Optional[PetRecord]] = []
+        self._persisted: List[Optional[list]] = []  # manifest form of each record, kept in step with _records
+        self._slots: Dict[str, int] = {}
+        self._features: Optional[Dict[str, Any]] = None
+        # Exact component rows of recently edited pets, for change-aware rescoring
+        self._partials = incremental.PartialScoreCache(partial_rows)
+
+    # -- persistence -----------------------------------------------------
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, "manifest.json")
+
+    @property
+    def capacity(self) -> int:
+        return len(self._ids)
+
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self._manifest_path, "rb") as f:
+                return fast_json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def refresh(self) -> None:
+        """Re-open the manifest (and matrix file) if another process changed them"""
+        try:
+            mtime = os.stat(self._manifest_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+        manifest = self._read_manifest()
+        with self._lock:
+            self._manifest_mtime = mtime
+            if manifest and manifest["version"] != self._version:
+                self._load(manifest)
+
+    def _load(self, manifest: Dict) -> None:
+        capacity = manifest["capacity"]
+        if manifest["matrix"] != self._matrix_file:
+            blocks = capacity // BLOCK
+            self._matrix = np.memmap(os.path.join(self.path, manifest["matrix"]), dtype=np.uint8, mode="r+",
+                                     shape=(blocks, blocks, BLOCK, BLOCK))
+            self._matrix_file = manifest["matrix"]
+        self._ids = manifest["ids"]
+        self._persisted = manifest["traits"]
+        self._records = [
+            PetRecord.from_traits(PetTraits(t[0], t[1], tuple(t[2]), t[3], t[4], t[5])) if t else None
+            for t in self._persisted
+        ]
+        self._slots = {pet_id: slot for slot, pet_id in enumerate(self._ids) if pet_id is not None}
+        self._features = None
+        # Another process changed the cohort; cached component rows may be stale
+        self._partials.clear()
+        self._version = manifest["version"]
+
+    def _write_manifest(self) -> None:
+        manifest = {
+            "version": self._version + 1,
+            "capacity": self.capacity,
+            "matrix": self._matrix_file,
+            "ids": self._ids,
+            "traits": self._persisted,
+        }
+        tmp_manifest = self._manifest_path + ".tmp"
+        with open(tmp_manifest, "wb") as f:
+            f.write(fast_json.dumps(manifest))
+        os.replace(tmp_manifest, self._manifest_path)
+        self._version = manifest["version"]
+        self._manifest_mtime = os.stat(self._manifest_path).st_mtime
+
+    def _allocate(self, capacity: int) -> None:
+        """Create a matrix file of `capacity` slots, carrying over the current scores"""
+        blocks = capacity // BLOCK
+        matrix_file = f"scores-{time.time_ns()}.u8"
+        matrix = np.memmap(os.path.join(self.path, matrix_file), dtype=np.uint8, mode="w+",
+                           shape=(blocks, blocks, BLOCK, BLOCK))
+        matrix[:] = EMPTY
+        if self._matrix is not None:
+            old_blocks = self._matrix.shape[0]
+            matrix[:old_blocks, :old_blocks] = self._matrix
+        matrix.flush()
+        old_file = self._matrix_file
+        self._matrix, self._matrix_file = matrix, matrix_file
+        self._ids = self._ids + [None] * (capacity - len(self._ids))
+        self._records = self._records + [None] * (capacity - len(self._records))
+        self._persisted = self._persisted + [None] * (capacity - len(self._persisted))
+        self._partials.grow(capacity)
+        if old_file:
+            # Processes still mapping the old file keep it alive until they refresh
+            os.unlink(os.path.join(self.path, old_file))
+
+    # -- queries ---------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, pet_id: str) -> bool:
+        return pet_id in self._slots
+
+    def score(self, pet1_id: str, pet2_id: str) -> Optional[float]:
+        """Overall score (0-100) of two cohort members, or None if either is not in the cohort"""
+        self.refresh()
+        slot1, slot2 = self._slots.get(pet1_id), self._slots.get(pet2_id)
+        if slot1 is None or slot2 is None or slot1 == slot2:
+            return None
+        value = self._matrix[slot1 // BLOCK, slot2 // BLOCK, slot1 % BLOCK, slot2 % BLOCK]
+        return None if value == EMPTY else round(int(value) * (100.0 / SCORE_SCALE), 1)
+
+    def row(self, pet_id: str) -> Optional["np.ndarray"]:
+        """Quantised scores of pet_id against every slot (EMPTY for free slots and itself)"""
+        self.refresh()
+        slot = self._slots.get(pet_id)
+        if slot is None:
+            return None
+        return self._matrix[slot // BLOCK, :, slot % BLOCK, :].reshape(-1)
+
+    def top_k(self, pet_id: str, k: int = 10, min_score: float = 0.0) -> Optional[List[Tuple[str, float]]]:
+        """The k best matches for pet_id as (pet_id, score) pairs, best first"""
+        row = self.row(pet_id)
+        if row is None:
+            return None
+        # EMPTY sorts last once the row is viewed as "higher is better" with EMPTY mapped to -1
+        scores = np.where(row == EMPTY, -1, row.astype(np.int16))
+        floor = int(np.ceil(min_score * SCORE_SCALE / 100.0))
+        candidates = np.flatnonzero(scores >= max(floor, 0))
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        # Highest score first; ties broken by slot so results are stable
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        percentages = to_percentage(row[candidates]).tolist()
+        ids = self._ids
+        return [(ids[slot], score) for slot, score in zip(candidates.tolist(), percentages)]
+
+    # -- updates ---------------------------------------------------------
+
+    def upsert(self, pets: Sequence[Tuple[str, PetRecord]]) -> int:
+        """Add or update pets and rescore what their changes affect; returns the cohort size"""
+        if not pets:
+            return len(self)
+        with self._exclusive():
+            self._apply(pets)
+            return len(self)
+
+    def apply_delta(self, pet_id: str, delta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Apply a partial profile update (PetProfile field names) to a member.
+
+        Only the breakdown components that depend on the changed fields are
+        recomputed when the pet's component row is cached. Returns the fields
+        that actually changed and the components recomputed, or None if the
+        pet is not in the cohort.
+        """
+        with self._exclusive():
+            slot = self._slots.get(pet_id)
+            if slot is None:
+                return None
+            delta = dict(delta)
+            for field in ("breed", "size"):
+                if field in delta:
+                    delta[field] = delta[field].lower()
+            if "personality_tags" in delta:
+                delta["personality_tags"] = tuple(delta["personality_tags"])
+            traits = self._records[slot].traits()._replace(**delta)
+            changes = self._apply([(pet_id, PetRecord.from_traits(traits))])
+            fields = changes.get(slot, (set(), frozenset()))
+            return {"changed_fields": sorted(fields[0]), "components": sorted(fields[1])}
+
+    def _apply(self, pets: Sequence[Tuple[str, PetRecord]]) -> Dict[int, Tuple[set, FrozenSet[str]]]:
+        """Store new records and rescore the affected components; caller holds _exclusive()"""
+        new_ids = list(dict.fromkeys(pet_id for pet_id, _ in pets if pet_id not in self._slots))
+        needed = len(self._slots) + len(new_ids)
+        capacity = max(self.capacity, self.initial_capacity)
+        while capacity < needed:
+            capacity *= 2
+        if self._matrix is None or capacity > self.capacity:
+            self._allocate(capacity)
+        free_slots = (slot for slot, pet_id in enumerate(self._ids) if pet_id is None)
+        for pet_id in new_ids:
+            slot = next(free_slots)
+            self._slots[pet_id] = slot
+            self._ids[slot] = pet_id
+        if new_ids:
+            self._features = None
+
+        changes: Dict[int, Tuple[set, FrozenSet[str]]] = {}
+        for pet_id, record in pets:
+            slot = self._slots[pet_id]
+            fields = incremental.changed_fields(self._records[slot], record)
+            self._records[slot] = record
+            self._persisted[slot] = list(record.traits()) if fields else self._persisted[slot]
+            if fields:
+                previous_fields, previous = changes.get(slot, (set(), frozenset()))
+                changes[slot] = (previous_fields | fields, previous | incremental.affected_components(fields))
+        if not changes:
+            return changes
+
+        added = set(new_ids)
+        self._rescore({slot: components for slot, (_, components) in changes.items()},
+                      edited=[slot for slot in changes if self._ids[slot] not in added])
+        self._matrix.flush()
+        self._write_manifest()
+        return changes
+
+    def delete(self, pet_ids: Sequence[str]) -> int:
+        """Remove pets from the cohort; their slots are blanked and reused later"""
+        with self._exclusive():
+            for pet_id in pet_ids:
+                slot = self._slots.pop(pet_id, None)
+                if slot is None:
+                    continue
+                self._ids[slot] = None
+                self._records[slot] = None
+                self._persisted[slot] = None
+                self._partials.discard(slot)
+                self._write_line(slot, np.full(self.capacity, EMPTY, dtype=np.uint8))
+            self._features = None
+            if self._matrix is not None:
+                self._matrix.flush()
+                self._write_manifest()
+            return len(self)
+
+    def rebuild(self) -> int:
+        """Rescore every pair, e.g. after the breed knowledge or scoring weights changed"""
+        with self._exclusive():
+            if self._matrix is not None:
+                self._features = None
+                self._partials.clear()
+                self._rescore({slot: incremental.ALL_COMPONENTS for slot in self._slots.values()})
+                self._matrix.flush()
+                self._write_manifest()
+            return len(self)
+
+    @contextmanager
+    def _exclusive(self):
+        """Thread lock plus cross-process file lock, with the latest manifest loaded on entry"""
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock, open(os.path.join(self.path, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                mtime = os.stat(self._manifest_path).st_mtime
+            except FileNotFoundError:
+                mtime = self._manifest_mtime
+            if mtime != self._manifest_mtime:
+                manifest = self._read_manifest()
+                if manifest["version"] != self._version:
+                    self._load(manifest)
+                self._manifest_mtime = mtime
+            yield
+
+    def _member_features(self, changed: Sequence[int] = ()) -> Tuple["np.ndarray", Dict[str, Any]]:
+        """Encoded features of the current members; edits re-encode only the changed slots"""
+        if self._features is not None and changed and self._features["tag_words"] == VOCABULARY.tag_words:
+            position = self._features["position"]
+            patch = compatibility.encode_pets([self._records[slot] for slot in changed], self.breed_table)
+            rows = np.array([position[slot] for slot in changed], dtype=np.intp)
+            for name, column in patch.items():
+                self._features["pets"][name][rows] = column
+        elif self._features is None or changed:
+            slots = np.array(sorted(self._slots.values()), dtype=np.intp)
+            records = [self._records[slot] for slot in slots.tolist()]
+            self._features = {
+                "slots": slots,
+                "position": {slot: i for i, slot in enumerate(slots.tolist())},
+                "pets": compatibility.encode_pets(records, self.breed_table),
+                "tag_words": VOCABULARY.tag_words,
+            }
+        return self._features["slots"], self._features["pets"]
+
+    def _score_components(self, index1: "np.ndarray", index2: "np.ndarray",
+                          components: Iterable[str]) -> Dict[str, "np.ndarray"]:
+        _, pets = self._member_features()
+        features = compatibility.pair_features(pets, index1, index2, self.breed_table)
+        return compatibility.score_components(features, list(components))
+
+    def _rescore(self, changes: Dict[int, FrozenSet[str]], edited: Sequence[int] = ()) -> None:
+        """
+        Recompute the changed components of each changed slot and write its row and mirrored column.
+
+        Slots with a cached component row recompute only their affected
+        components; the others (new pets, cache misses) get a full row, which
+        is cached for edited pets. Cached rows of other pets then have the
+        changed slots' columns patched, so they stay exact.
+        """
+        member_slots, _ = self._member_features(sorted(changes))
+        position = self._features["position"]
+        members = len(member_slots)
+        everyone = np.arange(members)
+        rows: Dict[int, "np.ndarray"] = {}
+
+        full = []
+        for slot, components in changes.items():
+            row = self._partials.get(slot)
+            if row is None or components == incremental.ALL_COMPONENTS:
+                full.append(slot)
+                continue
+            scores = self._score_components(np.full(members, position[slot], dtype=np.intp), everyone, components)
+            for name, values in scores.items():
+                row[incremental.COMPONENT_INDEX[name], member_slots] = values
+            rows[slot] = row
+
+        edited = set(edited)
+        for start in range(0, len(full), ROW_CHUNK):
+            chunk = full[start:start + ROW_CHUNK]
+            index1 = np.repeat(np.array([position[slot] for slot in chunk], dtype=np.intp), members)
+            scores = self._score_components(index1, np.tile(everyone, len(chunk)), incremental.COMPONENTS)
+            quantized = quantize(compatibility.combine_components(scores)).reshape(len(chunk), members)
+            for i, slot in enumerate(chunk):
+                self._write_scores(slot, member_slots, quantized[i])
+                if slot in edited:
+                    row = np.full((len(incremental.COMPONENTS), self.capacity), np.nan)
+                    for name, values in scores.items():
+                        row[incremental.COMPONENT_INDEX[name], member_slots] = values[i * members:(i + 1) * members]
+                    self._partials.put(slot, row)
+
+        # Keep every cached row exact: patch the changed slots' columns (rows rescored above included,
+        # since a partial rescore only covered that pet's own changed components). Full rows cached
+        # above are already exact; patching them again is harmless.
+        cached = [slot for slot in self._partials.slots() if slot in position]
+        if cached:
+            components = sorted(frozenset().union(*changes.values()))
+            changed = list(changes)
+            index1 = np.repeat(np.array([position[slot] for slot in cached], dtype=np.intp), len(changed))
+            index2 = np.tile(np.array([position[slot] for slot in changed], dtype=np.intp), len(cached))
+            scores = self._score_components(index1, index2, components)
+            for name, values in scores.items():
+                values = values.reshape(len(cached), len(changed))
+                component = incremental.COMPONENT_INDEX[name]
+                for i, slot in enumerate(cached):
+                    self._partials.get(slot)[component, changed] = values[i]
+
+        for slot, row in rows.items():
+            overall = compatibility.combine_components(
+                {name: row[incremental.COMPONENT_INDEX[name], member_slots] for name in incremental.COMPONENTS}
+            )
+            self._write_scores(slot, member_slots, quantize(overall))
+
+    def _write_scores(self, slot: int, member_slots: "np.ndarray", quantized: "np.ndarray") -> None:
+        line = np.full(self.capacity, EMPTY, dtype=np.uint8)
+        line[member_slots] = quantized
+        line[slot] = EMPTY
+        self._write_line(slot, line)
+
+    def _write_line(self, slot: int, line: "np.ndarray") -> None:
+        tiles = line.reshape(-1, BLOCK)
+        self._matrix[slot // BLOCK, :, slot % BLOCK, :] = tiles
+        self._matrix[:, slot // BLOCK, :, slot % BLOCK] = tiles
+
+
+class CompatibilityMatrixStore:
+    """One CohortMatrix per cohort name, each in its own directory under path"""
+
+    def __init__(self, path: str, breed_knowledge: Dict, capacity: int = DEFAULT_CAPACITY,
+                 partial_rows: int = 256):
+        self.path = path
+        self.capacity = capacity
+        self.partial_rows = partial_rows
+        self.breed_table = BreedTable.from_knowledge(breed_knowledge)
+        self._cohorts: Dict[str, CohortMatrix] = {}
+        self._lock = threading.Lock()
+
+    def cohort(self, name: str) -> CohortMatrix:
+        if not COHORT_NAME.match(name):
+            raise ValueError(f"Invalid cohort name: {name!r}")
+        with self._lock:
+            matrix = self._cohorts.get(name)
+            if matrix is None:
+                matrix = self._cohorts[name] = CohortMatrix(os.path.join(self.path, name), self.breed_table,
+                                                            self.capacity, self.partial_rows)
+        matrix.refresh()
+        return matrix
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+"""
+Pet compatibility scoring for the PawfectMatch AI service
+Per-component scores with a scalar path for single pairs and a vectorised path for batches
+"""
+
+import zlib
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+
+SIZE_ORDER = {"tiny": 1, "small": 2, "medium": 3, "large": 4, "extra-large": 5}
+SIZE_NAMES = {rank: size for size, rank in SIZE_ORDER.items()}
+DEFAULT_SIZE = 3
+DEFAULT_ENERGY = 5
+DEFAULT_BREED_SCORE = 0.6     # at least one breed missing from the knowledge base
+NEUTRAL_PERSONALITY = 0.5     # neither pet has personality tags
+NEUTRAL_ACTIVITY = 0.7        # activity level unknown for either pet
+VECTORIZE_MIN_BATCH = 32      # below this numpy call overhead outweighs the per-pair Python cost
+
+# Summation order matters for bit-identical scalar and vectorised results
+WEIGHTS = {
+    "species_match": 0.25,
+    "breed_compatibility": 0.20,
+    "personality_match": 0.25,
+    "size_compatibility": 0.10,
+    "age_compatibility": 0.10,
+    "activity_match": 0.10
+}
+CROSS_SPECIES_SUITABILITY = {"playdate": 0.2, "mating": 0.0, "cohabitation": 0.3}
+
+# Personality tags are client text: the first TAG_EXACT_BITS distinct tags get their own bit, later ones share
+# TAG_OVERFLOW_BITS hashed bits, so masks never exceed TAG_EXACT_BITS + TAG_OVERFLOW_BITS bits (8 uint64 words)
+TAG_EXACT_BITS = 448
+TAG_OVERFLOW_BITS = 64
+EXACT_TAG_MASK = (1 << TAG_EXACT_BITS) - 1
+OVERFLOW_TAG_PREFIX = "\x00tag-overflow:"  # portable name of an overflow bit, see PetVocabulary.tags_of
+
+
+class PetTraits(NamedTuple):
+    """The profile fields scoring reads as plain values: picklable for worker processes and persistable"""
+    species: str
+    breed: str                      # lower-cased
+    personality_tags: Tuple[str, ...]
+    size: str                       # lower-cased
+    age: int
+    activity_level: Optional[int]
+
+
+def traits_of(pet: Any) -> PetTraits:
+    return PetTraits(pet.species, pet.breed.lower(), tuple(pet.personality_tags), pet.size.lower(),
+                     pet.age, getattr(pet, "activity_level", None))
+
+
+class PetVocabulary:
+    """
+    Interns species, breeds and personality tags to small ints for PetRecord.
+
+    Codes are only meaningful inside the process that assigned them; records
+    crossing a process boundary or going to disk travel as PetTraits. Tag
+    codes are bit positions, so a pet's tags are a single int bitmask.
+    Lookups are lock-free; assigning a new code takes the lock, so records
+    may be built from executor threads.
+
+    The tag table is bounded: once TAG_EXACT_BITS tags are interned, new
+    tags hash into the overflow bits. Rare tags may then collide, which
+    only nudges personality scores; masks and per-batch cost stay bounded
+    however many distinct tags clients send. An overflow bit travels as
+    OVERFLOW_TAG_PREFIX plus its index, which maps back to the same bit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.species: Dict[str, int] = {}
+        self.species_names: List[str] = []
+        self.breeds: Dict[Tuple[str, str], int] = {}
+        self.breed_names: List[Tuple[str, str]] = []
+        self.tags: Dict[str, int] = {}
+        self.tag_names: List[str] = []
+        self._overflow_used = False
+
+    def _intern(self, codes: Dict, names: List, value: Any) -> int:
+        code = codes.get(value)
+        if code is None:
+            with self._lock:
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(names)
+                    names.append(value)
+        return code
+
+    def species_code(self, species: str) -> int:
+        return self._intern(self.species, self.species_names, species)
+
+    def breed_code(self, species: str, breed: str) -> int:
+        return self._intern(self.breeds, self.breed_names, (species, breed))
+
+    def tag_bit(self, tag: str) -> int:
+        bit = self.tags.get(tag)
+        if bit is not None:
+            return bit
+        if tag.startswith(OVERFLOW_TAG_PREFIX) and tag[len(OVERFLOW_TAG_PREFIX):].isdigit():
+            overflow = int(tag[len(OVERFLOW_TAG_PREFIX):]) % TAG_OVERFLOW_BITS
+        else:
+            with self._lock:
+                bit = self.tags.get(tag)
+                if bit is not None:
+                    return bit
+                if len(self.tag_names) < TAG_EXACT_BITS:
+                    bit = self.tags[tag] = len(self.tag_names)
+                    self.tag_names.append(tag)
+                    return bit
+            overflow = zlib.crc32(tag.encode("utf-8")) % TAG_OVERFLOW_BITS
+        self._overflow_used = True
+        return TAG_EXACT_BITS + overflow
+
+    def tag_mask(self, tags: Sequence[str]) -> int:
+        mask = 0
+        for tag in tags:
+            mask |= 1 << self.tag_bit(tag)
+        return mask
+
+    def tags_of(self, mask: int) -> List[str]:
+        names = self.tag_names
+        tags = []
+        while mask:
+            low = mask & -mask
+            bit = low.bit_length() - 1
+            tags.append(names[bit] if bit < TAG_EXACT_BITS else f"{OVERFLOW_TAG_PREFIX}{bit - TAG_EXACT_BITS}")
+            mask ^= low
+        return tags
+
+    @property
+    def tag_words(self) -> int:
+        if self._overflow_used:
+            return (TAG_EXACT_BITS + TAG_OVERFLOW_BITS) // 64
+        return max(1, (len(self.tag_names) + 63) // 64)
+
+
+VOCABULARY = PetVocabulary()
+
+
+class PetRecord:
+    """
+    Compact in-process form of a pet for scoring hot paths.
+
+    Only the scoring features, as small ints: interned species and breed
+    codes, size rank, age, activity level and a personality-tag bitmask.
+    Built once from a PetProfile (or PetTraits); around a hundred bytes per
+    pet against several kilobytes for the validated profile with photos,
+    bios and preference dicts, so whole regional catalogs can stay resident.
+    """
+
+    __slots__ = ("species", "breed", "size", "age", "activity", "tags")
+
+    def __init__(self, species: int, breed: int, size: int, age: int, activity: Optional[int], tags: int):
+        self.species = species
+        self.breed = breed
+        self.size = size
+        self.age = age
+        self.activity = activity
+        self.tags = tags
+
+    @classmethod
+    def from_traits(cls, traits: PetTraits) -> "PetRecord":
+        return cls(VOCABULARY.species_code(traits.species), VOCABULARY.breed_code(traits.species, traits.breed),
+                   SIZE_ORDER.get(traits.size, DEFAULT_SIZE), traits.age, traits.activity_level,
+                   VOCABULARY.tag_mask(traits.personality_tags))
+
+    @classmethod
+    def from_profile(cls, pet: Any) -> "PetRecord":
+        return cls.from_traits(traits_of(pet))
+
+    def traits(self) -> PetTraits:
+        """Portable form for worker processes and persisted state"""
+        species, breed = VOCABULARY.breed_names[self.breed]
+        return PetTraits(species, breed, tuple(VOCABULARY.tags_of(self.tags)), SIZE_NAMES[self.size],
+                         self.age, self.activity)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, PetRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"PetRecord({self.traits()!r})"
+
+
+def breed_profile(pet: PetRecord, breed_knowledge: Dict) -> Dict:
+    species, breed = VOCABULARY.breed_names[pet.breed]
+    return breed_knowledge.get(species, {}).get(breed, {})
+
+
+# -- per-component scores (scalar) ---------------------------------------
+
+def species_score(pet1: PetRecord, pet2: PetRecord) -> float:
+    return 1.0 if pet1.species == pet2.species else 0.0
+
+
+def breed_score(breed1: Dict, breed2: Dict) -> float:
+    """Energy closeness (40%) and temperament Jaccard overlap (60%) of the two breeds"""
+    if not (breed1 and breed2):
+        return DEFAULT_BREED_SCORE
+    energy1 = breed1.get("energy_level", DEFAULT_ENERGY)
+    energy2 = breed2.get("energy_level", DEFAULT_ENERGY)
+    energy_compat = max(0.0, 1.0 - (abs(energy1 - energy2) / 10.0))
+    temp1 = set(breed1.get("temperament", []))
+    temp2 = set(breed2.get("temperament", []))
+    temp_overlap = len(temp1 & temp2) / max(len(temp1 | temp2), 1)
+    return energy_compat * 0.4 + temp_overlap * 0.6
+
+
+def personality_score(pet1: PetRecord, pet2: PetRecord) -> float:
+    total = (pet1.tags | pet2.tags).bit_count()
+    return (pet1.tags & pet2.tags).bit_count() / total if total else NEUTRAL_PERSONALITY
+
+
+def size_score(pet1: PetRecord, pet2: PetRecord) -> float:
+    return max(0.0, 1.0 - (abs(pet1.size - pet2.size) * 0.15))
+
+
+def age_score(pet1: PetRecord, pet2: PetRecord) -> float:
+    return max(0.0, 1.0 - (abs(pet1.age - pet2.age) * 0.1))
+
+
+def activity_score(pet1: PetRecord, pet2: PetRecord) -> float:
+    if pet1.activity is None or pet2.activity is None:
+        return NEUTRAL_ACTIVITY
+    return max(0.0, 1.0 - (abs(pet1.activity - pet2.activity) / 10.0))
+
+
+def component_scores(pet1: PetRecord, pet2: PetRecord, breed1: Dict, breed2: Dict) -> Dict[str, float]:
+    return {
+        "species_match": species_score(pet1, pet2),
+        "breed_compatibility": breed_score(breed1, breed2),
+        "personality_match": personality_score(pet1, pet2),
+        "size_compatibility": size_score(pet1, pet2),
+        "age_compatibility": age_score(pet1, pet2),
+        "activity_match": activity_score(pet1, pet2)
+    }
+
+
+def overall_score(breakdown: Dict[str, float]) -> float:
+    return sum(breakdown[key] * weight for key, weight in WEIGHTS.items())
+
+
+# -- result assembly -----------------------------------------------------
+
+def build_result(pet1: PetRecord, pet2: PetRecord, breakdown: Dict[str, float], breeds_known: bool) -> Dict[str, Any]:
+    """Turn component scores into the enhanced-compatibility payload (insights, recommendations, ...)"""
+    insights = []
+    risk_factors = []
+    same_species = pet1.species == pet2.species
+
+    if same_species:
+        insights.append(f"Both are {VOCABULARY.species_names[pet1.species]}s - excellent species match")
+    else:
+        risk_factors.append("Different species may have communication difficulties")
+
+    if breeds_known:
+        if breakdown["breed_compatibility"] > 0.8:
+            insights.append("Excellent breed compatibility - similar needs and temperaments")
+        elif breakdown["breed_compatibility"] < 0.4:
+            risk_factors.append("Breeds have very different characteristics")
+
+    # Overflow bits may stand for different tags, so only named tags are reported as shared
+    common_traits = VOCABULARY.tags_of(pet1.tags & pet2.tags & EXACT_TAG_MASK)
+    if common_traits:
+        insights.append(f"Share {len(common_traits)} personality traits: {', '.join(common_traits[:3])}")
+
+    overall = overall_score(breakdown)
+    if same_species:
+        interaction_suitability = {
+            "playdate": min(1.0, overall + 0.1),
+            "mating": overall * 0.9,
+            "cohabitation": overall * 0.8
+        }
+    else:
+        interaction_suitability = CROSS_SPECIES_SUITABILITY
+
+    if overall > 0.8:
+        recommendations = [
+            "Excellent compatibility! These pets should get along very well",
+            "Consider arranging a supervised meetup in neutral territory",
+            "Gradual introduction recommended for best results"
+        ]
+    elif overall > 0.6:
+        recommendations = [
+            "Good potential for friendship with proper introduction",
+            "Take introductions slowly with multiple supervised sessions",
+            "Monitor interactions closely during initial meetings"
+        ]
+    else:
+        recommendations = [
+            "Challenging match - extensive supervision required",
+            "Consider if this pairing aligns with your goals",
+            "Professional trainer consultation recommended"
+        ]
+
+    # Confidence grows with the data completeness of the pair
+    data_completeness = sum([
+        1 if pet1.tags and pet2.tags else 0,
+        1 if breeds_known else 0,
+        1 if pet1.activity is not None and pet2.activity is not None else 0
+    ]) / 3.0
+    confidence = min(0.95, 0.7 + (data_completeness * 0.25))
+
+    return {
+        "compatibility_score": round(overall * 100, 1),
+        "confidence": round(confidence, 3),
+        "breakdown": {k: round(v, 3) for k, v in breakdown.items()},
+        "insights": insights,
+        "recommendations": recommendations,
+        "risk_factors": risk_factors,
+        "interaction_suitability": {k: round(v, 3) for k, v in interaction_suitability.items()}
+    }
+
+
+def score_pair(pet1: PetRecord, pet2: PetRecord, breed_knowledge: Dict) -> Dict[str, Any]:
+    breed1, breed2 = breed_profile(pet1, breed_knowledge), breed_profile(pet2, breed_knowledge)
+    breakdown = component_scores(pet1, pet2, breed1, breed2)
+    return build_result(pet1, pet2, breakdown, bool(breed1 and breed2))
+
+
+# -- vectorised batch path -----------------------------------------------
+
+class TagVocabulary:
+    """Assigns bit positions to a fixed set of tags (breed temperaments) for uint64 bitmask words"""
+
+    def __init__(self):
+        self._bits: Dict[str, int] = {}
+
+    def mask(self, tags: Sequence[str]) -> int:
+        mask = 0
+        for tag in tags:
+            bit = self._bits.get(tag)
+            if bit is None:
+                bit = self._bits[tag] = len(self._bits)
+            mask |= 1 << bit
+        return mask
+
+    @property
+    def words(self) -> int:
+        return max(1, (len(self._bits) + 63) // 64)
+
+
+_WORD_MASK = (1 << 64) - 1
+_POPCOUNT_TABLE = None
+
+
+def _to_words(masks: List[int], words: int) -> "np.ndarray":
+    out = np.empty((len(masks), words), dtype=np.uint64)
+    for w in range(words):
+        shift = 64 * w
+        out[:, w] = [(mask >> shift) & _WORD_MASK for mask in masks]
+    return out
+
+
+def _popcount(words: "np.ndarray") -> "np.ndarray":
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0 has a native popcount ufunc
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    global _POPCOUNT_TABLE
+    if _POPCOUNT_TABLE is None:
+        _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    as_bytes = np.ascontiguousarray(words).view(np.uint8).reshape(len(words), -1)
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=1, dtype=np.int64)
+
+
+class BreedTable:
+    """
+    Breed knowledge as arrays for the vectorised path.
+
+    Row i holds the energy level and temperament bitmask words (over a fixed
+    vocabulary) of keys[i]; one trailing sentinel row stands for unknown
+    breeds. The arrays can be memory-mapped so worker processes share them.
+    """
+
+    def __init__(self, keys: List[str], energy: "np.ndarray", temperament: "np.ndarray"):
+        self.keys = keys
+        self.rows = {key: row for row, key in enumerate(keys)}
+        self._breed_rows: List[int] = []  # table row per VOCABULARY breed code, filled on demand
+        self.unknown = len(keys)
+        self.energy = energy
+        self.temperament = temperament
+
+    @staticmethod
+    def key(species: str, breed: str) -> str:
+        return f"{species}/{breed}"
+
+    @classmethod
+    def from_knowledge(cls, breed_knowledge: Dict) -> "BreedTable":
+        keys, energy, masks = [], [], []
+        vocabulary = TagVocabulary()
+        for species, breeds in breed_knowledge.items():
+            for breed, data in breeds.items():
+                if data:  # empty profiles count as unknown, like breed_profile() lookups
+                    keys.append(cls.key(species, breed))
+                    energy.append(data.get("energy_level", DEFAULT_ENERGY))
+                    masks.append(vocabulary.mask(data.get("temperament", ())))
+        energy.append(DEFAULT_ENERGY)
+        masks.append(0)
+        return cls(keys, np.array(energy, dtype=np.float64), _to_words(masks, vocabulary.words))
+
+    def arrays(self) -> Dict[str, "np.ndarray"]:
+        return {"energy": self.energy, "temperament": self.temperament}
+
+    def lookup(self, pets: Sequence[PetRecord]) -> "np.ndarray":
+        breed_rows = self._breed_rows
+        if len(breed_rows) < len(VOCABULARY.breed_names):
+            for species, breed in VOCABULARY.breed_names[len(breed_rows):]:
+                breed_rows.append(self.rows.get(self.key(species, breed), self.unknown))
+        return np.array([breed_rows[pet.breed] for pet in pets], dtype=np.intp)
+
+
+def encode_pets(pets: Sequence[PetRecord], breed_table: BreedTable) -> Dict[str, Any]:
+    """Per-pet feature columns; pairs are scored by gathering two rows of these (see pair_features)"""
+    # One (size, age, activity) row per pet converts to float64 in a single call; NaN = unknown activity
+    numeric = np.array([
+        (pet.size, pet.age, pet.activity if pet.activity is not None else np.nan) for pet in pets
+    ], dtype=np.float64).reshape(len(pets), 3)
+    return {
+        "species": np.array([pet.species for pet in pets], dtype=np.int32),
+        "breed_rows": breed_table.lookup(pets),
+        "numeric": numeric,
+        "tags": _to_words([pet.tags for pet in pets], VOCABULARY.tag_words),
+    }
+
+
+def pair_features(pets: Dict[str, Any], index1: "np.ndarray", index2: "np.ndarray",
+                  breed_table: BreedTable) -> Dict[str, "np.ndarray"]:
+    """Feature columns for the pairs (pets[index1[i]], pets[index2[i]]) as consumed by score_pairs"""
+    rows1, rows2 = pets["breed_rows"][index1], pets["breed_rows"][index2]
+    return {
+        "same_species": pets["species"][index1] == pets["species"][index2],
+        "breeds_known": (rows1 != breed_table.unknown) & (rows2 != breed_table.unknown),
+        "energy1": breed_table.energy[rows1],
+        "energy2": breed_table.energy[rows2],
+        "temp1": breed_table.temperament[rows1],
+        "temp2": breed_table.temperament[rows2],
+        "numeric1": pets["numeric"][index1],
+        "numeric2": pets["numeric"][index2],
+        "tags1": pets["tags"][index1],
+        "tags2": pets["tags"][index2],
+    }
+
+
+def encode_pairs(pairs: Sequence[Tuple[PetRecord, PetRecord]], breed_table: BreedTable) -> Dict[str, "np.ndarray"]:
+    """Feature columns for a batch of pairs"""
+    count = len(pairs)
+    pets = encode_pets([pet1 for pet1, _ in pairs] + [pet2 for _, pet2 in pairs], breed_table)
+    return pair_features(pets, np.arange(count), np.arange(count, 2 * count), breed_table)
+
+
+def _breed_component(features: Dict[str, "np.ndarray"]) -> "np.ndarray":
+    energy_compat = np.maximum(0.0, 1.0 - (np.abs(features["energy1"] - features["energy2"]) / 10.0))
+    temp1, temp2 = features["temp1"], features["temp2"]
+    temp_overlap = _popcount(temp1 & temp2) / np.maximum(_popcount(temp1 | temp2), 1)
+    return np.where(features["breeds_known"], energy_compat * 0.4 + temp_overlap * 0.6, DEFAULT_BREED_SCORE)
+
+
+def _personality_component(features: Dict[str, "np.ndarray"]) -> "np.ndarray":
+    tags1, tags2 = features["tags1"], features["tags2"]
+    tags_inter = _popcount(tags1 & tags2)
+    tags_union = _popcount(tags1 | tags2)
+    return np.where(tags_union > 0, tags_inter / np.maximum(tags_union, 1), NEUTRAL_PERSONALITY)
+
+
+def _activity_component(features: Dict[str, "np.ndarray"]) -> "np.ndarray":
+    activity1, activity2 = features["numeric1"][:, 2], features["numeric2"][:, 2]
+    activity_known = ~(np.isnan(activity1) | np.isnan(activity2))
+    return np.where(
+        activity_known,
+        np.maximum(0.0, 1.0 - (np.abs(activity1 - activity2) / 10.0)),
+        NEUTRAL_ACTIVITY
+    )
+
+
+# Vectorised counterpart of each scalar component function, keyed like WEIGHTS
+COMPONENT_SCORERS = {
+    "species_match": lambda features: np.where(features["same_species"], 1.0, 0.0),
+    "breed_compatibility": _breed_component,
+    "personality_match": _personality_component,
+    "size_compatibility": lambda features: np.maximum(
+        0.0, 1.0 - (np.abs(features["numeric1"][:, 0] - features["numeric2"][:, 0]) * 0.15)),
+    "age_compatibility": lambda features: np.maximum(
+        0.0, 1.0 - (np.abs(features["numeric1"][:, 1] - features["numeric2"][:, 1]) * 0.1)),
+    "activity_match": _activity_component,
+}
+
+
+def score_components(features: Dict[str, Any], components: Sequence[str]) -> Dict[str, "np.ndarray"]:
+    """Only the named components for every pair; see incremental for which inputs each depends on"""
+    return {name: COMPONENT_SCORERS[name](features) for name in components}
+
+
+def combine_components(components: Dict[str, "np.ndarray"]) -> "np.ndarray":
+    """Weighted overall score, summed in WEIGHTS order so results match overall_score exactly"""
+    overall = np.zeros(len(components["species_match"]))
+    for key, weight in WEIGHTS.items():
+        overall = overall + components[key] * weight
+    return overall
+
+
+def score_pairs(features: Dict[str, Any]) -> Dict[str, "np.ndarray"]:
+    """Component and overall scores for every pair in one pass; mirrors the scalar functions exactly"""
+    components = score_components(features, WEIGHTS)
+    components["overall"] = combine_components(components)
+    return components
+
+
+def score_batch(pairs: Sequence[Tuple[PetRecord, PetRecord]], breed_knowledge: Dict,
+                breed_table: Optional[BreedTable] = None) -> List[Dict[str, Any]]:
+    """Score many pairs, vectorised once the batch is large enough; results equal score_pair for each pair"""
+    if len(pairs) < VECTORIZE_MIN_BATCH:
+        return [score_pair(pet1, pet2, breed_knowledge) for pet1, pet2 in pairs]
+    return score_batch_vectorized(pairs, breed_table or BreedTable.from_knowledge(breed_knowledge))
+
+
+def score_batch_vectorized(pairs: Sequence[Tuple[PetRecord, PetRecord]], breed_table: BreedTable) -> List[Dict[str, Any]]:
+    if not pairs:
+        return []
+    features = encode_pairs(pairs, breed_table)
+    scores = score_pairs(features)
+    columns = {key: scores[key].tolist() for key in WEIGHTS}
+    breeds_known = features["breeds_known"].tolist()
+    return [
+        build_result(pet1, pet2, {key: columns[key][i] for key in WEIGHTS}, breeds_known[i])
+        for i, (pet1, pet2) in enumerate(pairs)
+    ]
@@ -7,18 +7,41 @@ Production-ready AI service with advanced pet matching, caching, and learning
 import os
 import json
 import asyncio
-import aiohttp
 import logging
-from typing import List, Dict, Any, Optional, Tuple
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from typing import Annotated, List, Dict, Any, Optional, Tuple
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, PlainTextResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-import uvicorn
 from datetime import datetime, timedelta
 import hashlib
-import redis
+import time
+import functools
+import ipaddress
+from urllib.parse import urljoin, urlsplit
 from functools import lru_cache
-import numpy as np
+from lazy_imports import lazy_import, preload
+import fast_json
+from fast_json import FastJSONResponse, RawJSONResponse
+import compatibility
+from compatibility import PetRecord
+from batching import MicroBatcher
+from worker_pool import ScoringPool, PoolSaturated, pool_size
+from enrichment import EnrichmentQueue, PENDING as ENRICHMENT_PENDING
+import prompts
+from llm_cache import CompletionCache
+from catalog import CATALOG_SYNCS, PetCatalog, CatalogConflict
+from cache_codec import CacheCodec, load_dictionaries
+from llm_backends import (LLM_TOKENS, BACKEND_LATENCY, MOCK_API_KEY, LLMBackend, MockBackend, create_backend,
+                          parse_routes)
+from response_cache import VARY_HEADERS, ResponseCache, read_json, validate_body, request_body_openapi
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware
+from profiler import ServiceProfiler, SlowRequestMiddleware
+from admission import (AdmissionController, AdmissionMiddleware, RoutePolicy, INTERACTIVE, BATCH, BACKGROUND,
+                       EXEMPT)
+
+# Heavy dependencies are loaded on first use (or by the startup warm-up), not at import
+aiohttp = lazy_import("aiohttp")  # also used by the DeepSeek backend and the photo fetcher
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,9 +51,34 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="PawfectMatch AI Service with DeepSeek",
     description="Production-ready AI service with advanced pet matching, caching, and learning",
-    version="2.1.0"
+    version="2.1.0",
+    default_response_class=FastJSONResponse
 )
 
+# Admission control: per-worker concurrency (ADMISSION_CAPACITY, 0 disables), route group limits
+# (ADMISSION_LIMITS="generate_bios=2,..."), max queueing per class (ADMISSION_MAX_WAIT_MS="interactive=1000,...")
+# and ADMISSION_MAX_QUEUE. Unlisted routes are interactive with no route limit. Added first, so innermost:
+# shed responses still get CORS headers and are counted by the metrics middleware.
+admission = AdmissionController.from_env([
+    RoutePolicy("probes", EXEMPT, ("GET",), "/health"),
+    RoutePolicy("probes", EXEMPT, ("GET",), "/ready"),
+    RoutePolicy("probes", EXEMPT, ("GET",), "/metrics"),
+    RoutePolicy("admin", EXEMPT, (), "/api/admin/*"),
+    # Long-lived event streams would hold a slot until the narrative arrives
+    RoutePolicy("enrichment_events", EXEMPT, ("GET",), "/api/enrichment/{token}/events"),
+    RoutePolicy("generate_bios", BATCH, ("POST",), "/api/generate-bios", limit=4),
+    # Membership changes rescore whole matrix rows; pair scores and top matches are reads and stay interactive
+    RoutePolicy("cohort_update", BATCH, ("PUT",), "/api/cohorts/{cohort}/pets", limit=2),
+    RoutePolicy("cohort_update", BATCH, ("PATCH", "DELETE"), "/api/cohorts/{cohort}/pets/{pet_id}", limit=2),
+    RoutePolicy("catalog_sync", BATCH, ("POST",), "/api/catalog/sync", limit=1),
+    RoutePolicy("photo_index_flush", BACKGROUND, ("POST",), "/api/photos/index/flush", limit=1),
+    RoutePolicy("cache_admin", BACKGROUND, (), "/api/cache/*", limit=2),
+    RoutePolicy("prompt_usage", BACKGROUND, ("GET",), "/api/prompts/usage", limit=2),
+    RoutePolicy("compatibility", INTERACTIVE, ("POST",), "/api/enhanced-compatibility", limit=32),
+    RoutePolicy("compatibility", INTERACTIVE, ("POST",), "/api/calculate-compatibility", limit=32),
+])
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -39,22 +87,90 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+# Opt-in sampling profiler (AI_PROFILER_ENABLED=1, AI_ADMIN_TOKEN, AI_SLOW_REQUEST_MS)
+profiler = ServiceProfiler.from_env()
+app.add_middleware(SlowRequestMiddleware, profiler=profiler)
 
 # Configuration
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "sk-53af1f0560c54499aa5d6d39b02dd109")
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# A cache that is down at startup is retried with exponential backoff up to this many seconds apart
+REDIS_RECONNECT_MAX_DELAY = float(os.getenv("REDIS_RECONNECT_MAX_DELAY", 60))
+# LLM backend: auto (DeepSeek, or the mock while the API key is the placeholder), deepseek, mock,
+# record (DeepSeek, appending every exchange to LLM_RECORDING_PATH) or replay (answer from that file)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "auto")
+LLM_RECORDING_PATH = os.getenv("LLM_RECORDING_PATH", "./data/llm_recordings.jsonl")
+LLM_REPLAY_LATENCY_MS = float(os.environ["LLM_REPLAY_LATENCY_MS"]) if os.getenv("LLM_REPLAY_LATENCY_MS") else None
+LLM_REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", 1.0))
+LLM_REPLAY_ON_MISS = os.getenv("LLM_REPLAY_ON_MISS", "operation")  # operation, mock or error
+# Per-operation model overrides, e.g. "analyze_photo=small-model,suggest_improvements=small-model"
+LLM_MODEL_ROUTES = parse_routes(os.getenv("LLM_MODEL_ROUTES", ""))
+PHOTO_INDEX_PATH = os.getenv("PHOTO_INDEX_PATH", "./data/photo_index")
+COMPAT_MATRIX_PATH = os.getenv("COMPAT_MATRIX_PATH", "./data/compat_matrix")
+COMPAT_MATRIX_CAPACITY = int(os.getenv("COMPAT_MATRIX_CAPACITY", 1024))
+COMPAT_PARTIAL_CACHE_ROWS = int(os.getenv("COMPAT_PARTIAL_CACHE_ROWS", 256))  # per cohort and worker
+PHOTO_FETCH_MAX_BYTES = int(os.getenv("PHOTO_FETCH_MAX_BYTES", 10 * 1024 * 1024))
+# Comma-separated photo hosts (and their subdomains) the service may fetch from; empty allows any public host
+PHOTO_FETCH_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("PHOTO_FETCH_ALLOWED_HOSTS", "").split(",") if h.strip()]
+PHOTO_FETCH_MAX_REDIRECTS = 3
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))
+# Completions stay servable this long past their TTL while a background refresh replaces them (0 disables)
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", 3600))
+CACHE_REFRESH_CONCURRENCY = int(os.getenv("CACHE_REFRESH_CONCURRENCY", 4))
+# Warmer: every interval, refresh the most requested completions before they go stale (0 disables)
+CACHE_WARM_INTERVAL = float(os.getenv("CACHE_WARM_INTERVAL", 60))
+CACHE_WARM_TOP = int(os.getenv("CACHE_WARM_TOP", 100))
+CACHE_WARM_MIN_HITS = float(os.getenv("CACHE_WARM_MIN_HITS", 3))
+# Cached completions: codec ("auto" is zstd when installed, else zlib), size below which values stay uncompressed,
+# level, and comma-separated dictionaries from `python -m cache_codec train` (the first compresses new entries)
+CACHE_CODEC = os.getenv("CACHE_CODEC", "auto")
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 256))
+CACHE_CODEC_LEVEL = int(os.getenv("CACHE_CODEC_LEVEL", 0)) or None
+CACHE_CODEC_DICT = os.getenv("CACHE_CODEC_DICT", "")
+# Encoded responses default to gzip, which is sent as-is to clients that accept it
+RESPONSE_CACHE_CODEC = os.getenv("RESPONSE_CACHE_CODEC", "gzip")
+# Batched bios: pets per upstream call, pets per request and upstream calls in flight per request
+BIO_BATCH_SIZE = int(os.getenv("BIO_BATCH_SIZE", 8))
+BIO_BATCH_MAX_PETS = int(os.getenv("BIO_BATCH_MAX_PETS", 200))
+PERSONALITY_TAGS_MAX = int(os.getenv("PERSONALITY_TAGS_MAX", 32))  # per pet
+PERSONALITY_TAG_MAX_LENGTH = 64
+BIO_BATCH_CONCURRENCY = int(os.getenv("BIO_BATCH_CONCURRENCY", 4))
+COMPAT_BATCH_WINDOW_MS = float(os.getenv("COMPAT_BATCH_WINDOW_MS", 1.0))
+COMPAT_BATCH_MAX_SIZE = int(os.getenv("COMPAT_BATCH_MAX_SIZE", 64))
+# Scoring worker processes: 0 scores on the event loop, "auto" uses every CPU but one
+SCORING_POOL_WORKERS = os.getenv("SCORING_POOL_WORKERS", "0")
+SCORING_POOL_QUEUE_DEPTH = int(os.getenv("SCORING_POOL_QUEUE_DEPTH", 2))
+# Deferred AI narratives: concurrent upstream calls, queue bound and how long results stay fetchable
+ENRICHMENT_WORKERS = int(os.getenv("ENRICHMENT_WORKERS", 4))
+ENRICHMENT_MAX_QUEUE = int(os.getenv("ENRICHMENT_MAX_QUEUE", 256))
+ENRICHMENT_TTL = int(os.getenv("ENRICHMENT_TTL", 3600))
+ENRICHMENT_CLAIM_TTL = float(os.getenv("ENRICHMENT_CLAIM_TTL", 120))  # lease of a running job, a few times its usual time
+ENRICHMENT_STREAM_TIMEOUT = float(os.getenv("ENRICHMENT_STREAM_TIMEOUT", 60))
+# Resident pet catalog: snapshot/journal directory shared by workers, and sync batches between snapshot rewrites
+CATALOG_PATH = os.getenv("CATALOG_PATH", "./data/catalog")
+CATALOG_COMPACT_EVERY = int(os.getenv("CATALOG_COMPACT_EVERY", 1000))
+
+# Service metrics (exposed on /metrics)
+CACHE_REQUESTS = REGISTRY.counter("ai_cache_requests_total", "AI response cache lookups by operation and result",
+                                  ("operation", "result"))
+BIO_BATCH_PETS = REGISTRY.counter("bio_batch_pets_total", "Pets in batched bio requests by where their bio came from",
+                                  ("source",))
 
-# Initialize Redis for caching (optional)
-try:
-    redis_client = redis.from_url(REDIS_URL, decode_responses=True)
-    logger.info("Redis cache initialized successfully")
-except Exception as e:
-    redis_client = None
-    logger.warning(f"Redis not available, caching disabled: {e}")
+# Redis for caching (optional), connected by the startup warm-up; an empty REDIS_URL disables it
+redis_client = None
+# Same server without response decoding, for codec-encoded completion and response entries
+redis_bytes_client = None
+
+# Startup warm-up progress reported by /ready
+startup_state = {"ready": False, "started_at": time.monotonic(), "warmup_seconds": None, "cache": "pending"}
 
 # Enhanced Pydantic models
+PersonalityTag = Annotated[str, Field(max_length=PERSONALITY_TAG_MAX_LENGTH)]
+
 class PetProfile(BaseModel):
     id: str
     name: str
@@ -62,7 +178,7 @@ class PetProfile(BaseModel):
     breed: str
     age: int
     size: str
-    personality_tags: List[str]
+    personality_tags: List[PersonalityTag] = Field(..., max_length=PERSONALITY_TAGS_MAX)
     photos: Optional[List[str]] = []
     current_bio: Optional[str] = ""
     owner_preferences: Optional[Dict[str, Any]] = {}
@@ -92,22 +208,86 @@ class BioGenerationRequest(BaseModel):
     length: Optional[str] = "medium"  # short, medium, long
     include_call_to_action: Optional[bool] = True
 
+class BatchBioRequest(BaseModel):
+    pets: List[PetProfile] = Field(..., min_length=1, max_length=BIO_BATCH_MAX_PETS)
+    tone: Optional[str] = "friendly"
+    length: Optional[str] = "medium"
+    include_call_to_action: Optional[bool] = True
+
 class PhotoAnalysisRequest(BaseModel):
     photo_url: str
     pet_name: Optional[str] = ""
     known_breed: Optional[str] = ""
 
+class PhotoDuplicateRequest(BaseModel):
+    photo_url: str
+    photo_id: Optional[str] = None  # registered in the index when provided
+    max_distance: Optional[int] = Field(default=7, ge=0, le=16)  # Hamming bits out of 64; <8 keeps probes sub-millisecond
+    limit: Optional[int] = Field(default=10, ge=1, le=100)
+
+class CohortPetsRequest(BaseModel):
+    pets: List[PetProfile] = Field(..., min_length=1, max_length=5000)
+
+class PetProfileDelta(BaseModel):
+    """Partial PetProfile update; only the fields sent are changed"""
+    species: Optional[str] = None
+    breed: Optional[str] = None
+    age: Optional[int] = None
+    size: Optional[str] = None
+    personality_tags: Optional[List[PersonalityTag]] = Field(default=None, max_length=PERSONALITY_TAGS_MAX)
+    activity_level: Optional[int] = Field(default=None, ge=1, le=10)
+
+class CatalogSyncRequest(BaseModel):
+    """One batch of catalog changes moving it from base_version to version; replace sends the whole catalog"""
+    base_version: int = Field(..., ge=0)
+    version: int = Field(..., ge=1)
+    upserts: List[PetProfile] = Field(default=[], max_length=5000)
+    deletes: List[str] = Field(default=[], max_length=5000)
+    replace: bool = False
+
 class CompatibilityRequest(BaseModel):
-    pet1: PetProfile
-    pet2: PetProfile
+    # Each pet is sent in full or referenced by its catalog id
+    pet1: Optional[PetProfile] = None
+    pet2: Optional[PetProfile] = None
+    pet1_id: Optional[str] = None
+    pet2_id: Optional[str] = None
     interaction_type: Optional[str] = "playdate"  # playdate, mating, adoption
+    # inline: wait for the AI narrative; deferred: return an enrichment token; none: score only.
+    # Unset means inline on /api/enhanced-compatibility and none on /api/calculate-compatibility.
+    analysis_mode: Optional[str] = Field(default=None, pattern="^(inline|deferred|none)$")
 
 class EnhancedDeepSeekClient:
     def __init__(self):
         self.api_key = DEEPSEEK_API_KEY
         self.base_url = DEEPSEEK_BASE_URL
         self.model = DEEPSEEK_MODEL
-        self.breed_knowledge = self._load_breed_knowledge()
+        self.model_routes = LLM_MODEL_ROUTES
+        self._backend: Optional[LLMBackend] = None
+        self._breed_knowledge: Optional[Dict[str, Dict]] = None
+    
+    @property
+    def backend(self) -> LLMBackend:
+        """Backend selected by LLM_BACKEND, created on first use"""
+        if LLM_BACKEND == "auto" and self.api_key == MOCK_API_KEY:
+            return MOCK_BACKEND
+        if self._backend is None:
+            self._backend = create_backend(LLM_BACKEND, self.api_key, self.base_url, LLM_RECORDING_PATH,
+                                           LLM_REPLAY_LATENCY_MS, LLM_REPLAY_LATENCY_SCALE, LLM_REPLAY_ON_MISS)
+        return self._backend
+    
+    def model_for(self, operation: str) -> str:
+        return self.model_routes.get(operation, self.model)
+    
+    def close(self):
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+    
+    @property
+    def breed_knowledge(self) -> Dict[str, Dict]:
+        if self._breed_knowledge is None:
+            self._breed_knowledge = self._load_breed_knowledge()
+        return self._breed_knowledge
     
     def _load_breed_knowledge(self) -> Dict[str, Dict]:
         """Enhanced breed knowledge database"""
@@ -144,264 +324,294 @@ class EnhancedDeepSeekClient:
         }
     
     async def get_cached_response(self, cache_key: str) -> Optional[str]:
-        """Get cached AI response"""
-        if not redis_client:
-            return None
-        try:
-            cached = await asyncio.get_event_loop().run_in_executor(
-                None, redis_client.get, cache_key
-            )
-            return cached
-        except Exception as e:
-            logger.warning(f"Cache retrieval error: {e}")
-            return None
+        """Get cached AI response, fresh or stale"""
+        cached, _ = await completion_cache.lookup(cache_key)
+        return cached
     
     async def set_cached_response(self, cache_key: str, response: str, ttl: int = 3600):
-        """Cache AI response"""
-        if not redis_client:
-            return
-        try:
-            await asyncio.get_event_loop().run_in_executor(
-                None, redis_client.setex, cache_key, ttl, response
-            )
-        except Exception as e:
-            logger.warning(f"Cache storage error: {e}")
+        """Cache AI response; it is fresh for ttl seconds and servable for CACHE_STALE_TTL more"""
+        await completion_cache.store(cache_key, response, ttl)
     
     def generate_cache_key(self, operation: str, data: Dict) -> str:
         """Generate cache key for operation"""
         data_str = json.dumps(data, sort_keys=True)
         return f"deepseek:{operation}:{hashlib.md5(data_str.encode()).hexdigest()}"
         
+    def completion_cache_key(self, messages: List[Dict[str, str]], max_tokens: int,
+                             operation: str = "completion") -> str:
+        data = {"messages": messages, "max_tokens": max_tokens}
+        model = self.model_for(operation)
+        if model != self.model:
+            data["model"] = model  # Routed operations get their own entries; default-model keys are unchanged
+        return self.generate_cache_key("completion", data)
+        
     async def generate_completion(self, messages: List[Dict[str, str]], max_tokens: int = 500, 
-                                cache_ttl: int = 3600) -> str:
-        """Generate completion using DeepSeek API with caching"""
+                                cache_ttl: int = 3600, operation: str = "completion", cache: bool = True,
+                                response_format: Optional[Dict[str, str]] = None) -> str:
+        """
+        Generate completion using DeepSeek API with caching (cache=False always calls upstream).
+
+        Stale cache entries are returned at once and regenerated in the
+        background; popular keys are also refreshed ahead of expiry by the
+        completion cache's warmer.
+        """
         # Generate cache key
-        cache_key = self.generate_cache_key("completion", {
-            "messages": messages, "max_tokens": max_tokens
-        })
+        cache_key = self.completion_cache_key(messages, max_tokens, operation)
+        producer = functools.partial(self._complete, messages, max_tokens, operation, response_format)
         
         # Check cache first
-        cached_response = await self.get_cached_response(cache_key)
-        if cached_response:
-            logger.info(f"Cache hit for {cache_key}")
-            return cached_response
+        if cache:
+            cached_response, fresh = await completion_cache.lookup(cache_key)
+            completion_cache.track(cache_key, operation, cache_ttl, producer)
+            if cached_response:
+                logger.info(f"Cache hit for {cache_key}")
+                CACHE_REQUESTS.inc(operation, "hit" if fresh else "stale")
+                if not fresh:
+                    completion_cache.revalidate(cache_key, operation, cache_ttl, producer)
+                return cached_response
+            CACHE_REQUESTS.inc(operation, "miss")
         
-        if self.api_key == "sk-your-deepseek-api-key-here":
-            response = self._mock_response(messages)
-        else:
-            response = await self._call_deepseek_api(messages, max_tokens)
+        response = await producer()
         
         # Cache the response
-        await self.set_cached_response(cache_key, response, cache_ttl)
+        if cache:
+            await self.set_cached_response(cache_key, response, cache_ttl)
         
         return response
     
-    async def _call_deepseek_api(self, messages: List[Dict[str, str]], max_tokens: int) -> str:
-        """Call DeepSeek API with retry logic"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": self.model,
-            "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": 0.7,
-            "stream": False
-        }
-        
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
-                    async with session.post(
-                        f"{self.base_url}/chat/completions",
-                        headers=headers,
-                        json=payload
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            return data["choices"][0]["message"]["content"]
-                        elif response.status == 429:  # Rate limit
-                            if attempt < max_retries - 1:
-                                await asyncio.sleep(2 ** attempt)
-                                continue
-                        
-                        error_text = await response.text()
-                        logger.error(f"DeepSeek API error: {error_text}")
-                        raise HTTPException(
-                            status_code=response.status,
-                            detail=f"DeepSeek API error: {error_text}"
-                        )
-                        
-            except asyncio.TimeoutError:
-                if attempt < max_retries - 1:
-                    logger.warning(f"Timeout on attempt {attempt + 1}, retrying...")
-                    await asyncio.sleep(2 ** attempt)
-                    continue
-                raise HTTPException(status_code=504, detail="DeepSeek API timeout")
-            except aiohttp.ClientError as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"Client error on attempt {attempt + 1}: {e}, retrying...")
-                    await asyncio.sleep(2 ** attempt)
-                    continue
-                raise HTTPException(status_code=503, detail=f"API connection error: {str(e)}")
-        
-        raise HTTPException(status_code=503, detail="DeepSeek API unavailable after retries")
+    async def _complete(self, messages: List[Dict[str, str]], max_tokens: int, operation: str,
+                        response_format: Optional[Dict[str, str]]) -> str:
+        backend = self.backend
+        with BACKEND_LATENCY.time(backend.name, operation):
+            return await backend.complete(messages, max_tokens, self.model_for(operation), operation,
+                                          response_format)
     
-    def _mock_response(self, messages: List[Dict[str, str]]) -> str:
-        """Enhanced mock responses based on context"""
-        last_message = messages[-1]["content"].lower()
-        
-        if "bio" in last_message or "description" in last_message:
-            return "Meet this wonderful pet who brings joy and companionship wherever they go! With their unique personality and loving nature, they're searching for the perfect family to share adventures with. Their playful spirit and gentle heart make them an ideal companion for the right match."
-        elif "analyze" in last_message or "photo" in last_message:
-            return "This pet displays excellent characteristics including bright, alert eyes and confident body language. They appear well-socialized and healthy, with signs of an active, engaging personality that would thrive in a loving environment."
-        elif "compatibility" in last_message:
-            return "These pets demonstrate strong compatibility potential. Their similar energy levels, complementary personalities, and matching social needs suggest they would form a positive relationship with proper introduction and ongoing supervision."
-        else:
-            return "I'm here to provide detailed AI-powered analysis for pet matching, bio generation, and compatibility assessment!"
+# Dictionaries are shared: one trained on bios and analyses suits both caches
+CACHE_DICTIONARIES = load_dictionaries(CACHE_CODEC_DICT)
+
+# LLM completions with stale-while-revalidate and warming of popular keys, stored compressed
+completion_cache = CompletionCache(lambda: redis_bytes_client, stale_ttl=CACHE_STALE_TTL,
+                                   codec=CacheCodec("completions", CACHE_CODEC, CACHE_COMPRESS_MIN_BYTES,
+                                                    CACHE_CODEC_LEVEL, CACHE_DICTIONARIES),
+                                   refresh_concurrency=CACHE_REFRESH_CONCURRENCY, warm_top=CACHE_WARM_TOP,
+                                   warm_interval=CACHE_WARM_INTERVAL, warm_min_hits=CACHE_WARM_MIN_HITS)
 
 # Initialize Enhanced DeepSeek client
+MOCK_BACKEND = MockBackend()
 deepseek_client = EnhancedDeepSeekClient()
 
+# Encoded /api/generate-bio bodies; hits skip validation, the LLM client and JSON encoding
+response_cache = ResponseCache(lambda: redis_bytes_client, "deepseek:response", ttl=RESPONSE_CACHE_TTL,
+                               codec=CacheCodec("responses", RESPONSE_CACHE_CODEC, CACHE_COMPRESS_MIN_BYTES,
+                                                CACHE_CODEC_LEVEL, CACHE_DICTIONARIES))
+
+# Background AI narratives for two-phase compatibility responses, fetched by token
+enrichment_queue = EnrichmentQueue(lambda: redis_client, workers=ENRICHMENT_WORKERS, max_queue=ENRICHMENT_MAX_QUEUE,
+                                   ttl=ENRICHMENT_TTL, claim_ttl=ENRICHMENT_CLAIM_TTL)
+
+# Perceptual-hash index shared by all workers through a memory-mapped store
+photo_index = None
+
+# Precomputed pairwise scores for active cohorts, shared by all workers through memory-mapped files
+compat_matrix_store = None
+
+def get_compat_matrix_store():
+    """Open the cohort matrix store on first use"""
+    global compat_matrix_store
+    if compat_matrix_store is None:
+        from compat_matrix import CompatibilityMatrixStore
+        compat_matrix_store = CompatibilityMatrixStore(COMPAT_MATRIX_PATH, deepseek_client.breed_knowledge,
+                                                       capacity=COMPAT_MATRIX_CAPACITY,
+                                                       partial_rows=COMPAT_PARTIAL_CACHE_ROWS)
+    return compat_matrix_store
+
+def catalog_entry(pet: Dict[str, Any]) -> Tuple[PetProfile, PetRecord]:
+    """Profile for prompts and its scoring record; profiles were validated when they were synced"""
+    profile = PetProfile.model_construct(**pet)
+    return profile, PetRecord.from_profile(profile)
+
+# Pets referenced by id, kept current by /api/catalog/sync and shared by all workers through the catalog directory
+pet_catalog = PetCatalog(CATALOG_PATH, catalog_entry, compact_every=CATALOG_COMPACT_EVERY)
+
+async def get_catalog() -> PetCatalog:
+    await asyncio.get_event_loop().run_in_executor(None, pet_catalog.refresh)
+    return pet_catalog
+
+def get_photo_index():
+    """Open the photo index on first use so numpy/Pillow stay off the import path"""
+    global photo_index
+    if photo_index is None:
+        from photo_index import PhotoHashIndex
+        photo_index = PhotoHashIndex(PHOTO_INDEX_PATH)
+    return photo_index
+
+def public_address(address: str) -> bool:
+    """Whether a fetch may connect to this IP: not private, loopback, link-local, multicast or reserved"""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+def check_photo_url(url: str) -> None:
+    """Reject photo URLs the service must not fetch; hostnames are checked again at connect time"""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise HTTPException(status_code=400, detail="Photo URL must be an http(s) URL")
+    if PHOTO_FETCH_ALLOWED_HOSTS and not any(host == allowed or host.endswith("." + allowed)
+                                             for allowed in PHOTO_FETCH_ALLOWED_HOSTS):
+        raise HTTPException(status_code=400, detail="Photo host is not allowed")
+    try:
+        literal = public_address(host)
+    except ValueError:
+        return  # a hostname
+    if not literal:
+        raise HTTPException(status_code=400, detail="Photo host is not allowed")
+
+class PublicAddressResolver:
+    """
+    aiohttp resolver that drops non-public addresses.
+
+    Filtering the addresses actually connected to (rather than resolving
+    once up front) also covers DNS rebinding and redirects to internal names.
+    """
+
+    def __init__(self):
+        self._resolver = aiohttp.ThreadedResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: int = 0):
+        addresses = [a for a in await self._resolver.resolve(host, port, family) if public_address(a["host"])]
+        if not addresses:
+            raise OSError(f"{host} does not resolve to a public address")
+        return addresses
+
+    async def close(self) -> None:
+        await self._resolver.close()
+
+async def fetch_photo_bytes(photo_url: str) -> bytes:
+    """Download a photo for hashing from a public http(s) host, bounded by PHOTO_FETCH_MAX_BYTES"""
+    connector = aiohttp.TCPConnector(resolver=PublicAddressResolver())
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15), connector=connector) as session:
+        # Redirects are followed by hand so every hop is checked
+        for _ in range(PHOTO_FETCH_MAX_REDIRECTS + 1):
+            check_photo_url(photo_url)
+            try:
+                async with session.get(photo_url, allow_redirects=False) as response:
+                    if response.status in (301, 302, 303, 307, 308) and "Location" in response.headers:
+                        photo_url = urljoin(photo_url, response.headers["Location"])
+                        continue
+                    if response.status != 200:
+                        raise HTTPException(status_code=422, detail=f"Photo fetch failed with status {response.status}")
+                    data = await response.content.read(PHOTO_FETCH_MAX_BYTES + 1)
+                    if len(data) > PHOTO_FETCH_MAX_BYTES:
+                        raise HTTPException(status_code=413, detail="Photo exceeds size limit")
+                    return data
+            except aiohttp.ClientConnectorError as e:
+                raise HTTPException(status_code=422, detail=f"Photo fetch failed: {e}")
+        raise HTTPException(status_code=422, detail="Photo fetch failed: too many redirects")
+
 # Enhanced compatibility analysis functions
 def calculate_advanced_compatibility(pet1: PetProfile, pet2: PetProfile, 
                                    breed_knowledge: Dict) -> EnhancedCompatibilityResponse:
     """Advanced compatibility calculation with detailed breakdown"""
-    
-    breakdown = {}
-    insights = []
-    recommendations = []
-    risk_factors = []
-    interaction_suitability = {}
-    
-    # 1. Species compatibility
-    if pet1.species != pet2.species:
-        breakdown["species_match"] = 0.0
-        risk_factors.append("Different species may have communication difficulties")
-        interaction_suitability = {"playdate": 0.2, "mating": 0.0, "cohabitation": 0.3}
-    else:
-        breakdown["species_match"] = 1.0
-        insights.append(f"Both are {pet1.species}s - excellent species match")
-    
-    # 2. Breed compatibility
-    breed1_data = breed_knowledge.get(pet1.species, {}).get(pet1.breed.lower(), {})
-    breed2_data = breed_knowledge.get(pet2.species, {}).get(pet2.breed.lower(), {})
-    
-    breed_score = 0.6  # Default for unknown breeds
-    if breed1_data and breed2_data:
-        # Energy level compatibility
-        energy1 = breed1_data.get("energy_level", 5)
-        energy2 = breed2_data.get("energy_level", 5)
-        energy_compat = max(0.0, 1.0 - (abs(energy1 - energy2) / 10.0))
-        
-        # Temperament overlap
-        temp1 = set(breed1_data.get("temperament", []))
-        temp2 = set(breed2_data.get("temperament", []))
-        temp_overlap = len(temp1.intersection(temp2)) / max(len(temp1.union(temp2)), 1)
-        
-        breed_score = (energy_compat * 0.4 + temp_overlap * 0.6)
-        
-        if breed_score > 0.8:
-            insights.append("Excellent breed compatibility - similar needs and temperaments")
-        elif breed_score < 0.4:
-            risk_factors.append("Breeds have very different characteristics")
-    
-    breakdown["breed_compatibility"] = breed_score
-    
-    # 3. Personality compatibility
-    personality_overlap = len(set(pet1.personality_tags) & set(pet2.personality_tags))
-    total_traits = len(set(pet1.personality_tags) | set(pet2.personality_tags))
-    personality_score = personality_overlap / max(total_traits, 1) if total_traits > 0 else 0.5
-    
-    breakdown["personality_match"] = personality_score
-    
-    if personality_overlap > 0:
-        common_traits = list(set(pet1.personality_tags) & set(pet2.personality_tags))
-        insights.append(f"Share {personality_overlap} personality traits: {', '.join(common_traits[:3])}")
-    
-    # 4. Size and age compatibility
-    size_order = {"tiny": 1, "small": 2, "medium": 3, "large": 4, "extra-large": 5}
-    size1_val = size_order.get(pet1.size.lower(), 3)
-    size2_val = size_order.get(pet2.size.lower(), 3)
-    
-    size_diff = abs(size1_val - size2_val)
-    age_diff = abs(pet1.age - pet2.age)
-    
-    size_compat = max(0.0, 1.0 - (size_diff * 0.15))
-    age_compat = max(0.0, 1.0 - (age_diff * 0.1))
-    
-    breakdown["size_compatibility"] = size_compat
-    breakdown["age_compatibility"] = age_compat
-    
-    # 5. Activity level compatibility
-    if hasattr(pet1, 'activity_level') and hasattr(pet2, 'activity_level'):
-        activity_diff = abs(pet1.activity_level - pet2.activity_level)
-        activity_score = max(0.0, 1.0 - (activity_diff / 10.0))
-        breakdown["activity_match"] = activity_score
-    else:
-        breakdown["activity_match"] = 0.7  # Neutral default
-    
-    # Calculate overall score
-    weights = {
-        "species_match": 0.25,
-        "breed_compatibility": 0.20,
-        "personality_match": 0.25,
-        "size_compatibility": 0.10,
-        "age_compatibility": 0.10,
-        "activity_match": 0.10
-    }
-    
-    overall_score = sum(breakdown[key] * weights[key] for key in breakdown if key in weights)
-    
-    # Generate interaction suitability if not set
-    if not interaction_suitability:
-        interaction_suitability = {
-            "playdate": min(1.0, overall_score + 0.1),
-            "mating": overall_score * 0.9 if pet1.species == pet2.species else 0.0,
-            "cohabitation": overall_score * 0.8
-        }
-    
-    # Generate recommendations based on score
-    if overall_score > 0.8:
-        recommendations.extend([
-            "Excellent compatibility! These pets should get along very well",
-            "Consider arranging a supervised meetup in neutral territory",
-            "Gradual introduction recommended for best results"
-        ])
-    elif overall_score > 0.6:
-        recommendations.extend([
-            "Good potential for friendship with proper introduction",
-            "Take introductions slowly with multiple supervised sessions",
-            "Monitor interactions closely during initial meetings"
-        ])
-    else:
-        recommendations.extend([
-            "Challenging match - extensive supervision required",
-            "Consider if this pairing aligns with your goals",
-            "Professional trainer consultation recommended"
-        ])
-    
-    # Calculate confidence based on data completeness
-    data_completeness = sum([
-        1 if pet1.personality_tags and pet2.personality_tags else 0,
-        1 if breed1_data and breed2_data else 0,
-        1 if hasattr(pet1, 'activity_level') and hasattr(pet2, 'activity_level') else 0
-    ]) / 3.0
-    
-    confidence = min(0.95, 0.7 + (data_completeness * 0.25))
-    
-    return EnhancedCompatibilityResponse(
-        compatibility_score=round(overall_score * 100, 1),
-        confidence=round(confidence, 3),
-        breakdown={k: round(v, 3) for k, v in breakdown.items()},
-        insights=insights,
-        recommendations=recommendations,
-        risk_factors=risk_factors,
-        interaction_suitability={k: round(v, 3) for k, v in interaction_suitability.items()}
-    )
+    return EnhancedCompatibilityResponse(**compatibility_breakdown(pet1, pet2, breed_knowledge))
+
+def compatibility_breakdown(pet1: PetProfile, pet2: PetProfile, breed_knowledge: Dict) -> Dict[str, Any]:
+    """Plain-dict form of calculate_advanced_compatibility for endpoints that serialize it directly"""
+    return compatibility.score_pair(PetRecord.from_profile(pet1), PetRecord.from_profile(pet2), breed_knowledge)
+
+# Concurrent compatibility requests are scored together, in worker processes when SCORING_POOL_WORKERS is set
+compatibility_batcher = None
+scoring_pool = None
+
+def get_compatibility_batcher() -> MicroBatcher:
+    global compatibility_batcher, scoring_pool
+    if compatibility_batcher is None:
+        breed_knowledge = deepseek_client.breed_knowledge
+        workers = pool_size(SCORING_POOL_WORKERS)
+        if workers > 0:
+            scoring_pool = ScoringPool(breed_knowledge, workers, queue_depth=SCORING_POOL_QUEUE_DEPTH)
+            process_batch = scoring_pool.score
+        else:
+            process_batch = functools.partial(
+                compatibility.score_batch, breed_knowledge=breed_knowledge,
+                breed_table=compatibility.BreedTable.from_knowledge(breed_knowledge)
+            )
+        compatibility_batcher = MicroBatcher(
+            process_batch,
+            max_batch_size=COMPAT_BATCH_MAX_SIZE,
+            max_delay=COMPAT_BATCH_WINDOW_MS / 1000.0,
+            name="compatibility"
+        )
+    return compatibility_batcher
+
+def connect_redis() -> bool:
+    """Import redis and verify the connection; runs in an executor during warm-up and reconnection"""
+    global redis_client, redis_bytes_client
+    try:
+        import redis
+        client = redis.from_url(REDIS_URL, decode_responses=True, socket_connect_timeout=2)
+        client.ping()
+        redis_client = client
+        if redis_bytes_client is None:
+            redis_bytes_client = redis.from_url(REDIS_URL, socket_connect_timeout=2)
+        logger.info("Redis cache initialized successfully")
+        return True
+    except Exception as e:
+        logger.warning(f"Redis not available, caching disabled: {e}")
+        return False
+
+async def reconnect_redis():
+    """Retry a cache that was down at startup, backing off up to REDIS_RECONNECT_MAX_DELAY between attempts"""
+    loop = asyncio.get_event_loop()
+    delay = 1.0
+    while redis_client is None:
+        await asyncio.sleep(delay)
+        if await loop.run_in_executor(None, connect_redis):
+            startup_state["cache"] = "enabled"
+            return
+        delay = min(delay * 2, REDIS_RECONNECT_MAX_DELAY)
+
+def warm_up_dependencies():
+    """Blocking part of the warm-up: cache connection, lazy modules and lookup tables"""
+    if redis_client is None and REDIS_URL:
+        connect_redis()
+    startup_state["cache"] = "enabled" if redis_client is not None else "disabled"
+    preload(aiohttp, compatibility.np)  # finish the deferred imports before the first requests need them
+    deepseek_client.breed_knowledge
+    prompts.TOKENIZER.load()
+    pet_catalog.refresh()
+
+async def warm_up():
+    loop = asyncio.get_event_loop()
+    try:
+        await loop.run_in_executor(None, warm_up_dependencies)
+        get_compatibility_batcher()
+        if redis_client is None and REDIS_URL:
+            app.state.redis_reconnect_task = asyncio.create_task(reconnect_redis())
+    except Exception as e:
+        logger.error(f"Startup warm-up failed: {e}")
+    startup_state["warmup_seconds"] = round(time.monotonic() - startup_state["started_at"], 3)
+    startup_state["ready"] = True
+    logger.info(f"Service ready after {startup_state['warmup_seconds']}s")
+
+@app.on_event("startup")
+async def start_background_services():
+    profiler.start_background()
+    completion_cache.start()
+    # Warm up in the background so the worker starts accepting connections immediately
+    app.state.warmup_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    reconnect_task = getattr(app.state, "redis_reconnect_task", None)
+    if reconnect_task is not None:
+        reconnect_task.cancel()
+    await enrichment_queue.stop()
+    await completion_cache.stop()
+    if scoring_pool is not None:
+        scoring_pool.close()
+    deepseek_client.close()
 
 @app.get("/")
 async def root():
@@ -415,7 +625,7 @@ async def root():
             "Retry logic and error handling",
             "Real-time performance monitoring"
         ],
-        "deepseek_configured": DEEPSEEK_API_KEY != "sk-your-deepseek-api-key-here",
+        "deepseek_configured": DEEPSEEK_API_KEY != MOCK_API_KEY,
         "cache_enabled": redis_client is not None
     }
 
@@ -441,63 +651,244 @@ async def health_check():
         "version": "2.1.0", 
         "timestamp": datetime.now().isoformat(),
         "components": {
-            "deepseek_api": "configured" if DEEPSEEK_API_KEY != "sk-your-deepseek-api-key-here" else "mock_mode",
+            "deepseek_api": "configured" if DEEPSEEK_API_KEY != MOCK_API_KEY else "mock_mode",
+            "llm_backend": deepseek_client.backend.name,
             "cache": cache_status,
             "breed_knowledge": f"{len(deepseek_client.breed_knowledge)} species loaded"
         },
-        "cache_info": cache_info
+        "cache_info": cache_info,
+        "admission": admission.stats()
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the startup warm-up has finished; /health stays a liveness check"""
+    body = {
+        "status": "ready" if startup_state["ready"] else "starting",
+        "warmup_seconds": startup_state["warmup_seconds"],
+        "components": {"cache": startup_state["cache"]}
     }
+    return JSONResponse(status_code=200 if startup_state["ready"] else 503, content=body)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus-style text metrics: per-route latency, cache, upstream and token usage"""
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+def require_profiler_admin(token: Optional[str]):
+    """Profiler endpoints are invisible unless enabled and need the admin token"""
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiler.authorize(token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/api/admin/profiler/start", include_in_schema=False)
+async def start_profiling(duration: float = 10.0, x_admin_token: Optional[str] = Header(None)):
+    """Start a rate-limited stack sampling session"""
+    require_profiler_admin(x_admin_token)
+    try:
+        return {"status": "sampling", **profiler.start_session(duration)}
+    except RuntimeError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+@app.get("/api/admin/profiler/stacks", include_in_schema=False)
+async def profiling_stacks(x_admin_token: Optional[str] = Header(None)):
+    """Collapsed stacks of the current session so far (flamegraph.pl / speedscope input)"""
+    require_profiler_admin(x_admin_token)
+    return PlainTextResponse(profiler.session_stacks())
+
+@app.post("/api/admin/profiler/stop", include_in_schema=False)
+async def stop_profiling(x_admin_token: Optional[str] = Header(None)):
+    """Stop the session and return its collapsed stacks"""
+    require_profiler_admin(x_admin_token)
+    return PlainTextResponse(profiler.stop_session())
 
-@app.post("/api/generate-bio")
-async def generate_pet_bio(request: BioGenerationRequest):
+@app.get("/api/admin/profiler/slow-requests", include_in_schema=False)
+async def slow_request_captures(x_admin_token: Optional[str] = Header(None)):
+    """Traces captured for requests slower than AI_SLOW_REQUEST_MS, newest last"""
+    require_profiler_admin(x_admin_token)
+    return {
+        "threshold_ms": profiler.slow_request_seconds * 1000,
+        "captures": list(profiler.slow_captures)
+    }
+
+BIO_MIN_WORDS = 10
+
+def bio_personality(pet: PetProfile) -> str:
+    return ", ".join(pet.personality_tags) if pet.personality_tags else "friendly"
+
+def bio_closing(request) -> str:
+    if request.include_call_to_action:
+        return "End with a call-to-action encouraging contact"
+    return "Focus on the pet's qualities without a direct call-to-action"
+
+def bio_prompt(pet: PetProfile, request) -> prompts.Prompt:
+    """Single-pet bio prompt; its completion cache key is where every bio for this pet and style is stored"""
+    return prompts.BIO.build(
+        name=pet.name, species=pet.species, breed=pet.breed, age=pet.age, size=pet.size,
+        personality=bio_personality(pet), tone=request.tone, length=request.length, closing=bio_closing(request)
+    )
+
+def pack_bio_batches(pets: List[PetProfile]) -> List[List[Tuple[PetProfile, str]]]:
+    """Group pets into batch prompts of at most BIO_BATCH_SIZE pets that stay within the batch token budget"""
+    # Room left for the pet lines once the instructions, tone, length and closing are in
+    available = prompts.BIO_BATCH.budget - prompts.BIO_BATCH.static_tokens - 64
+    batches, current, used = [], [], 0
+    for pet in pets:
+        line = fast_json.dumps({
+            "id": pet.id, "name": pet.name, "species": pet.species, "breed": pet.breed, "age": pet.age,
+            "size": pet.size, "personality": prompts.TOKENIZER.truncate(bio_personality(pet), 100)
+        }).decode()
+        tokens = prompts.TOKENIZER.count(line) + 1
+        if current and (len(current) >= BIO_BATCH_SIZE or used + tokens > available):
+            batches.append(current)
+            current, used = [], 0
+        current.append((pet, line))
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def parse_batch_bios(text: str, pet_ids: set) -> Dict[str, str]:
+    """Bios from a batch completion, keeping only well-formed entries for pets that were asked for"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = fast_json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    if isinstance(data.get("bios"), dict):
+        data = data["bios"]
+    return {
+        pet_id: bio.strip() for pet_id, bio in data.items()
+        if pet_id in pet_ids and isinstance(bio, str) and len(bio.split()) >= BIO_MIN_WORDS
+    }
+
+async def generate_bio_batch(batch: List[Tuple[PetProfile, str]], request: BatchBioRequest) -> Dict[str, str]:
+    prompt = prompts.BIO_BATCH.render(tone=request.tone, length=request.length, closing=bio_closing(request),
+                                      count=len(batch), pets="\n".join(line for _, line in batch))
+    # Not cached as a whole: each bio is stored under its own single-pet key instead
+    text = await deepseek_client.generate_completion(
+        prompt.messages, max_tokens=prompts.BIO_BATCH.max_tokens * len(batch), operation="generate_bio_batch",
+        cache=False, response_format={"type": "json_object"}
+    )
+    bios = parse_batch_bios(text, {pet.id for pet, _ in batch})
+    if len(bios) < len(batch):
+        logger.warning(f"Batch bio completion covered {len(bios)} of {len(batch)} pets")
+    return bios
+
+@app.post("/api/generate-bios")
+async def generate_pet_bios(request: BatchBioRequest):
+    """
+    Generate bios for many pets (a litter, a shelter import) with few upstream calls.
+
+    Pets whose bio is already cached are served from the cache. The rest are
+    packed several to a prompt asking for JSON keyed by pet id; pets missing
+    or malformed in that reply fall back to the single-pet prompt. Every bio
+    is stored under its single-pet completion key, so a later
+    /api/generate-bio for the same pet and style does not call upstream.
+    """
+    pet_ids = [pet.id for pet in request.pets]
+    if len(set(pet_ids)) != len(pet_ids):
+        raise HTTPException(status_code=400, detail="Pet ids must be unique")
+    single_prompts = {pet.id: bio_prompt(pet, request) for pet in request.pets}
+    cache_keys = {pet_id: deepseek_client.completion_cache_key(prompt.messages, prompts.BIO.max_tokens, "generate_bio")
+                  for pet_id, prompt in single_prompts.items()}
+    upstream = asyncio.Semaphore(BIO_BATCH_CONCURRENCY)
+    bios: Dict[str, str] = {}
+    sources: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+
+    cached = await asyncio.gather(*(deepseek_client.get_cached_response(cache_keys[pet_id]) for pet_id in pet_ids))
+    for pet_id, bio in zip(pet_ids, cached):
+        CACHE_REQUESTS.inc("generate_bio", "hit" if bio else "miss")
+        if bio:
+            bios[pet_id], sources[pet_id] = bio, "cache"
+
+    async def run_batch(batch):
+        async with upstream:
+            return await generate_bio_batch(batch, request)
+
+    batches = pack_bio_batches([pet for pet in request.pets if pet.id not in bios])
+    results = await asyncio.gather(*(run_batch(batch) for batch in batches), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Batch bio completion failed: {result}")
+            continue
+        for pet_id, bio in result.items():
+            bios[pet_id], sources[pet_id] = bio, "batch"
+    await asyncio.gather(*(deepseek_client.set_cached_response(cache_keys[pet_id], bios[pet_id])
+                           for pet_id in pet_ids if sources.get(pet_id) == "batch"))
+
+    async def run_single(pet_id):
+        async with upstream:
+            prompts.BIO.observe(single_prompts[pet_id])
+            return await deepseek_client.generate_completion(single_prompts[pet_id].messages,
+                                                             max_tokens=prompts.BIO.max_tokens,
+                                                             operation="generate_bio", cache=False)
+
+    fallbacks = [pet_id for pet_id in pet_ids if pet_id not in bios]
+    results = await asyncio.gather(*(run_single(pet_id) for pet_id in fallbacks), return_exceptions=True)
+    for pet_id, result in zip(fallbacks, results):
+        if isinstance(result, Exception):
+            errors[pet_id] = str(getattr(result, "detail", result))
+            sources[pet_id] = "failed"
+        else:
+            bios[pet_id], sources[pet_id] = result, "single"
+    await asyncio.gather(*(deepseek_client.set_cached_response(cache_keys[pet_id], bios[pet_id])
+                           for pet_id in fallbacks if pet_id in bios))
+
+    for source in sources.values():
+        BIO_BATCH_PETS.inc(source)
+    return FastJSONResponse({
+        "bios": [
+            {"pet_id": pet_id, "bio": bios[pet_id].strip(), "source": sources[pet_id]} if pet_id in bios
+            else {"pet_id": pet_id, "error": errors[pet_id], "source": sources[pet_id]}
+            for pet_id in pet_ids
+        ],
+        "generated_at": datetime.now().isoformat(),
+        "tone": request.tone,
+        "length": request.length,
+        "upstream_calls": len(batches) + len(fallbacks)
+    })
+
+@app.post("/api/generate-bio", openapi_extra=request_body_openapi(BioGenerationRequest))
+async def generate_pet_bio(http_request: Request):
     """Generate AI-powered pet bio using DeepSeek"""
+    data = await read_json(http_request)
+    cache_key = response_cache.key("generate_bio", data)
+    cached = await response_cache.get(cache_key, "generate_bio")
+    response = response_cache.respond(cached, http_request) if cached else None
+    if response is not None:
+        return response
+    
+    request = validate_body(BioGenerationRequest, data)
     try:
         pet = request.pet
+        prompt = bio_prompt(pet, request)
+        prompts.BIO.observe(prompt)
         
-        # Create detailed prompt for DeepSeek
-        personality_str = ", ".join(pet.personality_tags) if pet.personality_tags else "friendly"
+        bio_text = await deepseek_client.generate_completion(prompt.messages, max_tokens=prompts.BIO.max_tokens,
+                                                             operation="generate_bio")
         
-        prompt = f"""Create an engaging and heartwarming bio for a pet adoption/matching profile.
-
-Pet Details:
-- Name: {pet.name}
-- Species: {pet.species}
-- Breed: {pet.breed}
-- Age: {pet.age} years old
-- Size: {pet.size}
-- Personality: {personality_str}
-
-Tone: {request.tone}
-Length: {request.length}
-
-Requirements:
-1. Make it warm, engaging, and authentic
-2. Highlight the pet's unique personality
-3. Include what kind of home/companion they're looking for
-4. Use a {request.tone} tone throughout
-5. Keep it {request.length} length (short=50-80 words, medium=80-120 words, long=120-180 words)
-{"6. End with a call-to-action encouraging contact" if request.include_call_to_action else "6. Focus on the pet's qualities without a direct call-to-action"}
-
-Write only the bio text, no additional commentary."""
-
-        messages = [
-            {"role": "system", "content": "You are an expert pet bio writer who creates compelling, heartwarming descriptions that help pets find their perfect matches."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        bio_text = await deepseek_client.generate_completion(messages, max_tokens=300)
-        
-        return {
+        body = fast_json.dumps({
             "bio": bio_text.strip(),
             "generated_at": datetime.now().isoformat(),
             "tone": request.tone,
             "length": request.length,
             "pet_id": pet.id,
             "ai_confidence": 0.95
-        }
+        })
+        await response_cache.set(cache_key, body)
+        
+        return RawJSONResponse(body, headers=VARY_HEADERS)
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Bio generation error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Bio generation error: {str(e)}",
+                            headers=VARY_HEADERS)
 
 @app.post("/api/analyze-photo")
 async def analyze_pet_photo(request: PhotoAnalysisRequest):
@@ -509,30 +900,12 @@ async def analyze_pet_photo(request: PhotoAnalysisRequest):
         photo_url = request.photo_url
         pet_name = request.pet_name or "this pet"
         
-        prompt = f"""As a veterinary expert and animal behaviorist, analyze what you can determine about a pet from their photo context and provide insights.
-
-Photo URL: {photo_url}
-Pet Name: {pet_name}
-Known Breed: {request.known_breed or "Unknown"}
-
-Based on typical characteristics and the context provided, please analyze:
-
-1. Likely personality traits
-2. Care requirements
-3. Compatibility with families/other pets
-4. Exercise and activity needs
-5. Any notable characteristics
-
-Provide a professional but friendly analysis that would help potential adopters or playdate partners understand this pet better.
-
-Format your response as a structured analysis focusing on practical insights."""
-
-        messages = [
-            {"role": "system", "content": "You are a professional veterinarian and animal behaviorist with expertise in pet personality assessment and breed characteristics."},
-            {"role": "user", "content": prompt}
-        ]
+        prompt = prompts.PHOTO_ANALYSIS.render(photo_url=photo_url, pet_name=pet_name,
+                                               known_breed=request.known_breed or "Unknown")
         
-        analysis_text = await deepseek_client.generate_completion(messages, max_tokens=400)
+        analysis_text = await deepseek_client.generate_completion(
+            prompt.messages, max_tokens=prompts.PHOTO_ANALYSIS.max_tokens, operation="analyze_photo"
+        )
         
         # Extract key insights (simplified parsing)
         traits = ["Friendly", "Energetic", "Intelligent", "Gentle"]  # Default traits
@@ -541,7 +914,7 @@ Format your response as a structured analysis focusing on practical insights."""
         elif "active" in analysis_text.lower() or "energetic" in analysis_text.lower():
             traits = ["Active", "Energetic", "Playful", "Adventurous"]
         
-        return {
+        return FastJSONResponse({
             "analysis": analysis_text.strip(),
             "detected_traits": traits,
             "confidence": 0.85,
@@ -552,66 +925,249 @@ Format your response as a structured analysis focusing on practical insights."""
                 "Social interaction important",
                 "Consistent training beneficial"
             ]
-        }
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Photo analysis error: {str(e)}")
 
-@app.post("/api/enhanced-compatibility")
-async def enhanced_pet_compatibility(request: CompatibilityRequest):
-    """Enhanced compatibility analysis with detailed breakdown and insights"""
+@app.post("/api/photos/check-duplicate")
+async def check_duplicate_photo(request: PhotoDuplicateRequest):
+    """Find near-duplicate photos by perceptual hash, optionally registering this one"""
+    if request.photo_id is not None:
+        from photo_index import encode_photo_id
+        try:
+            encode_photo_id(request.photo_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
-        logger.info(f"Enhanced compatibility analysis for {request.pet1.name} and {request.pet2.name}")
-        
-        # Get advanced algorithmic analysis
-        advanced_result = calculate_advanced_compatibility(
-            request.pet1, request.pet2, deepseek_client.breed_knowledge
+        image_bytes = await fetch_photo_bytes(request.photo_url)
+        loop = asyncio.get_event_loop()
+        index = await loop.run_in_executor(None, get_photo_index)
+        from photo_index import compute_phash
+        phash = await loop.run_in_executor(None, compute_phash, image_bytes)
+        matches = await loop.run_in_executor(
+            None, index.query, phash, request.max_distance, request.limit
         )
         
-        # Get AI narrative analysis
-        prompt = f"""As a certified animal behaviorist, provide detailed analysis for these pets' compatibility.
-
-Pet 1 - {request.pet1.name}:
-- Species: {request.pet1.species}, Breed: {request.pet1.breed}
-- Age: {request.pet1.age} years, Size: {request.pet1.size}
-- Personality: {', '.join(request.pet1.personality_tags)}
-- Activity Level: {getattr(request.pet1, 'activity_level', 'Unknown')}
-
-Pet 2 - {request.pet2.name}:
-- Species: {request.pet2.species}, Breed: {request.pet2.breed}
-- Age: {request.pet2.age} years, Size: {request.pet2.size}  
-- Personality: {', '.join(request.pet2.personality_tags)}
-- Activity Level: {getattr(request.pet2, 'activity_level', 'Unknown')}
-
-Interaction Type: {request.interaction_type}
-
-Based on the compatibility score of {advanced_result.compatibility_score}%, provide:
-1. Professional assessment of their compatibility
-2. Specific introduction strategies
-3. Long-term relationship predictions
-4. Important considerations for owners
-
-Keep response concise but professional."""
-
-        messages = [
-            {"role": "system", "content": "You are an expert animal behaviorist with 15+ years of experience in pet compatibility assessment and behavioral analysis."},
-            {"role": "user", "content": prompt}
-        ]
+        if request.photo_id:
+            # add() may trigger a flush once the buffer fills, so keep it off the event loop
+            await loop.run_in_executor(None, index.add, request.photo_id, phash)
         
-        try:
-            ai_analysis = await deepseek_client.generate_completion(messages, max_tokens=400, cache_ttl=7200)
-        except Exception as e:
-            logger.warning(f"AI analysis failed: {e}")
-            ai_analysis = "Professional compatibility analysis temporarily unavailable. Please refer to the detailed breakdown above."
-        
-        return {
-            **advanced_result.dict(),
-            "ai_analysis": ai_analysis,
-            "interaction_type": request.interaction_type,
-            "calculated_at": datetime.now().isoformat(),
-            "version": "enhanced-2.1"
-        }
+        return FastJSONResponse({
+            "phash": f"{phash:016x}",
+            "is_duplicate": bool(matches),
+            "matches": [{"photo_id": photo_id, "distance": distance} for photo_id, distance in matches],
+            "indexed_photos": len(index),
+            "checked_at": datetime.now().isoformat()
+        })
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Duplicate photo check error: {e}")
+        raise HTTPException(status_code=500, detail=f"Duplicate photo check failed: {str(e)}")
+
+@app.post("/api/photos/index/flush")
+async def flush_photo_index():
+    """Persist buffered photo hashes to the shared memory-mapped index"""
+    loop = asyncio.get_event_loop()
+    index = await loop.run_in_executor(None, get_photo_index)
+    total = await loop.run_in_executor(None, index.flush)
+    return {"message": "Photo index flushed", "indexed_photos": total}
+
+async def get_cohort(cohort: str):
+    loop = asyncio.get_event_loop()
+    store = await loop.run_in_executor(None, get_compat_matrix_store)
+    try:
+        return await loop.run_in_executor(None, store.cohort, cohort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.put("/api/cohorts/{cohort}/pets")
+async def upsert_cohort_pets(cohort: str, request: CohortPetsRequest):
+    """Add or update cohort members; only their rows and columns of the matrix are rescored"""
+    matrix = await get_cohort(cohort)
+    pets = [(pet.id, PetRecord.from_profile(pet)) for pet in request.pets]
+    try:
+        size = await asyncio.get_event_loop().run_in_executor(None, matrix.upsert, pets)
+    except Exception as e:
+        logger.error(f"Cohort matrix update error: {e}")
+        raise HTTPException(status_code=500, detail=f"Cohort update failed: {str(e)}")
+    return {"cohort": cohort, "updated": len(pets), "pets": size}
+
+@app.patch("/api/cohorts/{cohort}/pets/{pet_id}")
+async def update_cohort_pet(cohort: str, pet_id: str, request: PetProfileDelta):
+    """Change some fields of a cohort member; only the breakdown components they feed are rescored"""
+    matrix = await get_cohort(cohort)
+    delta = {field: value for field, value in request.model_dump(exclude_unset=True).items() if value is not None}
+    if not delta:
+        raise HTTPException(status_code=400, detail="No profile fields to update")
+    try:
+        result = await asyncio.get_event_loop().run_in_executor(None, matrix.apply_delta, pet_id, delta)
+    except Exception as e:
+        logger.error(f"Cohort matrix update error: {e}")
+        raise HTTPException(status_code=500, detail=f"Cohort update failed: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Pet not in cohort")
+    return {"cohort": cohort, "pet_id": pet_id, **result, "pets": len(matrix)}
+
+@app.delete("/api/cohorts/{cohort}/pets/{pet_id}")
+async def delete_cohort_pet(cohort: str, pet_id: str):
+    matrix = await get_cohort(cohort)
+    if pet_id not in matrix:
+        raise HTTPException(status_code=404, detail="Pet not in cohort")
+    size = await asyncio.get_event_loop().run_in_executor(None, matrix.delete, [pet_id])
+    return {"cohort": cohort, "deleted": pet_id, "pets": size}
+
+@app.get("/api/cohorts/{cohort}/compatibility")
+async def cohort_compatibility(cohort: str, pet1_id: str, pet2_id: str):
+    """Precomputed overall score of two cohort members (0.4-point resolution)"""
+    matrix = await get_cohort(cohort)
+    score = matrix.score(pet1_id, pet2_id)
+    if score is None:
+        raise HTTPException(status_code=404, detail="Both pets must be distinct members of the cohort")
+    return FastJSONResponse({"cohort": cohort, "pet1_id": pet1_id, "pet2_id": pet2_id, "compatibility_score": score})
+
+@app.get("/api/cohorts/{cohort}/pets/{pet_id}/top-matches")
+async def cohort_top_matches(cohort: str, pet_id: str, k: int = Query(default=10, ge=1, le=500),
+                             min_score: float = Query(default=0.0, ge=0.0, le=100.0)):
+    """Best k matches for a cohort member, read from its precomputed row"""
+    matrix = await get_cohort(cohort)
+    matches = matrix.top_k(pet_id, k, min_score)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Pet not in cohort")
+    return FastJSONResponse({
+        "cohort": cohort,
+        "pet_id": pet_id,
+        "matches": [{"pet_id": match_id, "compatibility_score": score} for match_id, score in matches]
+    })
+
+@app.post("/api/catalog/sync")
+async def sync_catalog(request: CatalogSyncRequest):
+    """
+    Apply a batch of catalog upserts and deletes.
+
+    409 with the catalog's version when base_version is not current: resend
+    the changes since that version, or the whole catalog with replace.
+    Batches at or below the current version (except replaces to a lower one) are acknowledged as not applied.
+    """
+    try:
+        result = await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(pet_catalog.sync, request.base_version, request.version,
+                                    [pet.model_dump() for pet in request.upserts], request.deletes, request.replace)
+        )
+    except CatalogConflict as e:
+        CATALOG_SYNCS.inc("conflict")
+        raise HTTPException(status_code=409, detail={"message": str(e), "version": e.version})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    CATALOG_SYNCS.inc("applied" if result["applied"] else "duplicate")
+    return result
+
+@app.get("/api/catalog")
+async def catalog_stats():
+    return (await get_catalog()).stats()
+
+async def resolve_compatibility_pets(request: CompatibilityRequest) -> Tuple[PetRecord, PetRecord]:
+    """
+    Scoring records of both pets; pets sent by id are filled in from the catalog.
+
+    Catalog pets come with their record already encoded, so id requests
+    skip profile validation and encoding entirely.
+    """
+    records = []
+    catalog = None
+    for field in ("pet1", "pet2"):
+        pet, pet_id = getattr(request, field), getattr(request, f"{field}_id")
+        if pet is not None:
+            records.append(PetRecord.from_profile(pet))
+            continue
+        if pet_id is None:
+            raise HTTPException(status_code=400, detail=f"Either {field} or {field}_id is required")
+        catalog = catalog or await get_catalog()
+        entry = catalog.get(pet_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"Pet {pet_id} is not in the catalog")
+        profile, record = entry
+        setattr(request, field, profile)
+        records.append(record)
+    return records[0], records[1]
+
+COMPATIBILITY_ANALYSIS_FALLBACK = "Professional compatibility analysis temporarily unavailable. Please refer to the detailed breakdown above."
+
+def compatibility_analysis_messages(request: CompatibilityRequest, score: float) -> List[Dict[str, str]]:
+    pet1, pet2 = request.pet1, request.pet2
+    return prompts.COMPATIBILITY.render(
+        name1=pet1.name, species1=pet1.species, breed1=pet1.breed, age1=pet1.age, size1=pet1.size,
+        personality1=", ".join(pet1.personality_tags), activity1=getattr(pet1, "activity_level", "Unknown"),
+        name2=pet2.name, species2=pet2.species, breed2=pet2.breed, age2=pet2.age, size2=pet2.size,
+        personality2=", ".join(pet2.personality_tags), activity2=getattr(pet2, "activity_level", "Unknown"),
+        interaction_type=request.interaction_type, score=score
+    ).messages
+
+async def generate_compatibility_analysis(messages: List[Dict[str, str]]) -> str:
+    return await deepseek_client.generate_completion(
+        messages, max_tokens=prompts.COMPATIBILITY.max_tokens, cache_ttl=7200, operation="compatibility"
+    )
+
+def enrichment_reference(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Token record as returned to clients, with where to poll or subscribe for the result"""
+    token = record["token"]
+    return {
+        "token": token,
+        "status": record["status"],
+        "poll_url": f"/api/enrichment/{token}",
+        "stream_url": f"/api/enrichment/{token}/events"
+    }
+
+async def build_enhanced_compatibility(request: CompatibilityRequest, records: Tuple[PetRecord, PetRecord],
+                                       analysis_mode: str = "inline") -> Dict[str, Any]:
+    """
+    Algorithmic breakdown plus, depending on analysis_mode, the AI narrative.
+
+    inline awaits the narrative; deferred queues it on the enrichment queue and
+    returns its token under "enrichment"; none skips the LLM entirely.
+    """
+    logger.info(f"Enhanced compatibility analysis for {request.pet1.name} and {request.pet2.name}")
+    
+    # Get advanced algorithmic analysis, batched with concurrent requests
+    advanced_result = await get_compatibility_batcher().submit(records)
+    result = {
+        **advanced_result,
+        "ai_analysis": None,
+        "interaction_type": request.interaction_type,
+        "calculated_at": datetime.now().isoformat(),
+        "version": "enhanced-2.1"
+    }
+    if analysis_mode == "none":
+        return result
+    
+    messages = compatibility_analysis_messages(request, advanced_result["compatibility_score"])
+    if analysis_mode == "deferred":
+        # Same prompt, same token: repeated requests share one background job
+        token = deepseek_client.generate_cache_key("enrichment", {"messages": messages}).rsplit(":", 1)[1]
+        record = await enrichment_queue.submit(token, "compatibility",
+                                               functools.partial(generate_compatibility_analysis, messages))
+        if record["status"] == "done":
+            result["ai_analysis"] = record["result"]
+        result["enrichment"] = enrichment_reference(record)
+        return result
+    
+    try:
+        result["ai_analysis"] = await generate_compatibility_analysis(messages)
+    except Exception as e:
+        logger.warning(f"AI analysis failed: {e}")
+        result["ai_analysis"] = COMPATIBILITY_ANALYSIS_FALLBACK
+    return result
+
+@app.post("/api/enhanced-compatibility")
+async def enhanced_pet_compatibility(request: CompatibilityRequest):
+    """Enhanced compatibility analysis with detailed breakdown and insights"""
+    records = await resolve_compatibility_pets(request)
+    try:
+        return FastJSONResponse(await build_enhanced_compatibility(request, records, request.analysis_mode or "inline"))
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Enhanced compatibility analysis error: {e}")
         raise HTTPException(
@@ -621,15 +1177,16 @@ Keep response concise but professional."""
 
 @app.post("/api/calculate-compatibility")
 async def calculate_pet_compatibility(request: CompatibilityRequest):
-    """Legacy compatibility endpoint with enhanced backend"""
+    """Legacy compatibility endpoint with enhanced backend; the AI narrative is opt-in via analysis_mode"""
+    records = await resolve_compatibility_pets(request)
     try:
         # Use enhanced analysis but return in legacy format
-        enhanced_result = await enhanced_pet_compatibility(request)
+        enhanced_result = await build_enhanced_compatibility(request, records, request.analysis_mode or "none")
         
-        return {
+        body = {
             "compatibility_score": enhanced_result["compatibility_score"],
             "percentage": enhanced_result["compatibility_score"],
-            "detailed_analysis": enhanced_result.get("ai_analysis", ""),
+            "detailed_analysis": enhanced_result["ai_analysis"] or "",
             "interaction_type": request.interaction_type,
             "calculated_at": enhanced_result["calculated_at"],
             "ai_confidence": enhanced_result["confidence"],
@@ -640,45 +1197,55 @@ async def calculate_pet_compatibility(request: CompatibilityRequest):
                 "personality_overlap": enhanced_result["breakdown"]["personality_match"] > 0.5
             }
         }
+        if "enrichment" in enhanced_result:
+            body["enrichment"] = enhanced_result["enrichment"]
+        return FastJSONResponse(body)
         
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Legacy compatibility calculation error: {e}")
         raise HTTPException(status_code=500, detail=f"Compatibility calculation error: {str(e)}")
 
+@app.get("/api/enrichment/{token}")
+async def get_enrichment(token: str, wait: float = Query(default=0.0, ge=0.0, le=30.0)):
+    """
+    Poll for a deferred AI narrative.
+
+    200 with the result once done (or failed), 202 while pending, 404 for
+    unknown or expired tokens. wait > 0 long-polls up to that many seconds.
+    """
+    record = await (enrichment_queue.wait(token, wait) if wait else enrichment_queue.get(token))
+    if record is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired enrichment token")
+    status_code = 202 if record["status"] == ENRICHMENT_PENDING else 200
+    return FastJSONResponse(record, status_code=status_code)
+
+@app.get("/api/enrichment/{token}/events")
+async def stream_enrichment(token: str):
+    """Server-sent events: the current status now, then the result as soon as it is ready"""
+    return StreamingResponse(
+        enrichment_queue.events(token, timeout=ENRICHMENT_STREAM_TIMEOUT),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/suggest-improvements")
 async def suggest_profile_improvements(pet: PetProfile):
     """Suggest improvements to pet profile using DeepSeek AI"""
     try:
         current_bio = pet.current_bio or "No bio available"
         
-        prompt = f"""As a pet adoption specialist, review this pet profile and suggest improvements to make it more appealing and effective.
-
-Pet Profile:
-- Name: {pet.name}
-- Species: {pet.species}
-- Breed: {pet.breed}
-- Age: {pet.age} years
-- Size: {pet.size}
-- Personality Tags: {', '.join(pet.personality_tags)}
-- Current Bio: {current_bio}
-
-Please provide specific, actionable suggestions for:
-1. Bio improvements (tone, content, structure)
-2. Additional personality tags that might be missing
-3. Photo recommendations
-4. Profile completeness assessment
-5. Appeal optimization for target audience
-
-Focus on making the profile more engaging and likely to result in successful matches."""
-
-        messages = [
-            {"role": "system", "content": "You are an expert pet adoption consultant who helps optimize profiles for maximum appeal and successful matches."},
-            {"role": "user", "content": prompt}
-        ]
+        prompt = prompts.PROFILE_SUGGESTIONS.render(
+            name=pet.name, species=pet.species, breed=pet.breed, age=pet.age, size=pet.size,
+            personality=", ".join(pet.personality_tags), current_bio=current_bio
+        )
         
-        suggestions = await deepseek_client.generate_completion(messages, max_tokens=400)
+        suggestions = await deepseek_client.generate_completion(
+            prompt.messages, max_tokens=prompts.PROFILE_SUGGESTIONS.max_tokens, operation="suggest_improvements"
+        )
         
-        return {
+        return FastJSONResponse({
             "suggestions": suggestions.strip(),
             "profile_score": 85,  # Mock score based on completeness
             "suggested_at": datetime.now().isoformat(),
@@ -687,7 +1254,7 @@ Focus on making the profile more engaging and likely to result in successful mat
                 "Include activity preferences",
                 "Mention ideal home environment"
             ]
-        }
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Suggestion generation error: {str(e)}")
@@ -708,6 +1275,7 @@ async def clear_cache(background_tasks: BackgroundTasks):
         except Exception as e:
             logger.error(f"Cache clear error: {e}")
     
+    completion_cache.forget()  # Stop warming entries that are being cleared
     background_tasks.add_task(clear_cache_task)
     return {"message": "Cache clear initiated", "status": "success"}
 
@@ -728,16 +1296,36 @@ async def get_cache_stats():
             "memory_usage": info.get("used_memory_human"),
             "total_connections": info.get("total_connections_received"),
             "commands_processed": info.get("total_commands_processed"),
-            "uptime_seconds": info.get("uptime_in_seconds")
+            "uptime_seconds": info.get("uptime_in_seconds"),
+            "completions": completion_cache.stats(),
+            "responses": response_cache.codec.stats()
         }
     except Exception as e:
         logger.error(f"Cache stats error: {e}")
         return {"cache": "error", "message": str(e)}
 
+@app.get("/api/prompts/usage")
+async def get_prompt_usage():
+    """Per-endpoint prompt sizes: template cost, estimated tokens sent, trims and upstream-reported usage"""
+    usage = {}
+    for operation, template in prompts.TEMPLATES.items():
+        rendered, estimated = prompts.PROMPT_TOKENS.totals(operation)
+        usage[operation] = {
+            **template.describe(),
+            "rendered": rendered,
+            "estimated_prompt_tokens": int(estimated),
+            "mean_prompt_tokens": round(estimated / rendered, 1) if rendered else None,
+            "trimmed": int(prompts.PROMPT_TRIMMED.value(operation)),
+            "upstream_tokens": {kind: int(LLM_TOKENS.value(operation, kind))
+                                for kind in ("prompt", "prompt_cache_hit", "completion")}
+        }
+    return {"tokenizer": "exact" if prompts.TOKENIZER.exact else "estimate", "operations": usage}
+
 if __name__ == "__main__":
+    import uvicorn
     port = int(os.getenv("PORT", 8000))
     print("🚀 Starting Enhanced PawfectMatch AI Service")
-    print(f"🔑 DeepSeek API: {'Configured' if DEEPSEEK_API_KEY != 'sk-your-deepseek-api-key-here' else 'Mock Mode'}")
+    print(f"🔑 DeepSeek API: {'Configured' if DEEPSEEK_API_KEY != MOCK_API_KEY else 'Mock Mode'}")
     print(f"🗄️  Redis Cache: {'Enabled' if redis_client else 'Disabled'}")
     print(f"📚 Breed Knowledge: {len(deepseek_client.breed_knowledge)} species loaded")
     print(f"🌐 Service URL: http://localhost:{port}")
@@ -746,9 +1334,15 @@ if __name__ == "__main__":
     print("   • /api/analyze-photo - Photo analysis and insights") 
     print("   • /api/enhanced-compatibility - Advanced compatibility analysis")
     print("   • /api/calculate-compatibility - Legacy compatibility (enhanced backend)")
+    print("   • /api/enrichment/{token} - Deferred AI analysis (poll or /events for SSE)")
     print("   • /api/suggest-improvements - Profile improvement suggestions")
+    print("   • /api/photos/check-duplicate - Near-duplicate photo detection")
+    print("   • /api/cohorts/{cohort}/... - Precomputed cohort compatibility, top matches and partial pet updates")
+    print("   • /api/generate-bios - Batched bio generation for many pets")
     print("   • /api/cache/stats - Cache statistics")
+    print("   • /api/prompts/usage - Prompt token usage per endpoint")
     print("   • /api/cache/clear - Clear cache")
+    print("   • /metrics - Prometheus-style service metrics")
     
     uvicorn.run(
         "deepseek_app:app",
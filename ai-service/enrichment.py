@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Deferred AI enrichment for the PawfectMatch AI service
+Algorithmic results return immediately; LLM narratives are generated by a background queue and fetched by token
+"""
+
+import time
+import asyncio
+import functools
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import fast_json
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ENRICHMENT_QUEUE_DEPTH = REGISTRY.gauge("enrichment_queue_depth", "Enrichment jobs waiting for a worker")
+ENRICHMENT_JOBS = REGISTRY.counter("enrichment_jobs_total", "Enrichment jobs by kind and result", ("kind", "result"))
+ENRICHMENT_DURATION = REGISTRY.histogram("enrichment_job_duration_seconds", "Time from enqueue to finished narrative",
+                                         ("kind",))
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+REJECTED = "rejected"
+
+# Replaces a record only if it is still the one read (a failed job, or a pending one whose owner stopped renewing)
+TAKE_OVER = ('if redis.call("get", KEYS[1]) == ARGV[1] then '
+             'return redis.call("set", KEYS[1], ARGV[2], "EX", ARGV[3]) end return 0')
+
+
+class EnrichmentQueue:
+    """
+    Runs LLM enrichment jobs in background tasks and keeps their results by token.
+
+    submit() returns at once with a token record; a fixed number of worker
+    tasks drain a bounded queue, so a burst of requests cannot open more
+    upstream calls than `workers`. When the queue is full the job is recorded
+    as rejected instead of queued. Tokens are derived from the job inputs by
+    the caller, so identical requests share one job and one result.
+
+    Records live in a bounded in-process LRU and, when the client getter
+    returns a Redis client (decode_responses=True), are written through to
+    Redis so any service worker can answer a poll for the token. A token is
+    claimed locally before submit() first awaits and in Redis with SET NX,
+    so concurrent submits in one or several workers queue the job once, and
+    a pending record never replaces a done one.
+
+    A pending claim is a lease: the owning process rewrites its pending
+    records every claim_ttl / 3 seconds, and one not renewed for claim_ttl
+    (the owner crashed) reads as failed and may be taken over by the next
+    submit, atomically, so only one worker does. stop() marks every job it
+    abandons as failed for the same retry path.
+    """
+
+    def __init__(self, client_getter: Callable[[], Any], workers: int = 4, max_queue: int = 256,
+                 ttl: int = 3600, max_local: int = 10000, namespace: str = "deepseek:enrichment",
+                 claim_ttl: float = 120.0):
+        self.client_getter = client_getter
+        self.workers = workers
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+        self.max_local = max_local
+        self.namespace = namespace
+        self._max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._events: Dict[str, asyncio.Event] = {}
+        self._owned: Dict[str, str] = {}  # token -> kind of jobs queued or running here
+        self._lease_lock = asyncio.Lock()  # orders lease renewals before the final record of a job
+
+    def start(self) -> None:
+        """Start the worker tasks on the running loop; called lazily by the first submit"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self._max_queue)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._renew_leases()))
+
+    async def stop(self) -> None:
+        """Cancel the workers and record the jobs they leave behind as failed, so a resubmit retries them"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+                ENRICHMENT_QUEUE_DEPTH.dec()
+        for token, kind in list(self._owned.items()):
+            await self._finish(self._record(token, kind, FAILED, error="Enrichment was interrupted, retry"))
+
+    async def submit(self, token: str, kind: str, job: Callable[[], Awaitable[str]]) -> Dict[str, Any]:
+        """Queue job under token unless it is already pending or done; returns the current record"""
+        existing = self._local(token)
+        if existing is not None and existing["status"] in (PENDING, DONE):
+            return existing
+        self.start()
+        record = self._record(token, kind, PENDING)
+        self._store_local(record)
+        self._events[token] = asyncio.Event()
+        existing = await self._claim(record)
+        if existing is not None:
+            # Another worker owns the job; polls for the token read its record from Redis
+            self._records.pop(token, None)
+            self._wake(token)
+            return existing
+        try:
+            self._queue.put_nowait((token, kind, job, time.perf_counter()))
+        except asyncio.QueueFull:
+            ENRICHMENT_JOBS.inc(kind, REJECTED)
+            record = self._record(token, kind, REJECTED, error="Enrichment queue is full, retry later")
+            self._wake(token)
+            await self._store(record)
+            return record
+        self._owned[token] = kind
+        ENRICHMENT_QUEUE_DEPTH.inc()
+        return record
+
+    async def get(self, token: str) -> Optional[Dict[str, Any]]:
+        record = self._local(token)
+        if record is not None:
+            return record
+        client = self.client_getter()
+        if client is None:
+            return None
+        try:
+            raw = await asyncio.get_event_loop().run_in_executor(None, client.get, self._key(token))
+        except Exception as e:
+            logger.warning(f"Enrichment record retrieval error: {e}")
+            return None
+        if not raw:
+            return None
+        record = fast_json.loads(raw)
+        if self._abandoned(record):
+            return {**record, "status": FAILED, "error": "Enrichment was interrupted, retry"}
+        return record
+
+    async def wait(self, token: str, timeout: float, poll_interval: float = 0.5) -> Optional[Dict[str, Any]]:
+        """Wait until the token leaves the pending state or timeout elapses; returns the latest record"""
+        deadline = time.monotonic() + timeout
+        while True:
+            record = await self.get(token)
+            remaining = deadline - time.monotonic()
+            if record is None or record["status"] != PENDING or remaining <= 0:
+                return record
+            event = self._events.get(token)
+            if event is not None:
+                # Job runs in this process: wake exactly when it finishes
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # Job runs in another worker process: poll the shared store
+                await asyncio.sleep(min(poll_interval, remaining))
+
+    async def events(self, token: str, timeout: float, keepalive: float = 15.0) -> AsyncIterator[bytes]:
+        """Server-sent events for one token: the current record, then the final one once it is ready"""
+        record = await self.get(token)
+        yield _sse(record["status"] if record else "unknown", record or {"token": token})
+        deadline = time.monotonic() + timeout
+        while record is not None and record["status"] == PENDING:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            record = await self.wait(token, min(keepalive, remaining))
+            if record is not None and record["status"] == PENDING:
+                yield b": keep-alive\n\n"
+        if record is not None and record["status"] != PENDING:
+            yield _sse(record["status"], record)
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            token, kind, job, enqueued_at = await self._queue.get()
+            ENRICHMENT_QUEUE_DEPTH.dec()
+            try:
+                result = await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Enrichment job {kind} failed: {e}")
+                ENRICHMENT_JOBS.inc(kind, FAILED)
+                record = self._record(token, kind, FAILED, error=str(e))
+            else:
+                ENRICHMENT_JOBS.inc(kind, DONE)
+                record = self._record(token, kind, DONE, result=result)
+            ENRICHMENT_DURATION.observe(time.perf_counter() - enqueued_at, kind)
+            await self._finish(record)
+            self._queue.task_done()
+
+    async def _finish(self, record: Dict[str, Any]) -> None:
+        """Store a job's final record; no lease renewal can land after it"""
+        async with self._lease_lock:
+            self._owned.pop(record["token"], None)
+            await self._store(record)
+        self._wake(record["token"])
+
+    async def _renew_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.claim_ttl / 3)
+            client = self.client_getter()
+            if client is None or not self._owned:
+                continue
+            async with self._lease_lock:
+                records = [self._record(token, kind, PENDING) for token, kind in self._owned.items()]
+                for record in records:
+                    self._store_local(record)
+                try:
+                    await asyncio.get_event_loop().run_in_executor(None, self._write_all, client, records)
+                except Exception as e:
+                    logger.warning(f"Enrichment lease renewal error: {e}")
+
+    def _write_all(self, client: Any, records: List[Dict[str, Any]]) -> None:
+        pipe = client.pipeline(transaction=False)
+        for record in records:
+            pipe.setex(self._key(record["token"]), self.ttl, fast_json.dumps(record))
+        pipe.execute()
+
+    def _abandoned(self, record: Dict[str, Any]) -> bool:
+        """A pending record whose owner stopped renewing its lease"""
+        return record["status"] == PENDING and time.time() - record["updated_at"] > self.claim_ttl
+
+    def _wake(self, token: str) -> None:
+        event = self._events.pop(token, None)
+        if event is not None:
+            event.set()
+
+    def _record(self, token: str, kind: str, status: str, result: Optional[str] = None,
+                error: Optional[str] = None) -> Dict[str, Any]:
+        record = {"token": token, "kind": kind, "status": status, "updated_at": time.time(),
+                  "expires_at": time.time() + self.ttl}
+        if result is not None:
+            record["result"] = result
+        if error is not None:
+            record["error"] = error
+        return record
+
+    def _key(self, token: str) -> str:
+        return f"{self.namespace}:{token}"
+
+    def _local(self, token: str) -> Optional[Dict[str, Any]]:
+        record = self._records.get(token)
+        if record is not None and record["expires_at"] > time.time():
+            self._records.move_to_end(token)
+            return record
+        return None
+
+    def _store_local(self, record: Dict[str, Any]) -> None:
+        self._records[record["token"]] = record
+        self._records.move_to_end(record["token"])
+        while len(self._records) > self.max_local:
+            self._records.popitem(last=False)
+
+    async def _store(self, record: Dict[str, Any]) -> None:
+        self._store_local(record)
+        client = self.client_getter()
+        if client is None:
+            return
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None, client.setex, self._key(record["token"]), self.ttl, fast_json.dumps(record)
+            )
+        except Exception as e:
+            logger.warning(f"Enrichment record storage error: {e}")
+
+    async def _claim(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Write a new pending record to Redis; returns the live pending or done record found there instead"""
+        client = self.client_getter()
+        if client is None:
+            return None
+        key, value = self._key(record["token"]), fast_json.dumps(record)
+        loop = asyncio.get_event_loop()
+        existing = None
+        try:
+            for _ in range(3):
+                if await loop.run_in_executor(None, functools.partial(client.set, key, value, nx=True, ex=self.ttl)):
+                    return None
+                raw = await loop.run_in_executor(None, client.get, key)
+                if not raw:
+                    continue  # expired in between: claim it with SET NX again
+                existing = fast_json.loads(raw)
+                if existing["status"] == DONE or (existing["status"] == PENDING and not self._abandoned(existing)):
+                    return existing
+                # Failed, rejected or abandoned: this submit retries the job unless another one took it over first
+                if await loop.run_in_executor(None, client.eval, TAKE_OVER, 1, key, raw, value, self.ttl):
+                    return None
+        except Exception as e:
+            logger.warning(f"Enrichment record storage error: {e}")
+            return None
+        return existing
+
+
+def _sse(event: str, data: Dict[str, Any]) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + fast_json.dumps(data) + b"\n\n"
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Fast JSON responses for the PawfectMatch AI services
+orjson-backed bytes serialization with a stdlib fallback, plus pass-through for pre-encoded payloads
+"""
+
+import json
+from datetime import date, datetime
+from typing import Any, Optional, Union
+
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # optional accelerator; the stdlib encoder produces the same JSON
+    orjson = None
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def _default(value: Any) -> Any:
+    """Encode the few non-JSON types endpoints hand back (orjson handles datetimes natively)"""
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize straight to UTF-8 bytes, compact and without NaN, like Starlette's JSONResponse"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                      default=_default).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson when available.
+
+    Returning an instance from an endpoint bypasses FastAPI's jsonable_encoder
+    pass, so content must already be plain dicts/lists/scalars (datetimes and
+    Pydantic models are handled by the encoder's default hook).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RawJSONResponse(Response):
+    """Send an already-serialized JSON document (e.g. a cache hit) without decoding it"""
+
+    media_type = JSON_MEDIA_TYPE
+
+    def __init__(self, content: Union[bytes, str], status_code: int = 200,
+                 headers: Optional[dict] = None, **kwargs):
+        super().__init__(content=content, status_code=status_code, headers=headers, **kwargs)
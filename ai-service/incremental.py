@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Change-aware compatibility re-scoring
+Maps profile fields to the breakdown components that read them and keeps exact per-pet component rows
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+import numpy as np
+
+from compatibility import WEIGHTS, PetRecord
+
+COMPONENTS = tuple(WEIGHTS)
+COMPONENT_INDEX = {name: i for i, name in enumerate(COMPONENTS)}
+ALL_COMPONENTS: FrozenSet[str] = frozenset(COMPONENTS)
+
+# Which breakdown components read which PetProfile fields
+COMPONENT_DEPENDENCIES: Dict[str, FrozenSet[str]] = {
+    "species_match": frozenset({"species"}),
+    "breed_compatibility": frozenset({"species", "breed"}),
+    "personality_match": frozenset({"personality_tags"}),
+    "size_compatibility": frozenset({"size"}),
+    "age_compatibility": frozenset({"age"}),
+    "activity_match": frozenset({"activity_level"}),
+}
+
+# PetProfile field behind each PetRecord slot
+RECORD_FIELDS = {
+    "species": "species",
+    "breed": "breed",
+    "tags": "personality_tags",
+    "size": "size",
+    "age": "age",
+    "activity": "activity_level",
+}
+
+
+def affected_components(fields: Iterable[str]) -> FrozenSet[str]:
+    """Components whose value can change when the given profile fields change"""
+    fields = set(fields)
+    return frozenset(name for name, depends_on in COMPONENT_DEPENDENCIES.items() if depends_on & fields)
+
+
+def changed_fields(old: Optional[PetRecord], new: PetRecord) -> Set[str]:
+    """Profile fields that differ between two records of the same pet; every field for a new pet"""
+    if old is None:
+        return set(RECORD_FIELDS.values())
+    return {field for slot, field in RECORD_FIELDS.items() if getattr(old, slot) != getattr(new, slot)}
+
+
+class PartialScoreCache:
+    """
+    Exact per-component scores of recently edited pets against every slot.
+
+    Each cached row is a (components, capacity) float64 array for one pet.
+    When that pet changes again only the affected components are recomputed,
+    and its overall scores are recombined from the row; when any other pet
+    changes, the owner of the matrix patches that pet's column in every
+    cached row. Rows are evicted least-recently-used beyond max_rows, so
+    memory is bounded at max_rows * 48 bytes * capacity.
+    """
+
+    def __init__(self, max_rows: int = 256):
+        self.max_rows = max_rows
+        self._rows: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get(self, slot: int) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._rows.get(slot)
+            if row is not None:
+                self._rows.move_to_end(slot)
+            return row
+
+    def put(self, slot: int, row: np.ndarray) -> None:
+        if self.max_rows <= 0:
+            return
+        with self._lock:
+            self._rows[slot] = row
+            self._rows.move_to_end(slot)
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+
+    def slots(self) -> List[int]:
+        with self._lock:
+            return list(self._rows)
+
+    def discard(self, slot: int) -> None:
+        with self._lock:
+            self._rows.pop(slot, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows.clear()
+
+    def grow(self, capacity: int) -> None:
+        """Widen cached rows after the matrix grew; new slots are filled in as pets are added"""
+        with self._lock:
+            for slot, row in self._rows.items():
+                if row.shape[1] < capacity:
+                    wider = np.full((len(COMPONENTS), capacity), np.nan)
+                    wider[:, :row.shape[1]] = row
+                    self._rows[slot] = wider
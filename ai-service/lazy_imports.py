@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Deferred module loading for faster AI service cold starts
+Heavy optional dependencies are bound at import time but only executed on first attribute access
+"""
+
+import sys
+import threading
+import importlib
+import importlib.util
+from types import ModuleType
+
+# Serialises first loads; importlib.util.LazyLoader is not thread-safe before Python 3.12
+_LOAD_LOCK = threading.RLock()
+
+
+class _LazyModule(ModuleType):
+    """
+    Stand-in for a module that imports it on the first missing attribute.
+
+    The real module is imported normally (under the import system's own
+    locks) and its namespace copied into the stand-in in one step, so a
+    thread racing the warm-up either finds the attribute or waits for the
+    import; it never sees a half-executed module.
+    """
+
+    def __getattr__(self, attr: str):
+        return getattr(_load(self), attr)
+
+
+def _load(proxy: _LazyModule) -> ModuleType:
+    with _LOAD_LOCK:
+        module = importlib.import_module(proxy.__name__)
+        if proxy.__spec__ is not module.__spec__:
+            proxy.__dict__.update(module.__dict__)
+        return module
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Return `name` as a module whose body runs on first attribute access.
+
+    Raises ImportError immediately if the module is not installed, so optional
+    dependency checks (try/except ImportError) keep working unchanged. Safe to
+    trigger from several threads at once, e.g. a warm-up executor and requests.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
+
+
+def preload(*modules: ModuleType) -> None:
+    """Force lazily imported modules to finish loading (e.g. from a startup task)."""
+    for module in modules:
+        if isinstance(module, _LazyModule):
+            _load(module)
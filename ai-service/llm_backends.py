@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Pluggable LLM backends for the PawfectMatch AI service
+DeepSeek over HTTP, canned mock answers, and record/replay of real exchanges for offline benchmarking
+"""
+
+import os
+import abc
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from itertools import count
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+
+import fast_json
+from lazy_imports import lazy_import
+from metrics import REGISTRY
+
+aiohttp = lazy_import("aiohttp")
+
+logger = logging.getLogger(__name__)
+
+# Placeholder key that selects the mock backend when LLM_BACKEND is auto
+MOCK_API_KEY = "sk-your-deepseek-api-key-here"
+
+UPSTREAM_LATENCY = REGISTRY.histogram("deepseek_request_duration_seconds", "DeepSeek API call latency per attempt",
+                                      ("outcome",))
+UPSTREAM_RETRIES = REGISTRY.counter("deepseek_retries_total", "DeepSeek API retries by reason", ("reason",))
+UPSTREAM_RATE_LIMITED = REGISTRY.counter("deepseek_rate_limited_total", "DeepSeek API 429 responses")
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "LLM tokens used by operation and kind", ("operation", "kind"))
+# Time inside the backend per completion; request latency minus this is the service's own overhead
+BACKEND_LATENCY = REGISTRY.histogram("llm_backend_duration_seconds", "Time spent in the LLM backend per completion",
+                                     ("backend", "operation"))
+REPLAY_REQUESTS = REGISTRY.counter("llm_replay_requests_total", "Replayed completions by how they were matched",
+                                   ("result",))
+
+
+def exchange_key(model: str, messages: List[Dict[str, str]], max_tokens: int,
+                 response_format: Optional[Dict[str, str]] = None) -> str:
+    """Identity of a completion request, shared by the recorder, the replayer and the bench stub"""
+    canonical = json.dumps([model, max_tokens, response_format, messages], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def load_recordings(path: str) -> List[Dict[str, Any]]:
+    """Exchanges from a recording file, skipping lines truncated by an interrupted write"""
+    exchanges = []
+    with open(path, "rb") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                exchanges.append(fast_json.loads(line))
+            except ValueError:
+                logger.warning(f"Skipping unreadable recording line {number} in {path}")
+    return exchanges
+
+
+def parse_routes(setting: str) -> Dict[str, str]:
+    """'analyze_photo=small-model,suggest_improvements=small-model' -> {operation: model}"""
+    routes = {}
+    for item in setting.split(","):
+        if "=" in item:
+            operation, model = item.split("=", 1)
+            routes[operation.strip()] = model.strip()
+    return routes
+
+
+class LLMBackend(abc.ABC):
+    """A chat completion source; complete() returns the assistant message text"""
+    name = "base"
+
+    @abc.abstractmethod
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, model: str,
+                       operation: str = "completion", response_format: Optional[Dict[str, str]] = None) -> str:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class DeepSeekBackend(LLMBackend):
+    """DeepSeek's OpenAI-compatible chat completions API with retries on 429, timeouts and connection errors"""
+    name = "deepseek"
+
+    def __init__(self, api_key: str, base_url: str, max_retries: int = 3, timeout: float = 30):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, model: str,
+                       operation: str = "completion", response_format: Optional[Dict[str, str]] = None) -> str:
+        return await self._call_deepseek_api(messages, max_tokens, model, operation, response_format)
+
+    async def _call_deepseek_api(self, messages: List[Dict[str, str]], max_tokens: int, model: str,
+                                 operation: str, response_format: Optional[Dict[str, str]]) -> str:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "stream": False
+        }
+        if response_format is not None:
+            payload["response_format"] = response_format
+
+        for attempt in range(self.max_retries):
+            started = time.perf_counter()
+            try:
+                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+                    async with session.post(
+                        f"{self.base_url}/chat/completions",
+                        headers=headers,
+                        json=payload
+                    ) as response:
+                        if response.status == 200:
+                            data = await response.json()
+                            UPSTREAM_LATENCY.observe(time.perf_counter() - started, "ok")
+                            usage = data.get("usage") or {}
+                            LLM_TOKENS.inc(operation, "prompt", amount=usage.get("prompt_tokens", 0))
+                            LLM_TOKENS.inc(operation, "completion", amount=usage.get("completion_tokens", 0))
+                            # DeepSeek reports how much of the prompt its context cache served
+                            if "prompt_cache_hit_tokens" in usage:
+                                LLM_TOKENS.inc(operation, "prompt_cache_hit", amount=usage["prompt_cache_hit_tokens"])
+                            return data["choices"][0]["message"]["content"]
+                        UPSTREAM_LATENCY.observe(time.perf_counter() - started, str(response.status))
+                        if response.status == 429:  # Rate limit
+                            UPSTREAM_RATE_LIMITED.inc()
+                            if attempt < self.max_retries - 1:
+                                UPSTREAM_RETRIES.inc("rate_limited")
+                                await asyncio.sleep(2 ** attempt)
+                                continue
+
+                        error_text = await response.text()
+                        logger.error(f"DeepSeek API error: {error_text}")
+                        raise HTTPException(
+                            status_code=response.status,
+                            detail=f"DeepSeek API error: {error_text}"
+                        )
+
+            except asyncio.TimeoutError:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, "timeout")
+                if attempt < self.max_retries - 1:
+                    UPSTREAM_RETRIES.inc("timeout")
+                    logger.warning(f"Timeout on attempt {attempt + 1}, retrying...")
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                raise HTTPException(status_code=504, detail="DeepSeek API timeout")
+            except aiohttp.ClientError as e:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, "client_error")
+                if attempt < self.max_retries - 1:
+                    UPSTREAM_RETRIES.inc("client_error")
+                    logger.warning(f"Client error on attempt {attempt + 1}: {e}, retrying...")
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                raise HTTPException(status_code=503, detail=f"API connection error: {str(e)}")
+
+        raise HTTPException(status_code=503, detail="DeepSeek API unavailable after retries")
+
+
+class MockBackend(LLMBackend):
+    """Canned answers picked by keywords in the last message; no network, no latency"""
+    name = "mock"
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, model: str,
+                       operation: str = "completion", response_format: Optional[Dict[str, str]] = None) -> str:
+        return self.respond(messages)
+
+    @staticmethod
+    def respond(messages: List[Dict[str, str]]) -> str:
+        """Enhanced mock responses based on context"""
+        last_message = messages[-1]["content"].lower()
+
+        if "return only a json object that maps each pet's id to its bio" in last_message:
+            pet_ids = [fast_json.loads(line)["id"] for line in messages[-1]["content"].splitlines()
+                       if line.startswith('{"id"')]
+            return fast_json.dumps({pet_id: f"Meet {pet_id}, a wonderful pet looking for a loving family to share "
+                                    "adventures with!" for pet_id in pet_ids}).decode()
+        elif "bio" in last_message or "description" in last_message:
+            return "Meet this wonderful pet who brings joy and companionship wherever they go! With their unique personality and loving nature, they're searching for the perfect family to share adventures with. Their playful spirit and gentle heart make them an ideal companion for the right match."
+        elif "analyze" in last_message or "photo" in last_message:
+            return "This pet displays excellent characteristics including bright, alert eyes and confident body language. They appear well-socialized and healthy, with signs of an active, engaging personality that would thrive in a loving environment."
+        elif "compatibility" in last_message:
+            return "These pets demonstrate strong compatibility potential. Their similar energy levels, complementary personalities, and matching social needs suggest they would form a positive relationship with proper introduction and ongoing supervision."
+        else:
+            return "I'm here to provide detailed AI-powered analysis for pet matching, bio generation, and compatibility assessment!"
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Passes requests to another backend and appends each exchange to a JSON-lines file.
+
+    Every line holds the request (model, messages, max_tokens,
+    response_format), the response text and the observed latency, keyed by
+    exchange_key(). Failed calls are not recorded. Recordings contain the
+    prompts as sent, so treat the file like request logs.
+    """
+    name = "record"
+
+    def __init__(self, inner: LLMBackend, path: str):
+        self.inner = inner
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, model: str,
+                       operation: str = "completion", response_format: Optional[Dict[str, str]] = None) -> str:
+        started = time.perf_counter()
+        response = await self.inner.complete(messages, max_tokens, model, operation, response_format)
+        line = fast_json.dumps({
+            "key": exchange_key(model, messages, max_tokens, response_format),
+            "operation": operation,
+            "model": model,
+            "max_tokens": max_tokens,
+            "response_format": response_format,
+            "messages": messages,
+            "response": response,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "recorded_at": time.time()
+        }) + b"\n"
+        # Disk writes (and a slow flush) stay off the event loop
+        await asyncio.get_event_loop().run_in_executor(None, self._append, line)
+        return response
+
+    def _append(self, line: bytes) -> None:
+        # One write per line keeps lines whole even with several workers appending to the same file
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+        self.inner.close()
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Answers from a recording file instead of calling upstream.
+
+    Requests are matched on exchange_key(). On a miss, `on_miss` decides:
+    "operation" replays the recordings of the same operation round-robin
+    (load tests with synthetic payloads rarely reproduce recorded prompts
+    exactly), "mock" falls back to MockBackend and "error" returns a 502.
+    Each answer is delayed by latency_ms when set, otherwise by the recorded
+    latency times latency_scale.
+    """
+    name = "replay"
+
+    def __init__(self, path: str, latency_ms: Optional[float] = None, latency_scale: float = 1.0,
+                 on_miss: str = "operation"):
+        self.path = path
+        self.latency_ms = latency_ms
+        self.latency_scale = latency_scale
+        self.on_miss = on_miss
+        self._exchanges: Dict[str, Dict[str, Any]] = {}
+        self._by_operation: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._turns = defaultdict(count)
+        for exchange in load_recordings(path):
+            self._exchanges[exchange["key"]] = exchange
+            self._by_operation[exchange["operation"]].append(exchange)
+        logger.info(f"Replaying {len(self._exchanges)} recorded LLM exchanges from {path}")
+
+    def __len__(self) -> int:
+        return len(self._exchanges)
+
+    def lookup(self, key: str, operation: str) -> Optional[Dict[str, Any]]:
+        exchange = self._exchanges.get(key)
+        if exchange is not None:
+            REPLAY_REQUESTS.inc("exact")
+            return exchange
+        candidates = self._by_operation.get(operation)
+        if self.on_miss == "operation" and candidates:
+            REPLAY_REQUESTS.inc("operation")
+            return candidates[next(self._turns[operation]) % len(candidates)]
+        REPLAY_REQUESTS.inc("miss")
+        return None
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, model: str,
+                       operation: str = "completion", response_format: Optional[Dict[str, str]] = None) -> str:
+        exchange = self.lookup(exchange_key(model, messages, max_tokens, response_format), operation)
+        if exchange is None:
+            if self.on_miss == "mock":
+                return MockBackend.respond(messages)
+            raise HTTPException(status_code=502, detail=f"No recorded LLM response for this {operation} request")
+        delay = self.latency_ms if self.latency_ms is not None else exchange["latency_ms"] * self.latency_scale
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        return exchange["response"]
+
+
+def create_backend(kind: str, api_key: str, base_url: str, recording_path: str = "./data/llm_recordings.jsonl",
+                   replay_latency_ms: Optional[float] = None, replay_latency_scale: float = 1.0,
+                   replay_on_miss: str = "operation") -> LLMBackend:
+    """Backend for an LLM_BACKEND setting: deepseek, mock, record (DeepSeek, recorded) or replay"""
+    if kind in ("deepseek", "auto"):
+        return DeepSeekBackend(api_key, base_url)
+    if kind == "mock":
+        return MockBackend()
+    if kind == "record":
+        return RecordingBackend(DeepSeekBackend(api_key, base_url), recording_path)
+    if kind == "replay":
+        return ReplayBackend(recording_path, replay_latency_ms, replay_latency_scale, replay_on_miss)
+    raise ValueError(f"Unknown LLM backend: {kind!r}")
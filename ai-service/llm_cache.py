@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Stale-while-revalidate cache for LLM completions
+Expired entries are served at once and refreshed in the background; a warmer refreshes popular keys before they expire
+"""
+
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from cache_codec import CacheCodec
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CACHE_REFRESHES = REGISTRY.counter("ai_cache_refreshes_total", "Background cache refreshes by trigger and result",
+                                   ("operation", "trigger", "result"))
+CACHE_TRACKED_KEYS = REGISTRY.gauge("ai_cache_tracked_keys", "Cache keys tracked for warming in this worker")
+
+Producer = Callable[[], Awaitable[str]]
+
+# Deletes the refresh lock only while it still holds this refresher's token, so a refresh that outlived
+# lock_ttl cannot release a lock another worker has taken since
+RELEASE_LOCK = 'if redis.call("get", KEYS[1]) == ARGV[1] then return redis.call("del", KEYS[1]) end return 0'
+
+
+class _Tracked:
+    __slots__ = ("operation", "ttl", "producer", "hits")
+
+    def __init__(self, operation: str, ttl: int, producer: Producer):
+        self.operation = operation
+        self.ttl = ttl
+        self.producer = producer
+        self.hits = 0.0
+
+
+class CompletionCache:
+    """
+    Redis-backed completion cache with a soft and a hard TTL.
+
+    An entry is fresh for its soft TTL (the caller's cache_ttl) and is kept
+    for stale_ttl seconds more; freshness is read from the key's remaining
+    Redis TTL, so the stored value is only the codec-encoded text. The client
+    must not decode responses. A stale hit is returned immediately and
+    regenerated in the background.
+
+    Refreshes are deduplicated within the worker (one task per key) and
+    across workers (a short SET NX lock next to the key, released only by
+    its owner), and at most
+    refresh_concurrency run at once. Lookups are counted per key with
+    periodic halving; every warm_interval the warm_top most requested keys
+    whose fresh time runs out before the next pass are refreshed ahead of
+    expiry, so popular entries never go stale at all. Tracking is per worker
+    and bounded to track_max keys (least recently used dropped).
+    """
+
+    def __init__(self, client_getter: Callable[[], Any], stale_ttl: int = 3600, lock_ttl: int = 60,
+                 refresh_concurrency: int = 4, track_max: int = 5000, warm_top: int = 100,
+                 warm_interval: float = 60.0, warm_min_hits: float = 3.0, codec: Optional[CacheCodec] = None):
+        self.client_getter = client_getter
+        self.codec = codec or CacheCodec("completions", "none")
+        self.stale_ttl = stale_ttl
+        self.lock_ttl = lock_ttl
+        self.track_max = track_max
+        self.warm_top = warm_top
+        self.warm_interval = warm_interval
+        self.warm_min_hits = warm_min_hits
+        self._refresh_slots = asyncio.Semaphore(refresh_concurrency)
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._tracked: "OrderedDict[str, _Tracked]" = OrderedDict()
+        self._warmer: Optional[asyncio.Task] = None
+
+    async def lookup(self, key: str) -> Tuple[Optional[str], bool]:
+        """(value, fresh); value is None on a miss or when the cache is unavailable"""
+        client = self.client_getter()
+        if client is None:
+            return None, False
+        try:
+            value, remaining = await asyncio.get_event_loop().run_in_executor(None, _get_with_ttl, client, key)
+        except Exception as e:
+            logger.warning(f"Cache retrieval error: {e}")
+            return None, False
+        value = self.codec.decode_text(value)
+        # -1: no expiry (written without a TTL)
+        return value, value is not None and (remaining == -1 or remaining > self.stale_ttl)
+
+    async def store(self, key: str, value: str, ttl: int) -> None:
+        client = self.client_getter()
+        if client is None:
+            return
+        entry = self.codec.encode(value)
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, client.setex, key, ttl + self.stale_ttl, entry)
+        except Exception as e:
+            logger.warning(f"Cache storage error: {e}")
+
+    def track(self, key: str, operation: str, ttl: int, producer: Producer) -> None:
+        """Count a lookup of key and remember how to regenerate it"""
+        entry = self._tracked.get(key)
+        if entry is None:
+            entry = self._tracked[key] = _Tracked(operation, ttl, producer)
+            if len(self._tracked) > self.track_max:
+                self._tracked.popitem(last=False)
+        else:
+            self._tracked.move_to_end(key)
+        entry.hits += 1
+
+    def forget(self) -> None:
+        self._tracked.clear()
+
+    def revalidate(self, key: str, operation: str, ttl: int, producer: Producer, trigger: str = "stale") -> None:
+        """Regenerate key in the background unless this worker is already doing so"""
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        task = asyncio.create_task(self._refresh(key, operation, ttl, producer, trigger))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, key: str, operation: str, ttl: int, producer: Producer, trigger: str) -> None:
+        try:
+            async with self._refresh_slots:
+                token = await self._acquire(key)
+                if token is None:
+                    CACHE_REFRESHES.inc(operation, trigger, "skipped")
+                    return
+                try:
+                    value = await producer()
+                    await self.store(key, value, ttl)
+                    CACHE_REFRESHES.inc(operation, trigger, "ok")
+                except Exception as e:
+                    # The stale value stays until its hard TTL; the next stale hit retries
+                    logger.warning(f"Cache refresh of {key} failed: {e}")
+                    CACHE_REFRESHES.inc(operation, trigger, "error")
+                finally:
+                    await self._release(key, token)
+        finally:
+            self._refreshing.discard(key)
+
+    async def _acquire(self, key: str) -> Optional[str]:
+        """Take the cross-worker refresh lock; returns its token, or None if another refresher holds it"""
+        token = uuid.uuid4().hex
+        client = self.client_getter()
+        if client is None:
+            return token  # without a cache there is nothing to coordinate
+        try:
+            acquired = await asyncio.get_event_loop().run_in_executor(
+                None, lambda: client.set(f"{key}:refreshing", token, nx=True, ex=self.lock_ttl)
+            )
+        except Exception as e:
+            logger.warning(f"Cache refresh lock error: {e}")
+            return token
+        return token if acquired else None
+
+    async def _release(self, key: str, token: str) -> None:
+        client = self.client_getter()
+        if client is None:
+            return
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, client.eval, RELEASE_LOCK, 1,
+                                                           f"{key}:refreshing", token)
+        except Exception as e:
+            logger.warning(f"Cache refresh lock error: {e}")
+
+    def start(self) -> None:
+        """Start the warmer on the running loop"""
+        if self._warmer is None and self.warm_interval > 0 and self.warm_top > 0:
+            self._warmer = asyncio.create_task(self._warm_loop())
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks) + ([self._warmer] if self._warmer is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._warmer = None
+
+    async def _warm_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.warm_interval)
+            try:
+                await self.warm()
+            except Exception as e:
+                logger.warning(f"Cache warming failed: {e}")
+
+    async def warm(self) -> int:
+        """Refresh the hottest keys that would go stale before the next pass; returns how many were queued"""
+        hot = sorted(((entry.hits, key) for key, entry in self._tracked.items() if entry.hits >= self.warm_min_hits),
+                     reverse=True)[:self.warm_top]
+        # Halve every count so popularity reflects the last few intervals
+        for entry in self._tracked.values():
+            entry.hits /= 2
+        CACHE_TRACKED_KEYS.set(value=len(self._tracked))
+        client = self.client_getter()
+        if client is None or not hot:
+            return 0
+        keys = [key for _, key in hot]
+        remaining = await asyncio.get_event_loop().run_in_executor(None, _ttls, client, keys)
+        # Fresh time left must cover the next pass, plus one more for the refresh itself
+        horizon = self.stale_ttl + 2 * self.warm_interval
+        queued = 0
+        for key, ttl in zip(keys, remaining):
+            if ttl == -1 or ttl > horizon:
+                continue
+            entry = self._tracked.get(key)
+            if entry is not None:
+                self.revalidate(key, entry.operation, entry.ttl, entry.producer, trigger="warm")
+                queued += 1
+        return queued
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tracked_keys": len(self._tracked), "refreshing": len(self._refreshing),
+                "stale_ttl": self.stale_ttl, "warm_interval": self.warm_interval, "warm_top": self.warm_top,
+                "codec": self.codec.stats()}
+
+
+def _get_with_ttl(client, key: str) -> Tuple[Optional[bytes], int]:
+    """GET and TTL in one round trip"""
+    pipe = client.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.ttl(key)
+    value, remaining = pipe.execute()
+    return value, remaining
+
+
+def _ttls(client, keys: List[str]) -> List[int]:
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.ttl(key)
+    return pipe.execute()
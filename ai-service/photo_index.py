@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash index for near-duplicate pet photo detection
+64-bit dHash/pHash fingerprints searched with multi-index hashing over a memory-mapped store
+"""
+
+import os
+import io
+import json
+import time
+import fcntl
+import shutil
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is only needed to hash raw image bytes
+    Image = None
+
+HASH_BITS = 64
+NUM_BANDS = 4                      # 4 x 16-bit bands: pigeonhole bound for multi-index hashing
+BAND_BITS = HASH_BITS // NUM_BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+ID_DTYPE = "S64"                   # photo ids are stored fixed-width so the id column can be mmapped
+ID_MAX_BYTES = 64                  # UTF-8 bytes; longer ids would be truncated and could collide
+DEFAULT_FLUSH_THRESHOLD = 10_000
+
+# Per-byte popcount table used for vectorised Hamming distances
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _require_pillow():
+    if Image is None:
+        raise RuntimeError("Pillow is required for perceptual hashing (pip install Pillow)")
+
+
+def _load_grayscale(image_bytes: bytes, size: Tuple[int, int]) -> np.ndarray:
+    _require_pillow()
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img = img.convert("L").resize(size, Image.LANCZOS)
+        return np.asarray(img, dtype=np.float64)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def compute_dhash(image_bytes: bytes) -> int:
+    """Difference hash: sign of horizontal gradients on a 9x8 grayscale thumbnail."""
+    pixels = _load_grayscale(image_bytes, (9, 8))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+_DCT_SIZE = 32
+_DCT_MATRIX = np.cos(
+    np.pi * (2 * np.arange(_DCT_SIZE)[None, :] + 1) * np.arange(_DCT_SIZE)[:, None] / (2 * _DCT_SIZE)
+)
+
+
+def compute_phash(image_bytes: bytes) -> int:
+    """DCT hash: low-frequency 8x8 DCT coefficients compared against their median."""
+    pixels = _load_grayscale(image_bytes, (_DCT_SIZE, _DCT_SIZE))
+    dct = _DCT_MATRIX @ pixels @ _DCT_MATRIX.T
+    low = dct[:8, :8]
+    median = np.median(low.ravel()[1:])  # DC term skews the median
+    return _bits_to_int(low > median)
+
+
+def encode_photo_id(photo_id: str) -> bytes:
+    """Stored form of a photo id; raises ValueError for ids that do not fit the id column"""
+    encoded = photo_id.encode("utf-8")
+    if not encoded or len(encoded) > ID_MAX_BYTES or encoded.endswith(b"\x00"):
+        raise ValueError(f"photo_id must be 1-{ID_MAX_BYTES} bytes of UTF-8")
+    return encoded
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _popcount64(values: np.ndarray) -> np.ndarray:
+    return _POPCOUNT_TABLE[values.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.uint32)
+
+
+def _band(hash_value: int, band: int) -> int:
+    return (hash_value >> (band * BAND_BITS)) & BAND_MASK
+
+
+def _band_neighbours(key: int, radius: int) -> List[int]:
+    """All BAND_BITS-wide keys within `radius` bit flips of `key`."""
+    keys = [key]
+    frontier = [(key, -1)]
+    for _ in range(radius):
+        next_frontier = []
+        for value, last_bit in frontier:
+            for bit in range(last_bit + 1, BAND_BITS):
+                flipped = value ^ (1 << bit)
+                keys.append(flipped)
+                next_frontier.append((flipped, bit))
+        frontier = next_frontier
+    return keys
+
+
+class PhotoHashIndex:
+    """
+    Multi-index Hamming search over 64-bit perceptual hashes.
+
+    Each hash is split into NUM_BANDS bands; two hashes within distance r must
+    agree to within r // NUM_BANDS bits on at least one band, so a query only
+    probes a handful of band keys with a binary search each and verifies the
+    resulting candidates exactly. Flushed generations are plain .npy files
+    opened with mmap_mode="r", so every worker process shares the same pages.
+    Adds are buffered in memory until flush(); flushes from several processes
+    are serialised with a file lock and merged against the latest generation.
+    """
+
+    def __init__(self, path: str, flush_threshold: int = DEFAULT_FLUSH_THRESHOLD):
+        self.path = path
+        self.flush_threshold = flush_threshold
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush per process; the file lock orders processes
+        self._generation: Optional[str] = None
+        self._hashes: Optional[np.ndarray] = None
+        self._ids: Optional[np.ndarray] = None
+        self._band_keys: List[np.ndarray] = []
+        self._band_rows: List[np.ndarray] = []
+        self._pending_hashes: List[int] = []
+        self._pending_ids: List[bytes] = []
+        self._manifest_mtime = 0.0
+
+    # -- persistence -----------------------------------------------------
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, "manifest.json")
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def refresh(self) -> None:
+        """Re-open the current generation if another process flushed a newer one."""
+        try:
+            mtime = os.stat(self._manifest_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._manifest_mtime and self._hashes is not None:
+            return
+        manifest = self._read_manifest()
+        if not manifest or manifest["generation"] == self._generation:
+            self._manifest_mtime = mtime
+            return
+        self._open(manifest["generation"], mtime)
+
+    def _open(self, generation: str, mtime: float, flushed: int = 0) -> None:
+        """Switch to a generation; the first `flushed` pending hashes, now part of it, leave the buffer at once"""
+        gen_dir = os.path.join(self.path, generation)
+        hashes = np.load(os.path.join(gen_dir, "hashes.npy"), mmap_mode="r")
+        ids = np.load(os.path.join(gen_dir, "ids.npy"), mmap_mode="r")
+        band_keys = [np.load(os.path.join(gen_dir, f"band{b}_keys.npy"), mmap_mode="r") for b in range(NUM_BANDS)]
+        band_rows = [np.load(os.path.join(gen_dir, f"band{b}_rows.npy"), mmap_mode="r") for b in range(NUM_BANDS)]
+        with self._lock:
+            self._generation = generation
+            self._hashes, self._ids = hashes, ids
+            self._band_keys, self._band_rows = band_keys, band_rows
+            self._manifest_mtime = mtime
+            del self._pending_hashes[:flushed]
+            del self._pending_ids[:flushed]
+        logger.info(f"Photo hash index loaded generation {self._generation} ({len(hashes)} hashes)")
+
+    def flush(self) -> int:
+        """
+        Merge buffered hashes into a new on-disk generation; returns the total size.
+
+        Buffered hashes stay queryable, and stay buffered if the write fails,
+        until the new generation is open; adds made meanwhile wait for the next flush.
+        """
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        with self._lock:
+            new_hashes = np.array(self._pending_hashes, dtype=np.uint64)
+            new_ids = np.array(self._pending_ids, dtype=ID_DTYPE)
+        flushed = len(new_hashes)
+        if not flushed:
+            return len(self)
+
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._manifest_mtime = 0.0
+            self.refresh()
+            if self._hashes is not None:
+                new_hashes = np.concatenate([self._hashes, new_hashes])
+                new_ids = np.concatenate([self._ids, new_ids])
+
+            generation = f"gen-{time.time_ns()}"
+            gen_dir = os.path.join(self.path, generation)
+            os.makedirs(gen_dir)
+            np.save(os.path.join(gen_dir, "hashes.npy"), new_hashes)
+            np.save(os.path.join(gen_dir, "ids.npy"), new_ids)
+            for b in range(NUM_BANDS):
+                keys = ((new_hashes >> np.uint64(b * BAND_BITS)) & np.uint64(BAND_MASK)).astype(np.uint16)
+                order = np.argsort(keys, kind="stable").astype(np.uint32)
+                np.save(os.path.join(gen_dir, f"band{b}_keys.npy"), keys[order])
+                np.save(os.path.join(gen_dir, f"band{b}_rows.npy"), order)
+
+            tmp_manifest = self._manifest_path + ".tmp"
+            with open(tmp_manifest, "w") as f:
+                json.dump({"generation": generation, "count": int(len(new_hashes))}, f)
+            os.replace(tmp_manifest, self._manifest_path)
+            self._open(generation, os.stat(self._manifest_path).st_mtime, flushed)
+
+            # Open mmaps in other workers keep unlinked generations alive until they refresh
+            for entry in os.listdir(self.path):
+                if entry.startswith("gen-") and entry != generation:
+                    shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+        return len(self)
+
+    # -- queries ---------------------------------------------------------
+
+    def __len__(self) -> int:
+        flushed = len(self._hashes) if self._hashes is not None else 0
+        return flushed + len(self._pending_hashes)
+
+    def add(self, photo_id: str, phash: int) -> None:
+        # Validated before buffering: one bad id in the buffer would make every later flush fail
+        encoded = encode_photo_id(photo_id)
+        with self._lock:
+            self._pending_hashes.append(phash)
+            self._pending_ids.append(encoded)
+            should_flush = len(self._pending_hashes) >= self.flush_threshold
+        if should_flush:
+            self.flush()
+
+    def query(self, phash: int, max_distance: int = 7, limit: int = 10) -> List[Tuple[str, int]]:
+        """Return up to `limit` (photo_id, distance) pairs within `max_distance`, closest first."""
+        self.refresh()
+        matches: List[Tuple[str, int]] = []
+
+        with self._lock:
+            hashes, ids = self._hashes, self._ids
+            band_keys, band_rows = self._band_keys, self._band_rows
+            pending = list(zip(self._pending_ids, self._pending_hashes))
+
+        if hashes is not None and len(hashes):
+            band_radius = max_distance // NUM_BANDS
+            candidates = []
+            for b in range(NUM_BANDS):
+                keys, rows = band_keys[b], band_rows[b]
+                # Probes must share the keys' dtype or searchsorted copies the whole column
+                probes = np.array(_band_neighbours(_band(phash, b), band_radius), dtype=keys.dtype)
+                los = np.searchsorted(keys, probes, side="left")
+                counts = np.searchsorted(keys, probes, side="right") - los
+                total = int(counts.sum())
+                if total:
+                    # Gather every matching slice in one fancy-index instead of per-probe slicing
+                    starts = np.repeat(los - np.cumsum(counts) + counts, counts)
+                    candidates.append(rows[starts + np.arange(total)])
+            if candidates:
+                rows = np.unique(np.concatenate(candidates))
+                distances = _popcount64(hashes[rows] ^ np.uint64(phash))
+                hit = distances <= max_distance
+                for row, distance in zip(rows[hit], distances[hit]):
+                    matches.append((ids[row].decode("utf-8"), int(distance)))
+
+        # Unflushed adds are bounded by flush_threshold, so a direct scan is cheap
+        for photo_id, pending_hash in pending:
+            distance = hamming_distance(phash, pending_hash)
+            if distance <= max_distance:
+                matches.append((photo_id.decode("utf-8"), distance))
+
+        matches.sort(key=lambda m: m[1])
+        return matches[:limit]
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Built-in sampling profiler for the PawfectMatch AI service
+Opt-in stack sampling with flamegraph-compatible collapsed output and slow-request capture
+"""
+
+import os
+import sys
+import hmac
+import time
+import threading
+import logging
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 64
+
+# Frame-label substrings attributing samples to the usual suspects of a slow request
+HOTSPOT_PATTERNS = {
+    "compatibility_scoring": ("calculate_advanced_compatibility",),
+    "json_serialization": ("jsonable_encoder", "serialize_response", "dumps(", "encode(encoder.py", "render("),
+    "pydantic_validation": ("request_body_to_args", "validate(", "model_validate", "__init__(main.py"),
+    "cache_io": ("get_cached_response", "set_cached_response", "execute_command("),
+    "upstream_llm": ("(llm_backends.py",),
+}
+IDLE_LEAVES = ("select(selectors.py", "wait(threading.py", "_worker(thread.py")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # ';' separates frames in collapsed stacks and ' ' precedes the count
+    return f"{code.co_name}({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":").replace(" ", "_")
+
+
+def _walk_stack(frame) -> Tuple[str, ...]:
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()  # Collapsed format is root-first
+    return tuple(stack)
+
+
+def collapse(samples) -> str:
+    """Render (thread_name, stack) samples as 'root;...;leaf count' lines (flamegraph.pl / speedscope)."""
+    counts = Counter((thread_name,) + stack for _, thread_name, stack in samples)
+    return "\n".join(f"{';'.join(stack)} {count}" for stack, count in counts.most_common())
+
+
+def hotspots(samples) -> Dict[str, float]:
+    """Share of non-idle samples whose stack contains each HOTSPOT_PATTERNS category."""
+    busy = [stack for _, _, stack in samples if stack and not stack[-1].startswith(IDLE_LEAVES)]
+    if not busy:
+        return {}
+    shares = {}
+    for category, patterns in HOTSPOT_PATTERNS.items():
+        hits = sum(1 for stack in busy if any(p in frame for frame in stack for p in patterns))
+        shares[category] = round(hits / len(busy), 3)
+    shares["busy_samples"] = len(busy)
+    return shares
+
+
+class StackSampler:
+    """
+    Periodically snapshots every thread's Python stack via sys._current_frames().
+
+    Samples land in a bounded ring buffer of (timestamp, thread_name, stack) so
+    callers can cut out any time window, e.g. the lifetime of a slow request.
+    """
+
+    def __init__(self, interval: float = 0.005, max_samples: int = 50_000):
+        self.interval = interval
+        self.samples: Deque[Tuple[float, str, Tuple[str, ...]]] = deque(maxlen=max_samples)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._deadline: Optional[float] = None
+        self._resume_interval: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: Optional[float] = None, resume_interval: Optional[float] = None) -> None:
+        """Sample until stopped, or for `duration` seconds and then at resume_interval (if given) until stopped"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._deadline = time.monotonic() + duration if duration else None
+        self._resume_interval = resume_interval
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                if self._resume_interval is None:
+                    break
+                self.interval, self._deadline = self._resume_interval, None
+            now = time.monotonic()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples.append((now, names.get(thread_id, str(thread_id)), _walk_stack(frame)))
+
+    def window(self, start: float, end: float) -> List[Tuple[float, str, Tuple[str, ...]]]:
+        return [sample for sample in list(self.samples) if start <= sample[0] <= end]
+
+
+class ServiceProfiler:
+    """
+    Admin-controlled profiling sessions plus automatic slow-request capture.
+
+    Disabled unless AI_PROFILER_ENABLED=1. Manual sessions are capped at
+    max_session_seconds and may start at most once per min_session_interval.
+    Slow-request capture (AI_SLOW_REQUEST_MS > 0) keeps a low-rate background
+    sampler running and stores at most max_captures_per_minute captures.
+    """
+
+    def __init__(self, enabled: bool = False, admin_token: str = "", slow_request_ms: float = 0,
+                 session_interval: float = 0.005, background_interval: float = 0.01,
+                 max_session_seconds: float = 60, min_session_interval: float = 60,
+                 max_captures_per_minute: int = 10, max_captures: int = 50):
+        self.enabled = enabled
+        self.admin_token = admin_token
+        self.slow_request_seconds = slow_request_ms / 1000.0
+        self.session_interval = session_interval
+        self.background_interval = background_interval
+        self.max_session_seconds = max_session_seconds
+        self.min_session_interval = min_session_interval
+        self.max_captures_per_minute = max_captures_per_minute
+        self.sampler = StackSampler(interval=background_interval)
+        self.session_started: Optional[float] = None
+        self.session_ends: Optional[float] = None
+        self._last_session_start = float("-inf")
+        self.slow_captures: Deque[Dict] = deque(maxlen=max_captures)
+        self._capture_times: Deque[float] = deque()
+
+    @classmethod
+    def from_env(cls) -> "ServiceProfiler":
+        return cls(
+            enabled=os.getenv("AI_PROFILER_ENABLED", "0") == "1",
+            admin_token=os.getenv("AI_ADMIN_TOKEN", ""),
+            slow_request_ms=float(os.getenv("AI_SLOW_REQUEST_MS", "0")),
+        )
+
+    @property
+    def captures_slow_requests(self) -> bool:
+        return self.enabled and self.slow_request_seconds > 0
+
+    def authorize(self, token: Optional[str]) -> bool:
+        return self.enabled and bool(self.admin_token) and token is not None and \
+            hmac.compare_digest(token.encode(), self.admin_token.encode())
+
+    # -- manual sessions -------------------------------------------------
+
+    def start_session(self, duration: float) -> Dict:
+        now = time.monotonic()
+        if self.session_started is not None and now < self.session_ends:
+            raise RuntimeError("A profiling session is already running")
+        if now - self._last_session_start < self.min_session_interval:
+            retry = self.min_session_interval - (now - self._last_session_start)
+            raise RuntimeError(f"Profiling sessions are rate-limited; retry in {retry:.0f}s")
+        duration = min(duration, self.max_session_seconds)
+        self._last_session_start = now
+        self.session_started = now
+        self.session_ends = now + duration
+        self.sampler.stop()
+        self.sampler.samples.clear()
+        self.sampler.interval = self.session_interval
+        # A session that runs out on its own hands the sampler back to slow-request capture
+        self.sampler.start(duration, resume_interval=self.background_interval if self.captures_slow_requests else None)
+        return {"duration_seconds": duration, "interval_seconds": self.session_interval}
+
+    def stop_session(self) -> str:
+        """Stop the manual session and return its collapsed stacks."""
+        started, ends = self.session_started, self.session_ends
+        self.session_started = self.session_ends = None
+        self.sampler.stop()
+        collapsed = collapse(self.sampler.window(started, min(ends, time.monotonic()))) if started is not None else ""
+        self.sampler.interval = self.background_interval
+        if self.captures_slow_requests:
+            self.sampler.start()
+        return collapsed
+
+    def session_stacks(self) -> str:
+        if self.session_started is None:
+            return ""
+        return collapse(self.sampler.window(self.session_started, min(self.session_ends, time.monotonic())))
+
+    # -- slow-request capture --------------------------------------------
+
+    def start_background(self) -> None:
+        if self.captures_slow_requests:
+            self.sampler.start()
+            logger.info(f"Slow-request capture enabled (> {self.slow_request_seconds * 1000:.0f} ms)")
+
+    def record_request(self, route: str, started: float, finished: float) -> None:
+        duration = finished - started
+        if not self.captures_slow_requests or duration < self.slow_request_seconds:
+            return
+        while self._capture_times and finished - self._capture_times[0] > 60:
+            self._capture_times.popleft()
+        if len(self._capture_times) >= self.max_captures_per_minute:
+            return
+        self._capture_times.append(finished)
+        # Concurrent requests share the loop thread, so the window may include their frames too
+        samples = self.sampler.window(started, finished)
+        self.slow_captures.append({
+            "route": route,
+            "duration_ms": round(duration * 1000, 1),
+            "captured_at": time.time(),
+            "hotspots": hotspots(samples),
+            "collapsed": collapse(samples),
+        })
+
+
+class SlowRequestMiddleware:
+    """Pure ASGI middleware feeding request timings to ServiceProfiler.record_request."""
+
+    def __init__(self, app, profiler: ServiceProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.captures_slow_requests:
+            await self.app(scope, receive, send)
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.record_request(scope["path"], started, time.monotonic())
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Prompt templates for the DeepSeek endpoints
+Templates are compiled once, share one system prefix for upstream prefix caching and are held to a token budget
+"""
+
+import os
+import re
+import string
+import logging
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from metrics import REGISTRY
+
+try:
+    import tiktoken
+except ImportError:  # optional exact tokenizer; the estimate below is within ~10% for English prompts
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Encoding used to count tokens when tiktoken is installed; "heuristic" always uses the estimate
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "cl100k_base")
+# Default ceiling on estimated prompt tokens; variable fields are trimmed to fit
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1200))
+
+# Chat formats add a few tokens per message for role and separators
+MESSAGE_OVERHEAD = 4
+TRIM_MARKER = "…"
+
+TOKEN_BUCKETS = (50, 100, 200, 300, 400, 500, 750, 1000, 1500, 2000, 4000)
+PROMPT_TOKENS = REGISTRY.histogram("llm_prompt_tokens_estimated", "Estimated prompt tokens per rendered prompt",
+                                   ("operation",), buckets=TOKEN_BUCKETS)
+PROMPT_TRIMMED = REGISTRY.counter("llm_prompts_trimmed_total", "Prompts trimmed to fit their token budget",
+                                  ("operation",))
+
+# Words, 1-3 digit groups and single symbols: roughly how BPE vocabularies split English text
+_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def _piece_tokens(piece: str) -> int:
+    # Common words are one token; long words split into ~6-character pieces
+    return (len(piece) + 5) // 6 if piece[0].isalpha() else 1
+
+
+class TokenCounter:
+    """
+    Counts and truncates text in tokens.
+
+    Uses tiktoken's encoding when it is installed and the encoding can be
+    loaded (it is fetched once and cached on disk), otherwise a regex
+    estimate. DeepSeek's tokenizer is not public, so either way this is an
+    estimate for budgeting; upstream usage is recorded separately.
+    """
+
+    def __init__(self, encoding_name: str = PROMPT_TOKENIZER):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._loaded = False
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if tiktoken is None or self.encoding_name == "heuristic":
+            return
+        try:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        except Exception as e:
+            logger.warning(f"Tokenizer {self.encoding_name} unavailable, estimating prompt tokens: {e}")
+
+    @property
+    def exact(self) -> bool:
+        self.load()
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        self.load()
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return sum(_piece_tokens(match.group()) for match in _PIECES.finditer(text))
+
+    def truncate(self, text: str, tokens: int) -> str:
+        """Longest prefix of text within `tokens` tokens, marked with an ellipsis when cut"""
+        if tokens <= 0:
+            return ""
+        self.load()
+        if self._encoding is not None:
+            encoded = self._encoding.encode(text)
+            if len(encoded) <= tokens:
+                return text
+            return self._encoding.decode(encoded[:tokens - 1]).rstrip() + TRIM_MARKER
+        used, end = 0, 0
+        for match in _PIECES.finditer(text):
+            used += _piece_tokens(match.group())
+            if used > tokens - 1:
+                return text[:end].rstrip() + TRIM_MARKER
+            end = match.end()
+        return text
+
+
+TOKENIZER = TokenCounter()
+
+
+class Prompt(NamedTuple):
+    messages: List[Dict[str, str]]
+    tokens: int
+    trimmed: bool
+
+
+class PromptTemplate:
+    """
+    A system role plus a user template with {field} placeholders.
+
+    The template is parsed once into literal and field segments. The system
+    message and the literal text are tokenized on first use and reused, so
+    rendering only counts the field values. Templates put their fixed
+    instructions before the per-request details: together with the shared
+    SYSTEM_PREFIX this keeps the longest possible prefix byte-identical
+    across requests, which is what upstream context caching matches on.
+
+    When the estimate exceeds the budget, the fields named in `trim` are
+    shortened in that order until the prompt fits. Other fields and the
+    instructions are never cut, so a prompt can still end up over budget;
+    that is logged rather than failing the request.
+    """
+
+    def __init__(self, operation: str, role: str, template: str, max_tokens: int,
+                 budget: Optional[int] = None, trim: Sequence[str] = ()):
+        self.operation = operation
+        self.system = f"{SYSTEM_PREFIX}\n\n{role}"
+        self.max_tokens = max_tokens
+        self.budget = budget if budget is not None else PROMPT_TOKEN_BUDGET
+        self.trim = tuple(trim)
+        self._segments: List[Tuple[str, Optional[str]]] = [
+            (literal, field) for literal, field, _, _ in string.Formatter().parse(template)
+        ]
+        self.fields = tuple(field for _, field in self._segments if field is not None)
+        unknown = set(self.trim) - set(self.fields)
+        if unknown:
+            raise ValueError(f"{operation}: trim fields {sorted(unknown)} are not in the template")
+        self._static_tokens: Optional[int] = None
+
+    @property
+    def static_tokens(self) -> int:
+        """Tokens of the system message, the literal template text and message overhead"""
+        if self._static_tokens is None:
+            literal = "".join(literal for literal, _ in self._segments)
+            self._static_tokens = TOKENIZER.count(self.system) + TOKENIZER.count(literal) + 2 * MESSAGE_OVERHEAD
+        return self._static_tokens
+
+    def render(self, **values: str) -> Prompt:
+        prompt = self.build(**values)
+        self.observe(prompt)
+        return prompt
+
+    def build(self, **values: str) -> Prompt:
+        """Render without recording metrics, e.g. to derive a cache key for a prompt that may never be sent"""
+        values = {field: str(values[field]) for field in self.fields}
+        field_tokens = {field: TOKENIZER.count(value) for field, value in values.items()}
+        tokens = self.static_tokens + sum(field_tokens[field] for field in self.fields)
+        trimmed = False
+        for field in self.trim:
+            excess = tokens - self.budget
+            if excess <= 0:
+                break
+            keep = max(0, field_tokens[field] - excess)
+            values[field] = TOKENIZER.truncate(values[field], keep)
+            shortened = TOKENIZER.count(values[field])
+            # A field may appear more than once in the template
+            tokens -= (field_tokens[field] - shortened) * self.fields.count(field)
+            field_tokens[field] = shortened
+            trimmed = True
+        if tokens > self.budget:
+            logger.warning(f"{self.operation} prompt is {tokens} tokens after trimming, budget {self.budget}")
+
+        user = "".join(literal + (values[field] if field is not None else "") for literal, field in self._segments)
+        messages = [{"role": "system", "content": self.system}, {"role": "user", "content": user}]
+        return Prompt(messages, tokens, trimmed)
+
+    def observe(self, prompt: Prompt) -> None:
+        """Record a prompt that is being sent upstream"""
+        if prompt.trimmed:
+            PROMPT_TRIMMED.inc(self.operation)
+        PROMPT_TOKENS.observe(prompt.tokens, self.operation)
+
+    def describe(self) -> Dict[str, object]:
+        return {"static_tokens": self.static_tokens, "budget": self.budget, "max_tokens": self.max_tokens,
+                "trim": list(self.trim)}
+
+
+# Identical leading text for every endpoint's system message
+SYSTEM_PREFIX = (
+    "You are the AI assistant of PawfectMatch, a platform that helps pets find adopters, playmates and "
+    "compatible companions. You write for pet owners and adopters: be warm, accurate and practical, base what "
+    "you say on the details provided, and do not invent medical facts."
+)
+
+BIO_ROLE = ("You are an expert pet bio writer who creates compelling, heartwarming descriptions that help pets "
+            "find their perfect matches.")
+
+BIO = PromptTemplate("generate_bio", BIO_ROLE, """\
+Create an engaging and heartwarming bio for a pet adoption/matching profile.
+
+Requirements:
+1. Make it warm, engaging, and authentic
+2. Highlight the pet's unique personality
+3. Include what kind of home/companion they're looking for
+4. Use the requested tone throughout
+5. Keep to the requested length (short=50-80 words, medium=80-120 words, long=120-180 words)
+6. Follow the closing instruction below
+
+Write only the bio text, no additional commentary.
+
+Pet Details:
+- Name: {name}
+- Species: {species}
+- Breed: {breed}
+- Age: {age} years old
+- Size: {size}
+- Personality: {personality}
+
+Tone: {tone}
+Length: {length}
+Closing: {closing}""", max_tokens=300, trim=("personality", "name", "breed"))
+
+# Several pets per upstream call; max_tokens is per pet and the packer keeps the pet list within the budget
+BIO_BATCH = PromptTemplate("generate_bio_batch", BIO_ROLE, """\
+Write a bio for each pet listed below for a pet adoption/matching profile.
+
+Requirements for every bio:
+1. Make it warm, engaging, and authentic
+2. Highlight the pet's unique personality
+3. Include what kind of home/companion they're looking for
+4. Use the requested tone throughout
+5. Keep to the requested length (short=50-80 words, medium=80-120 words, long=120-180 words)
+6. Follow the closing instruction below
+7. Write each bio on its own, without mentioning the other pets
+
+Return only a JSON object that maps each pet's id to its bio text, for example {{"pet-1": "Meet ..."}}, \
+with exactly one entry per pet and no other keys or commentary.
+
+Tone: {tone}
+Length: {length}
+Closing: {closing}
+
+Pets ({count}, one JSON object per line):
+{pets}""", max_tokens=300, budget=2 * PROMPT_TOKEN_BUDGET)
+
+PHOTO_ANALYSIS = PromptTemplate("analyze_photo", "You are a professional veterinarian and animal behaviorist with "
+                                "expertise in pet personality assessment and breed characteristics.", """\
+As a veterinary expert and animal behaviorist, analyze what you can determine about a pet from their photo context and provide insights.
+
+Based on typical characteristics and the context provided, please analyze:
+
+1. Likely personality traits
+2. Care requirements
+3. Compatibility with families/other pets
+4. Exercise and activity needs
+5. Any notable characteristics
+
+Provide a professional but friendly analysis that would help potential adopters or playdate partners understand this pet better.
+
+Format your response as a structured analysis focusing on practical insights.
+
+Photo URL: {photo_url}
+Pet Name: {pet_name}
+Known Breed: {known_breed}""", max_tokens=400, trim=("photo_url", "pet_name", "known_breed"))
+
+COMPATIBILITY = PromptTemplate("compatibility", "You are an expert animal behaviorist with 15+ years of experience "
+                               "in pet compatibility assessment and behavioral analysis.", """\
+As a certified animal behaviorist, provide detailed analysis for these pets' compatibility.
+
+Based on the compatibility score given below, provide:
+1. Professional assessment of their compatibility
+2. Specific introduction strategies
+3. Long-term relationship predictions
+4. Important considerations for owners
+
+Keep response concise but professional.
+
+Pet 1 - {name1}:
+- Species: {species1}, Breed: {breed1}
+- Age: {age1} years, Size: {size1}
+- Personality: {personality1}
+- Activity Level: {activity1}
+
+Pet 2 - {name2}:
+- Species: {species2}, Breed: {breed2}
+- Age: {age2} years, Size: {size2}
+- Personality: {personality2}
+- Activity Level: {activity2}
+
+Interaction Type: {interaction_type}
+Compatibility Score: {score}%""", max_tokens=400, trim=("personality1", "personality2", "name1", "name2"))
+
+PROFILE_SUGGESTIONS = PromptTemplate("suggest_improvements", "You are an expert pet adoption consultant who helps "
+                                     "optimize profiles for maximum appeal and successful matches.", """\
+As a pet adoption specialist, review this pet profile and suggest improvements to make it more appealing and effective.
+
+Please provide specific, actionable suggestions for:
+1. Bio improvements (tone, content, structure)
+2. Additional personality tags that might be missing
+3. Photo recommendations
+4. Profile completeness assessment
+5. Appeal optimization for target audience
+
+Focus on making the profile more engaging and likely to result in successful matches.
+
+Pet Profile:
+- Name: {name}
+- Species: {species}
+- Breed: {breed}
+- Age: {age} years
+- Size: {size}
+- Personality Tags: {personality}
+- Current Bio: {current_bio}""", max_tokens=400, trim=("current_bio", "personality", "name"))
+
+TEMPLATES = {template.operation: template
+             for template in (BIO, BIO_BATCH, PHOTO_ANALYSIS, COMPATIBILITY, PROFILE_SUGGESTIONS)}
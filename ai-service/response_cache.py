@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Response-level cache for the PawfectMatch AI services
+Stores final encoded HTTP bodies (compressed when large) keyed on normalized request inputs
+"""
+
+import gzip
+import asyncio
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Optional, Type
+
+from fastapi import Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response
+from pydantic import BaseModel, ValidationError
+
+import fast_json
+from cache_codec import GZIP, RAW, CacheCodec
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_REQUESTS = REGISTRY.counter("ai_response_cache_requests_total",
+                                           "Encoded response cache lookups by operation and result",
+                                           ("operation", "result"))
+
+# One-byte envelope of entries written before the cache codec, still readable until they expire
+_IDENTITY = b"\x00"
+_GZIP = b"\x01"
+
+# Sent with every response of a cached route: the same URL is served gzipped or not by Accept-Encoding
+VARY_HEADERS = {"Vary": "Accept-Encoding"}
+
+
+def normalize(value: Any) -> Any:
+    """
+    Canonical form of request inputs for cache keys.
+
+    Strings are stripped and lists of strings sorted, so requests differing
+    only in whitespace or tag order share an entry. Explicit nulls are kept:
+    a field sent as null need not mean the same as one left out.
+    """
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, list):
+        items = [normalize(v) for v in value]
+        return sorted(items) if all(isinstance(v, str) for v in items) else items
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip; q=0 refuses a coding and * stands for unlisted ones"""
+    wildcard = False
+    for item in accept_encoding.split(","):
+        coding, *params = item.split(";")
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        coding = coding.strip().lower()
+        if coding in ("gzip", "x-gzip"):
+            return q > 0
+        if coding == "*":
+            wildcard = q > 0
+    return wildcard
+
+
+async def read_json(request: Request) -> Any:
+    """Parse the request body with the fast decoder, reporting bad JSON like FastAPI does"""
+    try:
+        return fast_json.loads(await request.body())
+    except ValueError as e:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body", 0), "msg": "JSON decode error",
+                                       "input": {}, "ctx": {"error": str(e)}}])
+
+
+def validate_body(model: Type[BaseModel], data: Any) -> BaseModel:
+    """Validate a parsed body on the cache-miss path; errors become the usual 422 response"""
+    try:
+        return model.model_validate(data)
+    except ValidationError as e:
+        raise RequestValidationError([{**error, "loc": ("body",) + tuple(error["loc"])} for error in e.errors()])
+
+
+def request_body_openapi(model: Type[BaseModel]) -> Dict:
+    """openapi_extra documenting the JSON body of endpoints that read the raw request"""
+    schema = model.model_json_schema(ref_template="#/components/schemas/{model}")
+    schema.pop("$defs", None)
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+
+class ResponseCache:
+    """
+    Redis-backed cache of complete JSON response bodies.
+
+    Entries are the exact bytes sent to clients in a cache_codec envelope.
+    With the default gzip codec, bodies of at least compress_min_bytes are
+    stored gzipped and served with Content-Encoding: gzip to clients that
+    accept it, so a hit is one GET plus a socket write. Other codecs store
+    less but decompress on every hit. The client getter is called on every
+    access because the Redis client is connected (or injected) after
+    import; it must not decode responses.
+    """
+
+    def __init__(self, client_getter: Callable[[], Any], namespace: str, ttl: int = 3600,
+                 compress_min_bytes: int = 512, codec: Optional[CacheCodec] = None):
+        self.client_getter = client_getter
+        self.namespace = namespace
+        self.ttl = ttl
+        self.codec = codec or CacheCodec(namespace, "gzip", min_bytes=compress_min_bytes)
+
+    def key(self, operation: str, inputs: Any) -> str:
+        digest = hashlib.md5(fast_json.dumps(normalize(inputs))).hexdigest()
+        return f"{self.namespace}:{operation}:{digest}"
+
+    async def get(self, key: str, operation: str) -> Optional[bytes]:
+        client = self.client_getter()
+        if client is None:
+            return None
+        try:
+            entry = await asyncio.get_event_loop().run_in_executor(None, client.get, key)
+        except Exception as e:
+            logger.warning(f"Response cache retrieval error: {e}")
+            entry = None
+        RESPONSE_CACHE_REQUESTS.inc(operation, "hit" if entry else "miss")
+        return entry or None
+
+    async def set(self, key: str, body: bytes, ttl: Optional[int] = None) -> None:
+        client = self.client_getter()
+        if client is None:
+            return
+        entry = self.codec.encode(body)
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, client.setex, key, ttl or self.ttl, entry)
+        except Exception as e:
+            logger.warning(f"Response cache storage error: {e}")
+
+    def respond(self, entry: bytes, request: Request) -> Optional[Response]:
+        """
+        Turn a stored entry into a response without touching the JSON inside it.
+
+        None when the entry cannot be decoded here (e.g. its dictionary was
+        retired); callers treat that as a miss.
+        """
+        codec, _, payload = self.codec.unpack(entry)
+        if codec is None:
+            if entry[:1] not in (_IDENTITY, _GZIP):  # an envelope this version cannot read
+                return None
+            codec, payload = (GZIP if entry[:1] == _GZIP else RAW), entry[1:]
+        if codec == GZIP:
+            if accepts_gzip(request.headers.get("accept-encoding", "")):
+                return Response(content=payload, media_type=fast_json.JSON_MEDIA_TYPE,
+                                headers={"Content-Encoding": "gzip", **VARY_HEADERS})
+            try:
+                body = gzip.decompress(payload)
+            except (OSError, EOFError) as e:
+                logger.warning(f"Undecodable response cache entry: {e}")
+                return None
+        elif codec == RAW:
+            body = payload
+        else:
+            body = self.codec.decode(entry)
+            if body is None:
+                return None
+        return Response(content=body, media_type=fast_json.JSON_MEDIA_TYPE, headers=VARY_HEADERS)
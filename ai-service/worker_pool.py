@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Process pool for CPU-bound compatibility scoring
+Workers memory-map read-only feature tables once instead of receiving them with every task
+"""
+
+import os
+import shutil
+import asyncio
+import logging
+import tempfile
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import compatibility
+from compatibility import BreedTable, PetRecord, PetTraits
+from lazy_imports import lazy_import
+from metrics import REGISTRY
+
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+POOL_PENDING = REGISTRY.gauge("scoring_pool_pending_batches", "Scoring batches queued or running in the process pool")
+POOL_WAITING = REGISTRY.gauge("scoring_pool_waiting_batches", "Scoring batches waiting for a free pool slot")
+POOL_REJECTED = REGISTRY.counter("scoring_pool_rejected_total", "Scoring batches rejected because the pool queue was full")
+
+
+class PoolSaturated(RuntimeError):
+    """Raised instead of queueing once the pool's backlog limit is reached"""
+
+
+def pool_size(setting: str) -> int:
+    """'auto' leaves one CPU for the event loop and uses the rest; otherwise an explicit worker count"""
+    if setting.strip().lower() == "auto":
+        return max(1, (os.cpu_count() or 1) - 1)
+    return max(0, int(setting))
+
+
+def publish_arrays(directory: str, arrays: Dict[str, "np.ndarray"]) -> Dict[str, str]:
+    """Write arrays as .npy files that any process can open with mmap_mode='r'"""
+    paths = {}
+    for name, array in arrays.items():
+        paths[name] = os.path.join(directory, f"{name}.npy")
+        np.save(paths[name], np.ascontiguousarray(array))
+    return paths
+
+
+def attach_arrays(paths: Dict[str, str]) -> Dict[str, "np.ndarray"]:
+    return {name: np.load(path, mmap_mode="r") for name, path in paths.items()}
+
+
+# Per-worker state, set once by the pool initializer
+_worker_breed_table: Optional[BreedTable] = None
+
+
+def _init_worker(breed_keys: List[str], breed_paths: Dict[str, str]) -> None:
+    global _worker_breed_table
+    arrays = attach_arrays(breed_paths)
+    _worker_breed_table = BreedTable(breed_keys, arrays["energy"], arrays["temperament"])
+
+
+def _score_in_worker(pairs: List[Tuple[PetTraits, PetTraits]]) -> List[Dict[str, Any]]:
+    records = [(PetRecord.from_traits(pet1), PetRecord.from_traits(pet2)) for pet1, pet2 in pairs]
+    return compatibility.score_batch_vectorized(records, _worker_breed_table)
+
+
+class ScoringPool:
+    """
+    Scores compatibility batches in worker processes.
+
+    The breed feature table is published once as .npy files on tmpfs and
+    memory-mapped read-only by every worker at start-up, so tasks carry only
+    the pairs being scored. Workers use the spawn start method: the service
+    forks after uvicorn and executor threads exist, which is unsafe.
+
+    Backpressure: at most workers * queue_depth batches are dispatched at a
+    time; further batches wait for a slot, and once max_waiting are already
+    waiting score() raises PoolSaturated rather than growing the backlog.
+    """
+
+    def __init__(self, breed_knowledge: Dict, workers: int, queue_depth: int = 2,
+                 max_waiting: Optional[int] = None):
+        table = BreedTable.from_knowledge(breed_knowledge)
+        tmpfs = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        self._directory = tempfile.mkdtemp(prefix="pawfect-scoring-", dir=tmpfs)
+        # Removed on close(), or at exit if the pool is never closed
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self._directory, True)
+        paths = publish_arrays(self._directory, table.arrays())
+        self.workers = workers
+        self.max_in_flight = workers * queue_depth
+        self.max_waiting = max_waiting if max_waiting is not None else self.max_in_flight * 4
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._waiting = 0
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(table.keys, paths)
+        )
+        logger.info(f"Scoring pool started: {workers} workers, {self.max_in_flight} batches in flight")
+
+    async def score(self, pairs: Sequence[Tuple[PetRecord, PetRecord]]) -> List[Dict[str, Any]]:
+        if self._slots.locked() and self._waiting >= self.max_waiting:
+            POOL_REJECTED.inc()
+            raise PoolSaturated("Scoring pool is saturated, retry shortly")
+        self._waiting += 1
+        POOL_WAITING.inc()
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+            POOL_WAITING.dec()
+        POOL_PENDING.inc()
+        try:
+            # Record codes are process-local, so pairs cross to the worker as PetTraits
+            tasks = [(pet1.traits(), pet2.traits()) for pet1, pet2 in pairs]
+            return await asyncio.get_running_loop().run_in_executor(self._executor, _score_in_worker, tasks)
+        finally:
+            POOL_PENDING.dec()
+            self._slots.release()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._cleanup()
